@@ -1,11 +1,20 @@
 import os
 from flask import Flask, g, current_app, flash
 from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, ConfigurationError
 from dotenv import load_dotenv
 import pytz
 import logging
 from datetime import datetime
+from .rollups import ROLLUP_COLLECTION_NAME
+from .indexes import ensure_indexes, CHECKS_COLLECTION_NAME
+from .db import MongoConnectionManager, settings_from_env
+from .reminders import start_reminder_scheduler
+from .writebehind import WriteBehindQueue
+from .archive import CheckArchive
+from .pricing import create_price_table, PriceConfigError
+from .live import LiveCounters
+from .stations import validate_station_id, STATION_REPORT_MODES
+from . import metrics
 
 # Load environment variables from .env file
 load_dotenv()
@@ -18,104 +27,188 @@ logger = logging.getLogger(__name__)
 IST = pytz.timezone('Asia/Kolkata')
 UTC = pytz.utc
 
-def create_app():
-    """Creates and configures the Flask application."""
+def create_app(test_config=None):
+    """Creates and configures the Flask application. test_config overrides settings (tests, benchmarks)."""
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY=os.getenv('SECRET_KEY', 'dev_secret_key'),
-        DEBUG=os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
+        DEBUG=os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't'),
+        # Serve /reports from the pre-aggregated daily rollups instead of scanning pollution_checks.
+        # Off by default: run `flask rollups rebuild` once to backfill existing data, then enable it.
+        USE_REPORT_ROLLUPS=os.getenv('USE_REPORT_ROLLUPS', 'False').lower() in ('true', '1', 't'),
+        # 'svg' renders charts in pure Python; 'matplotlib' needs the optional matplotlib package
+        CHART_BACKEND=os.getenv('CHART_BACKEND', 'svg').lower(),
+        # Create the indexes listed in app/indexes.py when the app starts (idempotent)
+        ENSURE_INDEXES_ON_STARTUP=os.getenv('ENSURE_INDEXES_ON_STARTUP', 'True').lower() in ('true', '1', 't'),
+        # Explain report queries before running them and warn in the logs on COLLSCAN
+        QUERY_DIAGNOSTICS=os.getenv('QUERY_DIAGNOSTICS', 'False').lower() in ('true', '1', 't'),
+        # Documents per insert_many call for `flask checks import`
+        IMPORT_BATCH_SIZE=int(os.getenv('IMPORT_BATCH_SIZE', '1000')),
+        # Documents fetched per cursor round-trip when streaming /reports/export
+        EXPORT_BATCH_SIZE=int(os.getenv('EXPORT_BATCH_SIZE', '5000')),
+        # Expiry reminders: look-ahead window, batch size and in-process schedule (0 = disabled)
+        REMINDER_DAYS_AHEAD=int(os.getenv('REMINDER_DAYS_AHEAD', '7')),
+        REMINDER_BATCH_SIZE=int(os.getenv('REMINDER_BATCH_SIZE', '500')),
+        REMINDER_SCAN_INTERVAL_MINUTES=int(os.getenv('REMINDER_SCAN_INTERVAL_MINUTES', '0')),
+        # Add a Server-Timing header (mongo/chart/template/total) to dashboard responses
+        SERVER_TIMING=os.getenv('SERVER_TIMING', 'False').lower() in ('true', '1', 't'),
+        # Upper bound for the MongoDB ping behind /healthz
+        HEALTHZ_TIMEOUT_SECONDS=float(os.getenv('HEALTHZ_TIMEOUT_SECONDS', '1.0')),
+        # Write-behind mode: dashboard1 journals checks to local disk and a background worker
+        # inserts them in batches. The journal directory must be on persistent local storage.
+        WRITE_BEHIND=os.getenv('WRITE_BEHIND', 'False').lower() in ('true', '1', 't'),
+        WRITE_BEHIND_JOURNAL_DIR=os.getenv('WRITE_BEHIND_JOURNAL_DIR') or None, # Default: instance/journal
+        WRITE_BEHIND_MAX_BATCH=int(os.getenv('WRITE_BEHIND_MAX_BATCH', '500')),
+        WRITE_BEHIND_MAX_DELAY_MS=int(os.getenv('WRITE_BEHIND_MAX_DELAY_MS', '200')),
+        # Layout of newly written checks: 1 (original) or 2 (compact, see app/schema.py).
+        # Reads handle both, so this can be switched before or after `flask checks migrate-schema`.
+        CHECK_SCHEMA_VERSION=int(os.getenv('CHECK_SCHEMA_VERSION', '1')),
+        # Schema 2 only: False leaves the expiry date out of new checks (derived on read).
+        # Expiry reminders only scan checks with a stored expiry date.
+        CHECK_STORE_EXPIRY=os.getenv('CHECK_STORE_EXPIRY', 'True').lower() in ('true', '1', 't'),
+        # Cold archive of closed months (`flask archive run`): directory for the per-month files,
+        # months kept in MongoDB, and memory for archived months loaded by reports (per worker)
+        ARCHIVE_DIR=os.getenv('ARCHIVE_DIR') or None, # Default: instance/archive
+        ARCHIVE_KEEP_MONTHS=int(os.getenv('ARCHIVE_KEEP_MONTHS', '13')),
+        ARCHIVE_CACHE_BYTES=int(os.getenv('ARCHIVE_CACHE_BYTES', str(64 * 1024 * 1024))),
+        # Where prices come from: 'env' (PRICE_* settings), 'file' (PRICE_FILE, effective-dated JSON)
+        # or 'mongo' (price_versions collection). Workers poll for changes every PRICE_POLL_SECONDS.
+        PRICE_SOURCE=os.getenv('PRICE_SOURCE', 'env').lower(),
+        PRICE_FILE=os.getenv('PRICE_FILE') or None,
+        PRICE_POLL_SECONDS=float(os.getenv('PRICE_POLL_SECONDS', '5')),
+        # /reports/live: how often workers re-read today's counters while someone watches (checks
+        # saved by this worker are pushed at once), and how long one stream runs before the
+        # browser reconnects (each open stream holds a worker thread).
+        LIVE_POLL_SECONDS=float(os.getenv('LIVE_POLL_SECONDS', '2')),
+        LIVE_STREAM_MAX_SECONDS=int(os.getenv('LIVE_STREAM_MAX_SECONDS', '300')),
+        # The testing centre this deployment records checks for (empty: checks carry no station),
+        # and how per-station reports run: 'grouped' (one pass) or 'fanout' (one query per station,
+        # STATION_REPORT_WORKERS at a time). See app/stations.py.
+        STATION_ID=os.getenv('STATION_ID', ''),
+        STATION_REPORT_MODE=os.getenv('STATION_REPORT_MODE', 'grouped').lower(),
+        STATION_REPORT_WORKERS=int(os.getenv('STATION_REPORT_WORKERS', '4')),
+        # ASGI serving (`uvicorn asgi:app`, see app/asgi.py): worker processes per server process
+        # that render report charts off the event loop (0 = render inline)
+        ASYNC_CHART_PROCESSES=int(os.getenv('ASYNC_CHART_PROCESSES', '2'))
     )
 
     # --- MongoDB Connection ---
-    mongo_ip = os.getenv('MONGO_IP')
-    mongo_port = os.getenv('MONGO_PORT')
-    mongo_user = os.getenv('MONGO_USER')
-    mongo_pass = os.getenv('MONGO_PASS')
-    mongo_auth_db = os.getenv('MONGO_AUTH_DB')
-    mongo_db_name = os.getenv('MONGO_DB_NAME')
-
-    # Store connection details in app config
-    app.config['MONGO_IP'] = mongo_ip
-    app.config['MONGO_PORT'] = mongo_port
-    app.config['MONGO_USER'] = mongo_user
-    app.config['MONGO_PASS'] = mongo_pass
-    app.config['MONGO_AUTH_DB'] = mongo_auth_db
-    app.config['MONGO_DB_NAME'] = mongo_db_name
-    app.config['POLLUTION_COLLECTION'] = None
-    app.config['MONGO_CLIENT'] = None # Initialize client config key
-
-    if not all([mongo_ip, mongo_port, mongo_user, mongo_pass, mongo_auth_db, mongo_db_name]):
+    # The client is created lazily, once per process (after any fork), by the connection
+    # manager, so startup never blocks on the database. See app/db.py.
+    mongo_settings = settings_from_env()
+    app.config['MONGO_DB_NAME'] = mongo_settings['db_name']
+    if test_config:
+        app.config.update(test_config)
+    # Station ids become rollup field names, so a malformed one stops startup
+    try:
+        app.config['STATION_ID'] = validate_station_id(app.config['STATION_ID'])
+    except ValueError as e:
+        logger.error(f"{e} Fix STATION_ID and restart.")
+        raise
+    if app.config['STATION_REPORT_MODE'] not in STATION_REPORT_MODES:
+        logger.error(f"Unknown STATION_REPORT_MODE {app.config['STATION_REPORT_MODE']!r}. Using 'grouped'.")
+        app.config['STATION_REPORT_MODE'] = 'grouped'
+
+    mongo = MongoConnectionManager(mongo_settings,
+                                   client_factory=app.config.get('MONGO_CLIENT_FACTORY') or MongoClient,
+                                   event_listeners=[metrics.MongoCommandListener()])
+    if not mongo.configured:
         logger.error("Missing MongoDB configuration in .env file!")
-    else:
-        try:
-            logger.info(f"Attempting to connect to MongoDB at {mongo_ip}:{mongo_port} using auth DB {mongo_auth_db}")
-            client = MongoClient(host=mongo_ip, port=int(mongo_port),
-                                 username=mongo_user, password=mongo_pass,
-                                 authSource=mongo_auth_db,
-                                 serverSelectionTimeoutMS=5000,
-                                 connectTimeoutMS=5000)
-
-            # Check connection
-            client.admin.command('ismaster')
-            logger.info("MongoDB connection successful.")
-
-            db = client[mongo_db_name]
-            pollution_collection = db['pollution_checks']
-
-            # Store collection and client in app config
-            app.config['POLLUTION_COLLECTION'] = pollution_collection
-            app.config['MONGO_CLIENT'] = client # Store the client instance
-            logger.info(f"Using database '{mongo_db_name}' and collection 'pollution_checks'.")
-
-        except (ConnectionFailure, ConfigurationError, Exception) as e:
-             logger.error(f"MongoDB setup failed: {e}")
-             # Ensure config keys reflect failure state if client wasn't created
-             if 'client' in locals() and client:
-                 client.close() # Attempt to close if partially created
-             app.config['POLLUTION_COLLECTION'] = None
-             app.config['MONGO_CLIENT'] = None
-
+    if app.config['ENSURE_INDEXES_ON_STARTUP']:
+        mongo.on_connect(ensure_indexes)
+    app.extensions['mongo'] = mongo
+    # --- Prices ---
+    # env and file prices are validated now, so a gap in the matrix stops startup instead of
+    # surfacing as a failed submission. mongo prices load on first use (the client is lazy).
+    try:
+        pricing = create_price_table(app.config, _get_named_collection)
+        if app.config['PRICE_SOURCE'] != 'mongo':
+            pricing.load()
+    except PriceConfigError as e:
+        logger.error(f"{e} Fix the price configuration and restart.")
+        raise
+    app.extensions['pricing'] = pricing
+    app.extensions['archive'] = CheckArchive(app.config['ARCHIVE_DIR'] or os.path.join(app.instance_path, 'archive'),
+                                             cache_bytes=app.config['ARCHIVE_CACHE_BYTES'])
+    live = LiveCounters(app, get_rollup_collection, poll_seconds=app.config['LIVE_POLL_SECONDS'])
+    app.extensions['live'] = live
 
     # --- Register Blueprints/Routes ---
     with app.app_context():
         from . import routes
         from . import utils
+        from . import cli
 
         app.register_blueprint(routes.main_bp)
+        app.cli.add_command(cli.rollups_cli)
+        app.cli.add_command(cli.indexes_cli)
+        app.cli.add_command(cli.checks_cli)
+        app.cli.add_command(cli.reminders_cli)
+        app.cli.add_command(cli.archive_cli)
+        app.cli.add_command(cli.prices_cli)
+
+    if app.config['WRITE_BEHIND']:
+        _init_write_behind(app, routes.after_checks_saved)
+
+    if app.config['REMINDER_SCAN_INTERVAL_MINUTES'] > 0:
+        start_reminder_scheduler(app, get_collection, app.config['REMINDER_SCAN_INTERVAL_MINUTES'])
+
+    # --- Instrumentation (request timing, template timing, /metrics) ---
+    metrics.init_app(app)
+
+    metrics.REGISTRY.register_gauge('live_report_subscribers',
+                                    'Open /reports/live streams in this worker.',
+                                    lambda: {(): live.subscriber_count})
 
     # Make IST available globally in templates
     app.jinja_env.globals['IST'] = IST
 
-    # --- REMOVE OR COMMENT OUT TEARDOWN ---
-    # @app.teardown_appcontext
-    # def teardown_db(exception=None):
-    #     client = app.config.pop('MONGO_CLIENT', None) # Use pop to remove it
-    #     if client is not None:
-    #         client.close()
-    #         logger.info("MongoDB connection closed.")
-    # --- END OF REMOVAL ---
-
     return app
 
-# Helper function to get the collection safely from app config
-def get_collection():
-    """Gets the MongoDB collection from the application context."""
+def _init_write_behind(app, on_flushed):
+    """Sets up the write-behind queue; each worker process starts it on its first request."""
+    queue = WriteBehindQueue(app, get_collection, on_flushed=on_flushed,
+                             journal_dir=app.config['WRITE_BEHIND_JOURNAL_DIR'],
+                             max_batch=app.config['WRITE_BEHIND_MAX_BATCH'],
+                             max_delay=app.config['WRITE_BEHIND_MAX_DELAY_MS'] / 1000)
+    app.extensions['write_behind'] = queue
+
+    @app.before_request
+    def _start_write_behind():
+        # Started lazily so it runs in the serving process (after any fork) and
+        # replays journals left behind by a previous crash before taking new checks.
+        try:
+            queue.ensure_started()
+        except OSError as e:
+            logger.error(f"Write-behind journal unavailable: {e}")
+
+    metrics.REGISTRY.register_gauge('write_behind_queue_depth',
+                                    'Checks journaled but not yet inserted into MongoDB.',
+                                    lambda: {(): queue.depth})
+
+
+def _get_named_collection(name):
+    """Gets a collection through the process's connection manager, or None if unavailable."""
     # Ensure we are in an app context
     if not current_app:
-        logger.error("Attempted to get collection outside of application context.")
+        logger.error(f"Attempted to get collection '{name}' outside of application context.")
         return None
 
-    # Check if client connection failed during startup
-    if not current_app.config.get('MONGO_CLIENT'):
-         logger.warning("Attempted to access MongoDB collection, but client connection failed during startup.")
-         return None
-
-    collection = current_app.config.get('POLLUTION_COLLECTION')
+    collection = current_app.extensions['mongo'].get_collection(name)
     if collection is None:
-         # This case might happen if DB/Collection access failed even if client connected
-         logger.warning("Attempted to access MongoDB collection, but it's not available in config.")
+         logger.warning(f"Attempted to access MongoDB collection '{name}', but the database is not available.")
     return collection
 
+# Helper function to get the collection safely through the connection manager
+def get_collection():
+    """Gets the pollution_checks collection from the application context."""
+    return _get_named_collection(CHECKS_COLLECTION_NAME)
+
+# Helper function to get the daily rollup collection safely
+def get_rollup_collection():
+    """Gets the daily report rollup collection from the application context."""
+    return _get_named_collection(ROLLUP_COLLECTION_NAME)
+
 # Helper to get current IST time
 def get_ist_time():
     """Returns the current time in IST timezone."""
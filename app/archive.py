@@ -0,0 +1,490 @@
+import fcntl
+import itertools
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson import ObjectId
+import pytz
+import logging
+
+from .cache import LRUCache
+from .reports import REPORT_COUNTER_FIELDS, check_date_match, run_report_counters, trend_buckets
+from .schema import FUEL_CODES, FUEL_NAMES, decode_check, stored_projection
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+# --- Cold archive of closed months ---
+# `flask archive run` moves the checks of fully closed IST months out of pollution_checks
+# into one compressed .npz file per month: a NumPy array per field, sorted by check_date,
+# with dates as int64 milliseconds since the epoch (UTC). manifest.json lists the archived
+# months. Reports add the archived months' counters (computed with NumPy) to the live
+# MongoDB ones, so totals are the same whether or not a month has been archived.
+# While a run deletes a month's checks from MongoDB, its manifest entry says how many have
+# been deleted so far, and readers only count those rows from the file.
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = '.archive.lock'
+ARCHIVE_FIELDS = ['vehicle_no', 'vehicle_type', 'wheels', 'duration_months', 'price', 'check_date', 'expiry_date',
+                  'station_id']
+EPOCH = datetime(1970, 1, 1)
+HOUR_MS = 3600 * 1000
+# _id_type column: how to turn the stored string back into the _id MongoDB has
+ID_TYPES = {'str': 0, 'objectid': 1, 'int': 2}
+
+
+def _numpy():
+    """NumPy is only needed once months are archived; import it on first use."""
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The check archive needs NumPy. Install it with `pip install numpy`.") from None
+    return numpy
+
+
+def _to_ms(dt):
+    """Milliseconds since the epoch of a naive-UTC or timezone-aware datetime."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(UTC).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+
+def _from_ms(ms):
+    """Naive UTC datetime for milliseconds since the epoch, like PyMongo returns dates."""
+    return EPOCH + timedelta(milliseconds=int(ms))
+
+
+def month_bounds(month):
+    """Returns the UTC [start, end) of an IST month given as 'YYYY-MM'."""
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return IST.localize(start).astimezone(UTC), IST.localize(end).astimezone(UTC)
+
+
+def _month_label(dt_utc):
+    return dt_utc.astimezone(IST).strftime('%Y-%m')
+
+
+def _counter_columns(np, columns):
+    """Returns the per-row values whose sums are the REPORT_COUNTER_FIELDS."""
+    wheels, fuel, duration = columns['wheels'], columns['fuel'], columns['duration_months']
+    three_four = (wheels == 3) | (wheels == 4)
+    return {
+        'total_sales_paise': columns['price_paise'],
+        'total_checks': np.ones(len(wheels), dtype=np.int64),
+        'wheels_2': wheels == 2,
+        'wheels_3': wheels == 3,
+        'wheels_4': wheels == 4,
+        'duration_6m': duration == 6,
+        'duration_12m': duration == 12,
+        'type_petrol_3_4': three_four & (fuel == FUEL_CODES['petrol']),
+        'type_diesel_3_4': three_four & (fuel == FUEL_CODES['diesel']),
+    }
+
+
+def columns_from_cursor(cursor, batch_size=1000):
+    """Converts a cursor of stored checks to archive columns, sorted by check_date, or None if it is empty.
+
+    Documents are converted batch_size at a time, so a month of checks is only ever held
+    as compact column arrays, not as a list of Python dicts.
+    """
+    np = _numpy()
+    chunks = {}
+    while True:
+        batch = [decode_check(doc) for doc in itertools.islice(cursor, batch_size)]
+        if not batch:
+            break
+        for name, values in _unsorted_columns(batch).items():
+            chunks.setdefault(name, []).append(values)
+    if not chunks:
+        return None
+    return sort_columns({name: np.concatenate(values) for name, values in chunks.items()})
+
+
+def _id_type(value):
+    if isinstance(value, ObjectId):
+        return ID_TYPES['objectid']
+    if isinstance(value, int) and not isinstance(value, bool):
+        return ID_TYPES['int']
+    if isinstance(value, str):
+        return ID_TYPES['str']
+    raise RuntimeError(f"Cannot archive a check with a {type(value).__name__} _id ({value!r}).")
+
+
+def _unsorted_columns(checks):
+    """Converts decoded checks to archive columns (dict of NumPy arrays), in the given order."""
+    np = _numpy()
+    return {
+        '_id': np.array([str(check['_id']) for check in checks], dtype=str),
+        '_id_type': np.array([_id_type(check['_id']) for check in checks], dtype=np.int8),
+        'vehicle_no': np.array([check['vehicle_no'] for check in checks], dtype=str),
+        'fuel': np.array([FUEL_CODES.get(check['vehicle_type'], 0) for check in checks], dtype=np.int8),
+        'wheels': np.array([check['wheels'] for check in checks], dtype=np.int8),
+        'duration_months': np.array([check['duration_months'] for check in checks], dtype=np.int8),
+        'price_paise': np.array([check['price_paise'] for check in checks], dtype=np.int64),
+        'check_date': np.array([_to_ms(check['check_date']) for check in checks], dtype=np.int64),
+        'expiry_date': np.array([_to_ms(check['expiry_date']) for check in checks], dtype=np.int64),
+        'station_id': np.array([check.get('station_id') or '' for check in checks], dtype=str), # '' = no station
+    }
+
+
+def sort_columns(columns):
+    order = _numpy().argsort(columns['check_date'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+
+def column_counters(columns):
+    """Returns the REPORT_COUNTER_FIELDS of every row in columns, as Python ints."""
+    return {field: int(values.sum()) for field, values in _counter_columns(_numpy(), columns).items()}
+
+
+class ArchivedMonth:
+    """One archived month loaded into memory, with prefix sums for O(log n) range counters."""
+
+    def __init__(self, columns, deleted=None):
+        """deleted: while archive_month() is deleting this file's new rows from MongoDB, how many
+        it has deleted. The rows it has not reached yet are still counted by MongoDB and left out."""
+        np = _numpy()
+        if 'station_id' not in columns: # Archived before checks had stations
+            columns['station_id'] = np.zeros(len(columns['check_date']), dtype='<U1')
+        if '_id_type' not in columns: # Archived before the _id type was stored
+            columns['_id_type'] = np.array([ID_TYPES['objectid'] if ObjectId.is_valid(value) else ID_TYPES['str']
+                                            for value in columns['_id'].tolist()], dtype=np.int8)
+            columns['delete_order'] = np.full(len(columns['check_date']), -1, dtype=np.int64)
+        if deleted is not None:
+            counted = columns['delete_order'] < deleted
+            columns = {name: values[counted] for name, values in columns.items()}
+        self.columns = columns
+        self.check_date = columns['check_date']
+        # prefix[field][i] is the sum of the field over rows [0, i), so any row range is two lookups
+        self.prefix = {
+            field: np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+            for field, values in _counter_columns(np, columns).items()
+        }
+        self.nbytes = (sum(values.nbytes for values in columns.values())
+                       + sum(values.nbytes for values in self.prefix.values()))
+
+    def counters_between(self, bounds_ms):
+        """Returns {field: array of counters per interval} for consecutive bounds (ms, ascending)."""
+        np = _numpy()
+        index = np.searchsorted(self.check_date, np.asarray(bounds_ms, dtype=np.int64), side='left')
+        return {field: np.diff(prefix[index]) for field, prefix in self.prefix.items()}
+
+    def grouped_counters(self, start_ms, end_ms, interval_ms=None):
+        """Returns {(interval, station_id): REPORT_COUNTER_FIELDS} of the rows in [start, end).
+
+        Rows are grouped by station (None for checks without one) and, if interval_ms is
+        given, by the number of whole intervals between start_ms and their check_date.
+        """
+        np = _numpy()
+        first, last = np.searchsorted(self.check_date, [start_ms, end_ms], side='left')
+        if first == last:
+            return {}
+        rows = {name: values[first:last] for name, values in self.columns.items()}
+        stations, station_codes = np.unique(rows['station_id'], return_inverse=True)
+        keys = station_codes
+        if interval_ms:
+            keys = (rows['check_date'] - start_ms) // interval_ms * len(stations) + station_codes
+        groups, group_of_row = np.unique(keys, return_inverse=True)
+        # float64 sums are exact far beyond any realistic month of paise
+        sums = {field: np.bincount(group_of_row, weights=values.astype(np.float64), minlength=len(groups))
+                for field, values in _counter_columns(np, rows).items()}
+        return {
+            (int(key // len(stations)), str(stations[key % len(stations)]) or None):
+                {field: int(round(values[i])) for field, values in sums.items()}
+            for i, key in enumerate(groups)
+        }
+
+    def iter_checks(self, start_ms, end_ms):
+        """Yields the checks in [start, end) as decoded check dicts, oldest first."""
+        np = _numpy()
+        first, last = np.searchsorted(self.check_date, [start_ms, end_ms], side='left')
+        columns = self.columns
+        for i in range(first, last):
+            price_paise = int(columns['price_paise'][i])
+            yield {
+                'vehicle_no': str(columns['vehicle_no'][i]),
+                'vehicle_type': FUEL_NAMES.get(int(columns['fuel'][i])),
+                'wheels': int(columns['wheels'][i]),
+                'duration_months': int(columns['duration_months'][i]),
+                'price_paise': price_paise,
+                'price': price_paise / 100,
+                'check_date': _from_ms(columns['check_date'][i]),
+                'expiry_date': _from_ms(columns['expiry_date'][i]),
+                'station_id': str(columns['station_id'][i]) or None,
+            }
+
+
+class CheckArchive:
+    """Reads and writes the month archive in one directory.
+
+    The manifest is re-read whenever its modification time changes, so web workers
+    pick up months archived by `flask archive run` without a restart. Loaded months
+    are kept in an LRU cache bounded by cache_bytes.
+    """
+
+    def __init__(self, directory, cache_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._manifest = None
+        self._manifest_mtime = None
+        self._lock = threading.Lock()
+        self._months = LRUCache(max_items=120, max_bytes=cache_bytes)
+
+    def manifest(self):
+        """Returns {'months': {month: entry}} (empty if nothing is archived).
+
+        An entry with a 'deleted' key is a month whose checks are still being (or were
+        interrupted while being) deleted from MongoDB.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return {'months': {}}
+        # The manifest is replaced, not rewritten, so a new inode also catches two writes within one mtime tick
+        version = (stat.st_mtime_ns, stat.st_ino)
+        with self._lock:
+            if version != self._manifest_mtime:
+                with open(self.manifest_path, encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+                self._manifest_mtime = version
+            return self._manifest
+
+    def interrupted_months(self):
+        """Returns the months whose archive run stopped before all their checks were deleted from MongoDB."""
+        return sorted(month for month, entry in self.manifest()['months'].items() if 'deleted' in entry)
+
+    def _write_manifest(self, manifest):
+        path = self.manifest_path + '.tmp'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, self.manifest_path)
+
+    @contextmanager
+    def exclusive(self):
+        """Holds the archive's writer lock; raises RuntimeError if another run holds it."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RuntimeError("Another archive run is in progress.") from None
+            yield
+
+    def months_between(self, start_dt_utc, end_dt_utc):
+        """Returns the archived months overlapping [start, end), oldest first."""
+        months = self.manifest()['months']
+        first, last = _month_label(start_dt_utc), _month_label(end_dt_utc - timedelta(microseconds=1))
+        return sorted(month for month in months if first <= month <= last)
+
+    def covers(self, start_dt_utc, end_dt_utc):
+        """True if any part of [start, end) is archived."""
+        return bool(self.months_between(start_dt_utc, end_dt_utc))
+
+    def load_month(self, month):
+        """Returns the ArchivedMonth for an archived month (cached)."""
+        entry = self.manifest()['months'][month]
+        loaded = self._months.get((entry['file'], entry.get('deleted')))
+        if loaded is None:
+            try:
+                npz = _numpy().load(os.path.join(self.directory, entry['file']))
+            except FileNotFoundError:
+                # Replaced by a newer file since the manifest was read
+                with self._lock:
+                    self._manifest_mtime = None
+                entry = self.manifest()['months'][month]
+                npz = _numpy().load(os.path.join(self.directory, entry['file']))
+            with npz:
+                loaded = ArchivedMonth({name: npz[name] for name in npz.files}, entry.get('deleted'))
+            expected = entry['rows'] - entry['moved'] + entry['deleted'] if 'deleted' in entry else entry['rows']
+            if len(loaded.check_date) != expected:
+                raise RuntimeError(f"Archive file {entry['file']} has {len(loaded.check_date)} counted rows, "
+                                   f"the manifest expects {expected}.")
+            self._months.put((entry['file'], entry.get('deleted')), loaded, size=loaded.nbytes)
+        return loaded
+
+    def report_counters(self, start_dt_utc, end_dt_utc):
+        """Returns the REPORT_COUNTER_FIELDS of the archived checks in [start, end)."""
+        totals = dict.fromkeys(REPORT_COUNTER_FIELDS, 0)
+        bounds = [_to_ms(start_dt_utc), _to_ms(end_dt_utc)]
+        for month in self.months_between(start_dt_utc, end_dt_utc):
+            for field, values in self.load_month(month).counters_between(bounds).items():
+                totals[field] += int(values[0])
+        return totals
+
+    def bucket_counters(self, start_dt_utc, end_dt_utc, granularity):
+        """Returns {bucket label: REPORT_COUNTER_FIELDS} of the archived checks in [start, end)."""
+        buckets = trend_buckets(start_dt_utc, end_dt_utc, granularity)
+        bounds = [_to_ms(bucket_start) for _, bucket_start in buckets] + [_to_ms(end_dt_utc)]
+        result = {}
+        for month in self.months_between(start_dt_utc, end_dt_utc):
+            counters = self.load_month(month).counters_between(bounds)
+            for i, (label, _) in enumerate(buckets):
+                if counters['total_checks'][i]:
+                    bucket = result.setdefault(label, dict.fromkeys(REPORT_COUNTER_FIELDS, 0))
+                    for field in REPORT_COUNTER_FIELDS:
+                        bucket[field] += int(counters[field][i])
+        return result
+
+    def station_counters(self, start_dt_utc, end_dt_utc):
+        """Returns {station_id: REPORT_COUNTER_FIELDS} of the archived checks in [start, end).
+
+        Checks recorded without a station are under None.
+        """
+        result = {}
+        for month in self.months_between(start_dt_utc, end_dt_utc):
+            grouped = self.load_month(month).grouped_counters(_to_ms(start_dt_utc), _to_ms(end_dt_utc))
+            for (_, station_id), counters in grouped.items():
+                station = result.setdefault(station_id, dict.fromkeys(REPORT_COUNTER_FIELDS, 0))
+                for field in REPORT_COUNTER_FIELDS:
+                    station[field] += counters[field]
+        return result
+
+    def hour_counters(self, start_dt_utc, end_dt_utc):
+        """Yields per IST hour and station counters of the archived checks in [start, end), shaped
+        like the rollup rebuild's $group output ({'_id': {'day', 'hour', 'station_id'}, **REPORT_COUNTER_FIELDS}).
+
+        start_dt_utc must be an IST hour boundary (IST is UTC+05:30 all year, so every
+        IST hour is a whole number of hours after it).
+        """
+        for month in self.months_between(start_dt_utc, end_dt_utc):
+            month_start, month_end = month_bounds(month)
+            first, last = max(start_dt_utc, month_start), min(end_dt_utc, month_end)
+            grouped = self.load_month(month).grouped_counters(_to_ms(first), _to_ms(last), HOUR_MS)
+            for (hour, station_id), counters in sorted(grouped.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+                hour_ist = (first + timedelta(hours=hour)).astimezone(IST)
+                yield {
+                    '_id': {'day': hour_ist.strftime('%Y-%m-%d'), 'hour': hour_ist.hour, 'station_id': station_id},
+                    **counters,
+                }
+
+    def iter_checks(self, start_dt_utc, end_dt_utc):
+        """Yields the archived checks in [start, end), oldest first."""
+        start_ms, end_ms = _to_ms(start_dt_utc), _to_ms(end_dt_utc)
+        for month in self.months_between(start_dt_utc, end_dt_utc):
+            yield from self.load_month(month).iter_checks(start_ms, end_ms)
+
+    def _write_month_file(self, month, columns):
+        """Writes columns to a new compressed file and returns its name."""
+        name = f'checks-{month}-{uuid.uuid4().hex[:8]}.npz'
+        path = os.path.join(self.directory, name)
+        with open(path + '.tmp', 'wb') as f:
+            _numpy().savez_compressed(f, **columns)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        return name
+
+
+def archivable_months(collection, keep_months, now=None):
+    """Returns the closed IST months older than the newest keep_months ones that still have
+    checks in collection, oldest first."""
+    now_ist = (now or datetime.now(UTC)).astimezone(IST)
+    months_back = now_ist.year * 12 + now_ist.month - 1 - keep_months
+    cutoff = IST.localize(datetime(months_back // 12, months_back % 12 + 1, 1)).astimezone(UTC)
+
+    oldest = None
+    for date_field in ('check_date', 'cd'):
+        doc = collection.find_one({date_field: {'$lt': cutoff}}, projection={date_field: 1}, sort=[(date_field, 1)])
+        if doc is not None and (oldest is None or doc[date_field] < oldest):
+            oldest = doc[date_field]
+    if oldest is None:
+        return []
+
+    months = []
+    month = _month_label(UTC.localize(oldest))
+    while month_bounds(month)[1] <= cutoff:
+        if collection.find_one(check_date_match(*month_bounds(month))['$match'], projection={'_id': 1}) is not None:
+            months.append(month)
+        month = _month_label(month_bounds(month)[1])
+    return months
+
+
+def archive_month(collection, archive, month, now=None, batch_size=1000):
+    """Moves the checks of one closed IST month from collection into the archive.
+
+    The month's rows are read batch_size at a time into column arrays, written to a new
+    file and verified against a MongoDB aggregation of the same range before anything
+    is deleted. The month is then switched to the new file, with a count of its new rows
+    deleted so far, and the rows are deleted from MongoDB batch_size at a time in the file's
+    delete_order, advancing the count after each batch. Readers count the file's rows up to
+    that count and MongoDB the rest, so totals stay the same throughout (at most the batch
+    in flight is missed for the moment its delete_many runs). An interrupted run resumes
+    the deletion. Checks added to an already archived month later (e.g. imports) are merged
+    into a new file. Returns the number of checks moved.
+    """
+    start_dt_utc, end_dt_utc = month_bounds(month)
+    if end_dt_utc > (now or datetime.now(UTC)):
+        raise ValueError(f"{month} is not a closed month yet.")
+
+    manifest = archive.manifest()
+    entry = manifest['months'].get(month)
+    if entry is None or 'deleted' not in entry:
+        projection = stored_projection(ARCHIVE_FIELDS)
+        cursor = collection.find(check_date_match(start_dt_utc, end_dt_utc)['$match'],
+                                 projection=projection, batch_size=batch_size)
+        columns = columns_from_cursor(cursor, batch_size)
+        if columns is None:
+            return 0
+        moved = len(columns['check_date'])
+
+        # Nothing is deleted unless the archived rows add up to what MongoDB reports for the month
+        expected = run_report_counters(collection, start_dt_utc, end_dt_utc)
+        archived = column_counters(columns)
+        if archived != expected:
+            raise RuntimeError(f"Checks for {month} changed while archiving ({archived} vs {expected}). Run again.")
+
+        np = _numpy()
+        columns['delete_order'] = np.arange(moved, dtype=np.int64)
+        if entry is not None:
+            previous = dict(archive.load_month(month).columns)
+            previous['delete_order'] = np.full(len(previous['check_date']), -1, dtype=np.int64) # Deleted already
+            columns = sort_columns({name: np.concatenate((previous[name], columns[name])) for name in columns})
+        # With nothing deleted yet, readers still count exactly the previous file's rows from the new one
+        entry = {
+            'file': archive._write_month_file(month, columns),
+            'rows': len(columns['check_date']),
+            'moved': moved,
+            'deleted': 0,
+            'replaces': entry['file'] if entry is not None else None,
+            'counters': column_counters(columns),
+            'start': start_dt_utc.isoformat(),
+            'end': end_dt_utc.isoformat(),
+        }
+        manifest = {'months': {**manifest['months'], month: entry}}
+        archive._write_manifest(manifest)
+    else:
+        logger.info(f"Resuming the interrupted archive run for {month} at {entry['deleted']} of {entry['moved']} checks.")
+
+    ids = archive_ids(archive.directory, entry['file'])
+    for i in range(entry['deleted'], len(ids), batch_size):
+        collection.delete_many({'_id': {'$in': ids[i:i + batch_size]}})
+        entry = {**entry, 'deleted': min(i + batch_size, len(ids))}
+        manifest = {'months': {**manifest['months'], month: entry}}
+        archive._write_manifest(manifest)
+
+    replaces = entry['replaces']
+    entry = {key: value for key, value in entry.items() if key not in ('deleted', 'replaces')}
+    manifest = {'months': {**manifest['months'], month: {**entry, 'archived_at': datetime.now(UTC).isoformat()}}}
+    archive._write_manifest(manifest)
+    if replaces is not None and replaces != entry['file']:
+        os.remove(os.path.join(archive.directory, replaces))
+    logger.info(f"Archived {entry['moved']} checks of {month} to {entry['file']}.")
+    return entry['moved']
+
+
+def archive_ids(directory, file_name):
+    """Returns the _ids of the rows an archive file moved out of MongoDB, in delete_order and
+    converted back to the types MongoDB stores them as."""
+    np = _numpy()
+    with np.load(os.path.join(directory, file_name)) as npz:
+        order, values, types = npz['delete_order'], npz['_id'], npz['_id_type']
+    rows = np.flatnonzero(order >= 0)
+    rows = rows[np.argsort(order[rows], kind='stable')]
+    convert = {ID_TYPES['str']: str, ID_TYPES['objectid']: ObjectId, ID_TYPES['int']: int}
+    return [convert[int(types[i])](str(values[i])) for i in rows]
@@ -0,0 +1,460 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from decimal import Decimal
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+import logging
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+    from pymongo import AsyncMongoClient
+    from quart import Quart, Blueprint, render_template, request, redirect, url_for, flash, current_app, g
+except ImportError as e:
+    raise RuntimeError("The ASGI entry point needs Quart, asgiref and PyMongo 4.13 or newer. "
+                       "Install them with `pip install quart asgiref uvicorn \"pymongo>=4.13\"`.") from e
+
+from . import IST, create_app
+from .db import MongoConnectionManager, settings_from_env
+from .indexes import CHECKS_COLLECTION_NAME
+from .rollups import (ROLLUP_COLLECTION_NAME, DAY_COUNTER_PROJECTION, build_rollup_updates, build_rollup_report_pipeline,
+                      build_rollup_trend_pipeline, day_counters)
+from .reports import (TREND_GRANULARITIES, add_counters, counters_to_report, build_report_pipeline,
+                      build_trend_pipeline, merge_archived_trend, summarize_trend)
+from .stations import (build_station_report_pipeline, build_rollup_station_pipeline, build_station_fanout_pipeline,
+                       merge_archived_stations, summarize_rollup_station_results, summarize_stations)
+from .routes import report_chart_specs, trend_chart_specs, report_cache_source, live_baseline_day, notify_checks_saved
+from .cache import REPORT_CACHE
+from .checks import validate_check_input, build_check_entry, schema_options
+from .schema import V2_FIELDS
+from .utils import (get_price, calculate_expiry_date, get_utc_date_range, chart_backend, chart_key,
+                    encode_chart_spec, render_chart_spec, CHART_CACHE)
+from .metrics import HTTP_LATENCY, HTTP_REQUESTS, MongoCommandListener
+
+logger = logging.getLogger(__name__)
+
+# --- Async serving (ASGI) ---
+# `uvicorn asgi:app` serves the entry form (/) and the reports page (/reports) from Quart
+# views that talk to MongoDB through PyMongo's asyncio client, so a worker keeps serving
+# other dashboards while one waits on an aggregation. Charts are rendered in a small
+# process pool instead of on the event loop. Every other route (exports, live stream,
+# charts, APIs, /metrics) is handed to the regular Flask app, run in a thread pool.
+# Both share one process: caches, metrics, prices and the live counters are the same objects.
+ASYNC_ENDPOINTS = ('main.dashboard1', 'main.dashboard2')
+
+async_bp = Blueprint('main', __name__) # Same endpoint names as the Flask views, for url_for()
+
+
+class ChartRenderPool:
+    """Renders chart specs in a bounded pool of worker processes, off the event loop.
+
+    Results go into the process's CHART_CACHE, like charts rendered by the Flask views.
+    Concurrent requests for the same chart wait on a single render. With max_workers=0
+    charts are rendered inline on the event loop (fine for small SVG charts).
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._pending = {} # chart key -> asyncio.Future of the render in progress
+
+    def start(self):
+        if self.max_workers > 0 and self._executor is None:
+            # spawn: never fork a process that runs an event loop and driver threads
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    async def render(self, key, spec, backend):
+        """Returns (image_bytes, mimetype) for a chart, from the cache or rendered now. None if nothing to plot."""
+        rendered = CHART_CACHE.get(key)
+        if rendered is not None:
+            return rendered
+        if self._executor is not None:
+            future = self._pending.get(key)
+            if future is None:
+                future = asyncio.get_running_loop().run_in_executor(self._executor, render_chart_spec, spec, backend)
+                self._pending[key] = future
+                future.add_done_callback(lambda done: self._rendered(key, done))
+            try:
+                # A client that disconnects must not cancel the render other requests are waiting on
+                return await asyncio.shield(future)
+            except BrokenProcessPool:
+                logger.error("A chart render process died; restarting the pool and rendering this chart inline.")
+                self.shutdown(wait=False)
+                self.start()
+
+        rendered = render_chart_spec(spec, backend=backend)
+        if rendered is not None:
+            CHART_CACHE.put(key, rendered, size=len(rendered[0]))
+        return rendered
+
+    def _rendered(self, key, future):
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        rendered = future.result()
+        if rendered is not None:
+            CHART_CACHE.put(key, rendered, size=len(rendered[0]))
+
+
+def get_async_collection(name=CHECKS_COLLECTION_NAME):
+    """Gets a collection from the process's asyncio MongoDB client, or None if unavailable."""
+    collection = current_app.extensions['mongo_async'].get_collection(name)
+    if collection is None:
+        logger.warning(f"Attempted to access MongoDB collection '{name}', but the database is not available.")
+    return collection
+
+
+def get_async_rollup_collection():
+    return get_async_collection(ROLLUP_COLLECTION_NAME)
+
+
+async def _aggregate(collection, pipeline):
+    cursor = await collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+
+async def _archive_covers(archive, start_dt_utc, end_dt_utc):
+    # Reads the archive manifest from disk when it changed, so keep it off the event loop
+    return archive is not None and await asyncio.to_thread(archive.covers, start_dt_utc, end_dt_utc)
+
+
+def _price_in_app(flask_app, wheels, duration_months, when):
+    """get_price() in the Flask app context; a price source may reload from disk or MongoDB."""
+    with flask_app.app_context():
+        return get_price(wheels, duration_months, when)
+
+
+async def _chart_urls(specs):
+    """Renders (or reuses) each chart in the pool and returns the URLs of those with something to plot."""
+    backend = chart_backend(current_app.config)
+    keys = {name: chart_key(spec, backend, current_app.config['SECRET_KEY']) for name, spec in specs.items()}
+    pool = current_app.extensions['chart_pool']
+    rendered = await asyncio.gather(*(pool.render(keys[name], spec, backend) for name, spec in specs.items()))
+    # The spec travels with the URL so any worker can re-render after a cache miss
+    return {name: url_for('main.chart_image', chart_key=keys[name], s=encode_chart_spec(spec))
+            for (name, spec), result in zip(specs.items(), rendered) if result is not None}
+
+
+async def _save_check(entry):
+    """Inserts one check and updates its daily rollup. Returns the inserted _id. Raises on insert failure."""
+    collection = get_async_collection()
+    if collection is None:
+        return None
+    result = await collection.insert_one(entry)
+    rollup_collection = get_async_rollup_collection()
+    if rollup_collection is not None:
+        try:
+            await rollup_collection.bulk_write(build_rollup_updates([entry]), ordered=False)
+        except Exception as e:
+            # The check itself is saved; `flask rollups rebuild` repairs the affected day.
+            logger.error(f"Failed to update daily rollups: {e}")
+    notify_checks_saved([entry], current_app.extensions.get('live'))
+    return result.inserted_id
+
+
+@async_bp.route('/', methods=['GET', 'POST'])
+async def dashboard1():
+    """Handles the data input form (Dashboard 1), like routes.dashboard1."""
+    if request.method == 'GET':
+        return await render_template('dashboard1.html', submitted_data={})
+
+    form = await request.form
+    errors, cleaned = validate_check_input(form.get('vehicle_no', ''), form.get('vehicle_type'),
+                                           form.get('wheels'), form.get('duration'))
+    if errors:
+        for error in errors:
+            await flash(error, 'danger')
+        return await render_template('dashboard1.html', submitted_data=form)
+
+    vehicle_no = cleaned['vehicle_no']
+    duration_months = cleaned['duration_months']
+    check_time_ist = datetime.now(IST)
+    price = await asyncio.to_thread(_price_in_app, current_app.extensions['flask'],
+                                    cleaned['wheels'], duration_months, check_time_ist)
+    if price == Decimal('0.0'):
+        await flash("Could not determine price. Check the price configuration.", "danger")
+        return await render_template('dashboard1.html', submitted_data=form)
+
+    expiry_time_ist = calculate_expiry_date(check_time_ist, duration_months)
+    entry = build_check_entry(vehicle_no, cleaned['vehicle_type'], cleaned['wheels'], duration_months,
+                              price, check_time_ist, expiry_time_ist, **schema_options(current_app.config))
+
+    write_behind = current_app.extensions.get('write_behind')
+    try:
+        if write_behind is not None:
+            # Journaling fsyncs, so it runs in a thread; the queue's worker inserts the check
+            record_id = await asyncio.to_thread(write_behind.submit, entry)
+            logger.info(f"Journaled record for {vehicle_no} with ID: {record_id}")
+        else:
+            record_id = await _save_check(entry)
+            if record_id is None:
+                await flash("Database connection is not available. Cannot save data. Please check server logs.", "danger")
+                return await render_template('dashboard1.html', submitted_data=form)
+            logger.info(f"Inserted record for {vehicle_no} with ID: {record_id}")
+    except Exception as e:
+        logger.error(f"Failed to save pollution check: {e}")
+        await flash(f"Could not save data. Details: {e}", 'danger')
+        return await render_template('dashboard1.html', submitted_data=form)
+
+    await flash(f"Pollution check added successfully! Record ID: {record_id}", 'success')
+    return redirect(url_for('main.dashboard1'))
+
+
+async def _run_report(collection, use_rollups, start_dt_utc, end_dt_utc):
+    """Totals of the range, like summarize_rollups / reports.run_report. None if there are no checks."""
+    if use_rollups:
+        results = await _aggregate(collection, build_rollup_report_pipeline(start_dt_utc, end_dt_utc))
+        return results[0] if results and results[0].get('total_checks') else None
+    archive = current_app.extensions.get('archive')
+    if await _archive_covers(archive, start_dt_utc, end_dt_utc):
+        results = await _aggregate(collection, build_report_pipeline(start_dt_utc, end_dt_utc, project=False))
+        counters = add_counters({}, results[0] if results else {})
+        add_counters(counters, await asyncio.to_thread(archive.report_counters, start_dt_utc, end_dt_utc))
+        return counters_to_report(counters) if counters['total_checks'] else None
+    results = await _aggregate(collection, build_report_pipeline(start_dt_utc, end_dt_utc))
+    return results[0] if results else None
+
+
+async def _run_trend(collection, use_rollups, start_dt_utc, end_dt_utc, granularity):
+    """Trend report, like summarize_rollup_trend / reports.run_trend_report."""
+    archive = current_app.extensions.get('archive')
+    if use_rollups:
+        results = await _aggregate(collection, build_rollup_trend_pipeline(start_dt_utc, end_dt_utc, granularity))
+    elif await _archive_covers(archive, start_dt_utc, end_dt_utc):
+        results = await _aggregate(collection, build_trend_pipeline(start_dt_utc, end_dt_utc, granularity, project=False))
+        archived_totals = await asyncio.to_thread(archive.report_counters, start_dt_utc, end_dt_utc)
+        archived_buckets = await asyncio.to_thread(archive.bucket_counters, start_dt_utc, end_dt_utc, granularity)
+        results = merge_archived_trend(results, archived_totals, archived_buckets)
+    else:
+        results = await _aggregate(collection, build_trend_pipeline(start_dt_utc, end_dt_utc, granularity))
+    return summarize_trend(results, start_dt_utc, end_dt_utc, granularity)
+
+
+async def _run_station_fanout(collection, start_dt_utc, end_dt_utc, max_workers):
+    """Per-station report, one aggregation per known station, max_workers in flight. Like stations.run_station_fanout."""
+    station_ids = set()
+    for field in ('station_id', V2_FIELDS['station_id']):
+        station_ids.update(await collection.distinct(field, {field: {'$exists': True}}))
+    station_ids = sorted(station_ids)
+    in_flight = asyncio.Semaphore(max(1, max_workers))
+
+    async def station_counters(station_id):
+        async with in_flight:
+            results = await _aggregate(collection, build_station_fanout_pipeline(station_id, start_dt_utc, end_dt_utc))
+        return add_counters({}, results[0] if results else {})
+
+    stations = dict(zip(station_ids, await asyncio.gather(*(station_counters(s) for s in station_ids))))
+    archive = current_app.extensions.get('archive')
+    if await _archive_covers(archive, start_dt_utc, end_dt_utc):
+        archived = await asyncio.to_thread(archive.station_counters, start_dt_utc, end_dt_utc)
+        merge_archived_stations(stations, {station_id: counters for station_id, counters in archived.items()
+                                           if station_id is not None})
+    return summarize_stations(stations)
+
+
+async def _run_station_breakdown(use_rollups, start_dt_utc, end_dt_utc):
+    """Per-station report in the configured STATION_REPORT_MODE, like routes._run_station_breakdown."""
+    if current_app.config.get('STATION_REPORT_MODE') == 'fanout':
+        collection = get_async_collection()
+        if collection is None:
+            raise RuntimeError("Database connection is not available.")
+        return await _run_station_fanout(collection, start_dt_utc, end_dt_utc,
+                                         current_app.config.get('STATION_REPORT_WORKERS', 4))
+
+    collection = get_async_rollup_collection() if use_rollups else get_async_collection()
+    if collection is None:
+        raise RuntimeError("Database connection is not available.")
+    if use_rollups:
+        return summarize_rollup_station_results(
+            await _aggregate(collection, build_rollup_station_pipeline(start_dt_utc, end_dt_utc)))
+    stations = {doc['_id']: add_counters({}, doc)
+                for doc in await _aggregate(collection, build_station_report_pipeline(start_dt_utc, end_dt_utc))}
+    archive = current_app.extensions.get('archive')
+    if await _archive_covers(archive, start_dt_utc, end_dt_utc):
+        merge_archived_stations(stations, await asyncio.to_thread(archive.station_counters, start_dt_utc, end_dt_utc))
+    return summarize_stations(stations)
+
+
+async def _live_baseline(start_dt_utc, end_dt_utc):
+    """Today's counters if the range includes today, like routes._live_baseline."""
+    day = live_baseline_day(start_dt_utc, end_dt_utc)
+    rollup_collection = get_async_rollup_collection() if day is not None else None
+    if rollup_collection is None:
+        return None
+    doc = await rollup_collection.find_one({'_id': day}, projection=DAY_COUNTER_PROJECTION)
+    return {'day': day, 'counters': day_counters(doc)}
+
+
+async def _build_report(use_rollups, start_dt_utc, end_dt_utc, granularity, by_station):
+    """Computes everything the reports page shows for a range; the dict REPORT_CACHE keeps."""
+    collection = get_async_rollup_collection() if use_rollups else get_async_collection()
+    if collection is None:
+        return None
+    trend = stations = None
+    if by_station:
+        stations = await _run_station_breakdown(use_rollups, start_dt_utc, end_dt_utc)
+    if granularity:
+        # Totals and per-bucket counters come from the same aggregation
+        trend = await _run_trend(collection, use_rollups, start_dt_utc, end_dt_utc, granularity)
+        report_data = trend['totals'] if trend else None
+    elif by_station and current_app.config.get('STATION_REPORT_MODE') != 'fanout':
+        # The grouped pass covers every check, so its totals are the report
+        report_data = stations['totals'] if stations else None
+    else:
+        report_data = await _run_report(collection, use_rollups, start_dt_utc, end_dt_utc)
+    live = await _live_baseline(start_dt_utc, end_dt_utc)
+
+    specs = report_chart_specs(report_data) if report_data else {}
+    if trend:
+        specs.update(trend_chart_specs(trend))
+    charts = await _chart_urls(specs)
+    return {'report_data': report_data, 'charts': charts, 'trend': trend, 'live': live, 'stations': stations}
+
+
+@async_bp.route('/reports', methods=['GET', 'POST'])
+async def dashboard2():
+    """Handles the reports generation (Dashboard 2), like routes.dashboard2."""
+    form = await request.form
+    report_data = None
+    result = {}
+    start_date_str = form.get('start_date', "")
+    end_date_str = form.get('end_date', "")
+    granularity = form.get('granularity', "")
+    if granularity and granularity not in TREND_GRANULARITIES:
+        await flash("Invalid trend period selected. Showing totals only.", "warning")
+        granularity = ""
+    by_station = form.get('by_station') == '1'
+
+    if request.method == 'POST':
+        start_dt_utc, end_dt_utc = (get_utc_date_range(start_date_str, end_date_str)
+                                    if start_date_str and end_date_str else (None, None))
+        if not start_date_str or not end_date_str:
+            await flash("Please select both Start Date and End Date.", "warning")
+        elif not start_dt_utc or not end_dt_utc:
+            await flash("Invalid date range selected or format incorrect (use YYYY-MM-DD).", "warning")
+        else:
+            use_rollups = current_app.config.get('USE_REPORT_ROLLUPS', False)
+            source = report_cache_source(current_app.config, use_rollups, granularity, by_station)
+            try:
+                # Shared with the Flask views: a report cached by either is served by both
+                cache_version = REPORT_CACHE.version()
+                cached = REPORT_CACHE.get(start_dt_utc, end_dt_utc, source=source)
+                if cached is not None:
+                    result = cached
+                    logger.info(f"Report for {start_date_str} to {end_date_str} served from cache.")
+                else:
+                    result = await _build_report(use_rollups, start_dt_utc, end_dt_utc, granularity, by_station)
+                    if result is None:
+                        await flash("Database connection is not available. Cannot generate report.", "danger")
+                        result = {}
+                    else:
+                        REPORT_CACHE.put(start_dt_utc, end_dt_utc, result, source=source, version=cache_version)
+                if result:
+                    report_data = result['report_data']
+                    if report_data:
+                        logger.info(f"Report generated for {start_date_str} to {end_date_str}: {report_data}")
+                    else:
+                        await flash(f"No records found for the selected date range ({start_date_str} to {end_date_str}).", "info")
+                        report_data = {} # Set to empty dict to avoid errors in template, indicates no data
+            except Exception as e:
+                logger.error(f"Error generating report: {e}", exc_info=True)
+                await flash(f"Error generating report: {e}", "danger")
+                report_data, result = None, {}
+
+    return await render_template('dashboard2.html',
+                                 report_data=report_data,
+                                 charts=result.get('charts') or {},
+                                 trend=result.get('trend'),
+                                 live=result.get('live'),
+                                 stations=result.get('stations'),
+                                 by_station=by_station,
+                                 granularity=granularity,
+                                 start_date=start_date_str,
+                                 end_date=end_date_str)
+
+
+class ASGIDispatcher:
+    """Sends requests for the async views to the Quart app and everything else to the Flask app.
+
+    The Flask app runs through asgiref's WSGI adapter, one thread per request. Lifespan
+    events go to the Quart app, which starts and stops the chart pool.
+    """
+
+    def __init__(self, async_app, flask_app):
+        self.async_app = async_app
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self._urls = async_app.url_map.bind('')
+
+    def _is_async(self, path, method):
+        try:
+            self._urls.match(path, method=method)
+            return True
+        except HTTPException: # NotFound, MethodNotAllowed or RequestRedirect; build-only rules never match
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not self._is_async(scope['path'], scope['method']):
+            await self.wsgi_app(scope, receive, send)
+        else:
+            await self.async_app(scope, receive, send)
+
+
+def create_asgi_app(test_config=None):
+    """Builds the Flask app and the Quart app serving its dashboards asynchronously. Returns the ASGI app."""
+    flask_app = create_app(test_config)
+    quart_app = Quart(__name__, static_folder=None, template_folder=flask_app.template_folder,
+                      root_path=flask_app.root_path)
+    # The application's settings (and the session key, so flashes survive redirects between the two)
+    quart_app.config.update({key: value for key, value in flask_app.config.items()
+                             if key not in Flask.default_config})
+    quart_app.config['SECRET_KEY'] = flask_app.config['SECRET_KEY']
+    quart_app.jinja_env.globals['IST'] = IST
+
+    mongo_async = MongoConnectionManager(settings_from_env(),
+                                         client_factory=quart_app.config.get('MONGO_ASYNC_CLIENT_FACTORY') or AsyncMongoClient,
+                                         event_listeners=[MongoCommandListener()])
+    chart_pool = ChartRenderPool(max_workers=quart_app.config['ASYNC_CHART_PROCESSES'])
+    quart_app.extensions.update(flask_app.extensions, flask=flask_app, mongo_async=mongo_async, chart_pool=chart_pool)
+
+    quart_app.register_blueprint(async_bp)
+    # url_for() in the shared templates also builds links to routes only the Flask app serves
+    for rule in flask_app.url_map.iter_rules():
+        if rule.endpoint not in ASYNC_ENDPOINTS:
+            build_rule = quart_app.url_rule_class(rule.rule, endpoint=rule.endpoint, methods=rule.methods)
+            build_rule.build_only = True
+            quart_app.url_map.add(build_rule)
+
+    @quart_app.before_serving
+    async def _start():
+        chart_pool.start()
+        # Creates the thread-based client, which also runs its startup tasks (index creation)
+        await asyncio.to_thread(flask_app.extensions['mongo'].get_client)
+
+    @quart_app.after_serving
+    async def _stop():
+        await asyncio.to_thread(chart_pool.shutdown) # Waits for the render processes to exit
+
+    @quart_app.before_request
+    async def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @quart_app.after_request
+    async def _record_request(response):
+        started = g.get('request_started')
+        if started is not None:
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - started, endpoint, request.method)
+            HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+    return ASGIDispatcher(quart_app, flask_app)
@@ -0,0 +1,174 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache bounded by entry count and (optionally) total size in bytes.
+
+    Callers pass the size of each value to put(); entries are evicted least recently
+    used first until both bounds hold. Hit/miss counters are kept for diagnostics.
+    """
+
+    def __init__(self, max_items=256, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (value, size)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Returns the cached value for key (marking it recently used) or default."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size=0):
+        """Stores value under key. Values larger than max_bytes are not cached."""
+        if self.max_bytes is not None and size > self.max_bytes:
+            logger.info(f"Not caching {key!r}: {size} bytes exceeds the cache budget of {self.max_bytes}.")
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self._entries and (len(self._entries) > self.max_items or
+                                     (self.max_bytes is not None and self.current_bytes > self.max_bytes)):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """Removes key from the cache and returns its value (or default)."""
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is None:
+                return default
+            self.current_bytes -= item[1]
+            return item[0]
+
+    def clear(self):
+        """Drops every entry. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Returns a dict of size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class ReportCache:
+    """Caches report results (aggregation output plus chart URLs) per UTC date range.
+
+    Ranges that include the present are keyed on a generation counter that bump_generation()
+    advances after every insert, and also expire after live_ttl seconds to bound staleness
+    from inserts made by other workers. Ranges that end before "now" only change when
+    checks are added to past days (imports, rollup rebuilds, journal replays): they are
+    keyed on a closed epoch that invalidate_closed() advances, and expire after closed_ttl
+    seconds (0 = never) to pick up such changes made by other processes.
+
+    Take version() before computing a report and pass it to put(): a result computed
+    while the cache was invalidated is then not stored.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, max_items=1024, live_ttl=30, closed_ttl=3600):
+        self._entries = LRUCache(max_items=max_items, max_bytes=max_bytes)
+        self._lock = threading.Lock()
+        self.live_ttl = live_ttl
+        self.closed_ttl = closed_ttl
+        self.generation = 0
+        self.closed_epoch = 0
+
+    def bump_generation(self):
+        """Invalidates every cached range that includes the present."""
+        with self._lock:
+            self.generation += 1
+
+    def invalidate_closed(self):
+        """Invalidates every cached range that ended in the past."""
+        with self._lock:
+            self.closed_epoch += 1
+
+    def version(self):
+        """Returns (generation, closed_epoch), to pass to put() for a report computed from now on."""
+        with self._lock:
+            return self.generation, self.closed_epoch
+
+    def _key(self, start_dt_utc, end_dt_utc, source, now, version=None):
+        generation, closed_epoch = version or (self.generation, self.closed_epoch)
+        if end_dt_utc <= now:
+            return ('closed', source, start_dt_utc.isoformat(), end_dt_utc.isoformat(), closed_epoch)
+        return ('live', source, start_dt_utc.isoformat(), end_dt_utc.isoformat(), generation)
+
+    def get(self, start_dt_utc, end_dt_utc, source='raw'):
+        """Returns the cached value for the range, or None."""
+        now = datetime.now(timezone.utc)
+        entry = self._entries.get(self._key(start_dt_utc, end_dt_utc, source, now))
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() > expires_at:
+            return None
+        return value
+
+    def put(self, start_dt_utc, end_dt_utc, value, source='raw', version=None):
+        """Caches a JSON-serialisable value for the range.
+
+        version is version() as taken before the value was computed; the value is dropped
+        if the range was invalidated since.
+        """
+        now = datetime.now(timezone.utc)
+        key = self._key(start_dt_utc, end_dt_utc, source, now, version)
+        if version is not None and key != self._key(start_dt_utc, end_dt_utc, source, now):
+            return
+        if key[0] == 'live':
+            expires_at = time.monotonic() + self.live_ttl
+        else:
+            expires_at = time.monotonic() + self.closed_ttl if self.closed_ttl else None
+        size = len(json.dumps(value, default=str))
+        self._entries.put(key, (value, expires_at), size=size)
+
+    def clear(self):
+        """Drops every cached report, including closed ranges."""
+        self._entries.clear()
+
+    def stats(self):
+        """Returns cache counters, including the hit ratio."""
+        stats = self._entries.stats()
+        stats['generation'] = self.generation
+        stats['closed_epoch'] = self.closed_epoch
+        return stats
+
+
+REPORT_CACHE = ReportCache(max_bytes=int(os.getenv('REPORT_CACHE_MAX_BYTES', str(8 * 1024 * 1024))),
+                           live_ttl=int(os.getenv('REPORT_CACHE_LIVE_TTL_SECONDS', '30')),
+                           closed_ttl=int(os.getenv('REPORT_CACHE_CLOSED_TTL_SECONDS', '3600')))
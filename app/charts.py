@@ -0,0 +1,202 @@
+import math
+import re
+from xml.sax.saxutils import escape
+
+# Same palette as Matplotlib's Pastel1, used when no (or too few) colors are given
+DEFAULT_COLORS = ['#fbb4ae', '#b3cde3', '#ccebc5', '#decbe4', '#fed9a6',
+                  '#ffffcc', '#e5d8bd', '#fddaec', '#f2f2f2']
+
+# Canvas layout (px). The pie sits on the left, the legend on the right.
+WIDTH, HEIGHT = 480, 330
+PIE_CX, PIE_CY, PIE_R = 155, 185, 125
+LEGEND_X, LEGEND_Y = 305, 120
+PCT_DISTANCE = 0.80 # Label distance from center as a fraction of the radius (like Matplotlib's pctdistance)
+FONT = 'font-family="-apple-system, Segoe UI, Roboto, Helvetica, Arial, sans-serif"'
+# Colors end up in SVG attributes: only hex colors and a few CSS names are accepted
+COLOR_PATTERN = re.compile(r'^#[0-9a-fA-F]{3,8}$')
+NAMED_COLORS = frozenset({
+    'black', 'white', 'gray', 'grey', 'silver', 'red', 'maroon', 'orange', 'gold', 'yellow', 'olive',
+    'lime', 'green', 'teal', 'cyan', 'aqua', 'skyblue', 'lightblue', 'blue', 'navy', 'purple',
+    'magenta', 'fuchsia', 'pink', 'brown', 'tan', 'coral', 'salmon', 'lightgreen', 'lightgray',
+})
+
+
+def is_valid_color(color):
+    """Returns True if color is a hex color (#rgb to #rrggbbaa) or one of NAMED_COLORS."""
+    return isinstance(color, str) and (bool(COLOR_PATTERN.match(color)) or color.lower() in NAMED_COLORS)
+
+
+def _pick_colors(colors, count, defaults):
+    """Returns count colors: the given ones if there are enough, else defaults. Invalid colors fall back too."""
+    if not colors or len(colors) < count:
+        colors = defaults
+    return [color if is_valid_color(color) else DEFAULT_COLORS[i % len(DEFAULT_COLORS)]
+            for i, color in enumerate(colors[:count])]
+
+
+def _attr(value):
+    """Escapes value for use inside a double-quoted XML attribute."""
+    return escape(str(value), {'"': '&quot;'})
+
+
+def _point(angle, radius):
+    """Returns the SVG coordinates of a polar point (angle in radians, counter-clockwise from 3 o'clock)."""
+    return PIE_CX + radius * math.cos(angle), PIE_CY - radius * math.sin(angle)
+
+
+def _wedge(start, end, color):
+    """Returns the SVG element for one wedge between two angles (radians)."""
+    if end - start >= 2 * math.pi - 1e-9:
+        # A single category covering the whole pie cannot be drawn as an arc
+        return (f'<circle cx="{PIE_CX}" cy="{PIE_CY}" r="{PIE_R}" fill="{_attr(color)}" '
+                f'stroke="white" stroke-width="1"/>')
+    x0, y0 = _point(start, PIE_R)
+    x1, y1 = _point(end, PIE_R)
+    large_arc = 1 if end - start > math.pi else 0
+    # sweep-flag 0 draws counter-clockwise on screen, matching Matplotlib's default wedge order
+    return (f'<path d="M{PIE_CX},{PIE_CY} L{x0:.2f},{y0:.2f} '
+            f'A{PIE_R},{PIE_R} 0 {large_arc} 0 {x1:.2f},{y1:.2f} Z" '
+            f'fill="{_attr(color)}" stroke="white" stroke-width="1"/>')
+
+
+def render_pie_svg(data, labels, title, colors=None):
+    """Renders a pie chart as an SVG document string.
+
+    Mirrors the Matplotlib chart: wedges start at 12 o'clock and run counter-clockwise,
+    each wedge carries a "pct% (count)" label and the categories are listed in a legend.
+    """
+    final_colors = _pick_colors(colors, len(data), [DEFAULT_COLORS[i % len(DEFAULT_COLORS)] for i in range(len(data))])
+
+    total = float(sum(data))
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" '
+        f'viewBox="0 0 {WIDTH} {HEIGHT}" role="img" {FONT}>',
+        f'<title>{escape(str(title))}</title>',
+        f'<text x="{WIDTH / 2:.0f}" y="28" text-anchor="middle" font-size="16" '
+        f'font-weight="bold" fill="#222">{escape(str(title))}</text>',
+    ]
+
+    wedges, texts = [], []
+    angle = math.pi / 2 # startangle=90
+    for value, color in zip(data, final_colors):
+        if value <= 0:
+            continue
+        sweep = 2 * math.pi * value / total
+        wedges.append(_wedge(angle, angle + sweep, color))
+
+        mid = angle + sweep / 2
+        tx, ty = _point(mid, PIE_R * PCT_DISTANCE)
+        pct = 100.0 * value / total
+        texts.append(
+            f'<text x="{tx:.2f}" y="{ty:.2f}" text-anchor="middle" font-size="12" font-weight="bold" fill="black">'
+            f'<tspan x="{tx:.2f}" dy="-0.2em">{pct:.1f}%</tspan>'
+            f'<tspan x="{tx:.2f}" dy="1.2em">({int(value):d})</tspan></text>'
+        )
+        angle += sweep
+    parts.extend(wedges)
+    parts.extend(texts)
+
+    # --- Legend ---
+    parts.append(f'<text x="{LEGEND_X}" y="{LEGEND_Y}" font-size="12" font-weight="bold" fill="#222">Categories</text>')
+    for i, (label, color) in enumerate(zip(labels, final_colors)):
+        y = LEGEND_Y + 12 + i * 20
+        parts.append(f'<rect x="{LEGEND_X}" y="{y}" width="14" height="14" fill="{_attr(color)}" stroke="#999" stroke-width="0.5"/>')
+        parts.append(f'<text x="{LEGEND_X + 20}" y="{y + 11}" font-size="12" fill="#222">{escape(str(label))}</text>')
+
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+# --- Trend (bar/line) charts ---
+TREND_WIDTH, TREND_HEIGHT = 640, 330
+PLOT_LEFT, PLOT_RIGHT, PLOT_TOP, PLOT_BOTTOM = 64, 620, 70, 280
+Y_TICKS = 5
+MAX_X_LABELS = 12 # Every nth bucket is labelled so the axis stays legible
+MAX_LINE_MARKERS = 60
+
+
+def _nice_ceiling(value):
+    """Rounds value up to 1, 2, 2.5 or 5 times a power of ten, for readable axis ticks."""
+    if value <= 0:
+        return 1
+    magnitude = 10 ** math.floor(math.log10(value))
+    for step in (1, 2, 2.5, 5, 10):
+        if value <= step * magnitude:
+            return step * magnitude
+    return 10 * magnitude
+
+
+def _format_tick(value):
+    return f'{value:,.0f}' if value == int(value) else f'{value:,.1f}'
+
+
+def render_trend_svg(labels, series, title, kind='line', colors=None):
+    """Renders a time series chart as an SVG document string.
+
+    labels are the bucket names along the x axis; series is a list of (name, values)
+    pairs with one value per label. kind 'bar' draws grouped bars, 'line' one line per series.
+    """
+    defaults = ['#377eb8', '#ff7f00', '#4daf4a', '#e41a1c', '#984ea3'][:len(series)]
+    defaults += [DEFAULT_COLORS[i % len(DEFAULT_COLORS)] for i in range(len(series) - len(defaults))]
+    final_colors = _pick_colors(colors, len(series), defaults)
+
+    y_max = _nice_ceiling(max((max(values) for _, values in series if values), default=0))
+    plot_w, plot_h = PLOT_RIGHT - PLOT_LEFT, PLOT_BOTTOM - PLOT_TOP
+    slot = plot_w / max(len(labels), 1)
+
+    def y_of(value):
+        return PLOT_BOTTOM - plot_h * value / y_max
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{TREND_WIDTH}" height="{TREND_HEIGHT}" '
+        f'viewBox="0 0 {TREND_WIDTH} {TREND_HEIGHT}" role="img" {FONT}>',
+        f'<title>{escape(str(title))}</title>',
+        f'<text x="{TREND_WIDTH / 2:.0f}" y="28" text-anchor="middle" font-size="16" '
+        f'font-weight="bold" fill="#222">{escape(str(title))}</text>',
+    ]
+
+    # --- Legend (one row under the title) ---
+    x = PLOT_LEFT
+    for (name, _), color in zip(series, final_colors):
+        parts.append(f'<rect x="{x}" y="42" width="12" height="12" fill="{_attr(color)}"/>')
+        parts.append(f'<text x="{x + 17}" y="52" font-size="12" fill="#222">{escape(str(name))}</text>')
+        x += 30 + 7 * len(str(name))
+
+    # --- Axes and grid ---
+    for i in range(Y_TICKS + 1):
+        value = y_max * i / Y_TICKS
+        y = y_of(value)
+        parts.append(f'<line x1="{PLOT_LEFT}" y1="{y:.2f}" x2="{PLOT_RIGHT}" y2="{y:.2f}" '
+                     f'stroke="{"#999" if i == 0 else "#e5e5e5"}" stroke-width="1"/>')
+        parts.append(f'<text x="{PLOT_LEFT - 6}" y="{y + 4:.2f}" text-anchor="end" font-size="11" '
+                     f'fill="#444">{_format_tick(value)}</text>')
+    label_every = max(1, math.ceil(len(labels) / MAX_X_LABELS))
+    for i, label in enumerate(labels):
+        if i % label_every == 0:
+            x = PLOT_LEFT + slot * (i + 0.5)
+            parts.append(f'<text x="{x:.2f}" y="{PLOT_BOTTOM + 18}" text-anchor="middle" font-size="11" '
+                         f'fill="#444">{escape(str(label))}</text>')
+
+    # --- Data ---
+    if kind == 'bar':
+        bar_w = slot * 0.8 / max(len(series), 1)
+        for s, ((_, values), color) in enumerate(zip(series, final_colors)):
+            for i, value in enumerate(values):
+                if value <= 0:
+                    continue
+                x = PLOT_LEFT + slot * (i + 0.1) + bar_w * s
+                y = y_of(value)
+                parts.append(f'<rect x="{x:.2f}" y="{y:.2f}" width="{bar_w:.2f}" height="{PLOT_BOTTOM - y:.2f}" '
+                             f'fill="{_attr(color)}"><title>{escape(str(labels[i]))}: {_format_tick(value)}</title></rect>')
+    else:
+        for (_, values), color in zip(series, final_colors):
+            points = [(PLOT_LEFT + slot * (i + 0.5), y_of(value)) for i, value in enumerate(values)]
+            parts.append(f'<polyline fill="none" stroke="{_attr(color)}" stroke-width="2" '
+                         f'points="{" ".join(f"{x:.2f},{y:.2f}" for x, y in points)}"/>')
+            if len(points) <= MAX_LINE_MARKERS:
+                for (x, y), label, value in zip(points, labels, values):
+                    parts.append(f'<circle cx="{x:.2f}" cy="{y:.2f}" r="3" fill="{_attr(color)}">'
+                                 f'<title>{escape(str(label))}: {_format_tick(value)}</title></circle>')
+
+    parts.append('</svg>')
+    return ''.join(parts)
@@ -0,0 +1,81 @@
+import pytz
+import logging
+
+from .schema import encode_check, to_paise, SCHEMA_VERSIONS
+
+logger = logging.getLogger(__name__)
+UTC = pytz.utc
+
+# Form/CSV duration values and the months they stand for
+DURATION_MONTHS = {'six_months': 6, 'one_year': 12}
+VALID_WHEELS = (2, 3, 4)
+VALID_FUEL_TYPES = ('petrol', 'diesel')
+
+
+def validate_check_input(vehicle_no, vehicle_type, wheels_str, duration_str):
+    """Validates raw check input as submitted by the form (or a CSV row).
+
+    Returns (errors, cleaned) where cleaned holds vehicle_no (upper-cased), vehicle_type,
+    wheels and duration_months. cleaned is only meaningful when errors is empty.
+    """
+    vehicle_no = (vehicle_no or '').strip().upper()
+    wheels_str = (wheels_str or '').strip()
+
+    errors = []
+    if not vehicle_no: errors.append("Vehicle Number is required.")
+    # Add regex validation for vehicle_no if needed (e.g., using re module)
+    if not vehicle_type or vehicle_type not in VALID_FUEL_TYPES: errors.append("Invalid Vehicle Fuel Type selected.")
+    if not wheels_str or not wheels_str.isdigit(): errors.append("Invalid Number of Wheels selected.")
+    if not duration_str or duration_str not in DURATION_MONTHS: errors.append("Invalid Duration Period selected.")
+
+    # Proceed with further checks only if basic types are okay
+    wheels = 0
+    if wheels_str and wheels_str.isdigit():
+         wheels = int(wheels_str)
+         if wheels not in VALID_WHEELS: errors.append("Wheels must be 2, 3, or 4.")
+         # Check fuel type compatibility *after* confirming wheels is valid
+         if wheels == 2 and vehicle_type == 'diesel': errors.append("2-Wheelers cannot be Diesel type.")
+    elif wheels_str: # If it's not empty but not a digit
+        errors.append("Number of Wheels must be a number (2, 3, or 4).")
+
+    cleaned = {
+        'vehicle_no': vehicle_no,
+        'vehicle_type': vehicle_type,
+        'wheels': wheels,
+        'duration_months': DURATION_MONTHS.get(duration_str, 0),
+    }
+    return errors, cleaned
+
+
+def schema_options(config):
+    """Returns the build_check_entry schema arguments selected by the app config (layout and station)."""
+    version = config.get('CHECK_SCHEMA_VERSION', 1)
+    if version not in SCHEMA_VERSIONS:
+        logger.error(f"Unknown CHECK_SCHEMA_VERSION {version!r}. Writing schema version 1.")
+        version = 1
+    return {'schema_version': version, 'store_expiry': config.get('CHECK_STORE_EXPIRY', True),
+            'station_id': config.get('STATION_ID')}
+
+
+def build_check_entry(vehicle_no, vehicle_type, wheels, duration_months, price, check_time_ist, expiry_time_ist,
+                      schema_version=1, store_expiry=True, station_id=None):
+    """Builds the MongoDB document for one pollution check. Dates are stored as UTC.
+
+    schema_version 2 produces the compact layout described in app/schema.py. station_id
+    (see app/stations.py) is left out of the document when None.
+    """
+    entry = {
+        "vehicle_no": vehicle_no,
+        "vehicle_type": vehicle_type,
+        "wheels": wheels,
+        "duration_months": duration_months,
+        "price": float(price), # Store as float/double in MongoDB for wider compatibility
+        "check_date": check_time_ist.astimezone(UTC), # Store as native BSON Date (UTC)
+        "expiry_date": expiry_time_ist.astimezone(UTC), # Store as native BSON Date (UTC)
+    }
+    if station_id:
+        entry['station_id'] = station_id
+    if schema_version == 1:
+        return entry
+    entry['price_paise'] = to_paise(price) # Exact, unlike the float
+    return encode_check(entry, version=schema_version, store_expiry=store_expiry)
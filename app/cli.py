@@ -0,0 +1,270 @@
+import json
+import os
+import click
+from flask import current_app
+from flask.cli import AppGroup
+import logging
+
+from .utils import get_utc_date_range
+from . import get_collection, get_rollup_collection, _get_named_collection
+
+logger = logging.getLogger(__name__)
+
+# --- Rollup maintenance (flask rollups ...) ---
+rollups_cli = AppGroup('rollups', help='Maintain the pre-aggregated daily report rollups.')
+
+
+@rollups_cli.command('rebuild')
+@click.option('--start', 'start_date_str', required=True, help='First IST day to rebuild (YYYY-MM-DD).')
+@click.option('--end', 'end_date_str', required=True, help='Last IST day to rebuild, inclusive (YYYY-MM-DD).')
+def rebuild_rollups_command(start_date_str, end_date_str):
+    """Recomputes the daily rollups for a date range from pollution_checks."""
+    from .rollups import rebuild_rollups
+
+    start_dt_utc, end_dt_utc = get_utc_date_range(start_date_str, end_date_str)
+    if not start_dt_utc or not end_dt_utc:
+        raise click.BadParameter("Invalid date range (use YYYY-MM-DD, start on or before end).")
+
+    collection = get_collection()
+    rollup_collection = get_rollup_collection()
+    if collection is None or rollup_collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+
+    days = rebuild_rollups(collection, rollup_collection, start_dt_utc, end_dt_utc,
+                           archive=current_app.extensions.get('archive'))
+    click.echo(f"Rebuilt {days} daily rollup(s) for {start_date_str} to {end_date_str}.")
+
+
+# --- Index management (flask indexes ...) ---
+indexes_cli = AppGroup('indexes', help='Manage and verify MongoDB indexes.')
+
+
+@indexes_cli.command('ensure')
+def ensure_indexes_command():
+    """Creates every index in the index registry (idempotent)."""
+    from .indexes import ensure_indexes
+
+    collection = get_collection()
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+
+    for collection_name, names in ensure_indexes(collection.database).items():
+        click.echo(f"{collection_name}: {', '.join(names)}")
+
+
+@indexes_cli.command('explain')
+@click.option('--start', 'start_date_str', required=True, help='First IST day of the report (YYYY-MM-DD).')
+@click.option('--end', 'end_date_str', required=True, help='Last IST day of the report, inclusive (YYYY-MM-DD).')
+def explain_reports_command(start_date_str, end_date_str):
+    """Explains the report pipelines for a date range and flags collection scans."""
+    from .indexes import check_pipeline_plan
+    from .reports import build_report_pipeline
+    from .rollups import build_rollup_report_pipeline
+    from .stations import (build_station_report_pipeline, build_rollup_station_pipeline,
+                           build_station_fanout_pipeline, known_stations)
+
+    start_dt_utc, end_dt_utc = get_utc_date_range(start_date_str, end_date_str)
+    if not start_dt_utc or not end_dt_utc:
+        raise click.BadParameter("Invalid date range (use YYYY-MM-DD, start on or before end).")
+
+    collection = get_collection()
+    rollup_collection = get_rollup_collection()
+    if collection is None or rollup_collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+
+    checks = [
+        ('raw report', collection, build_report_pipeline(start_dt_utc, end_dt_utc)),
+        ('rollup report', rollup_collection, build_rollup_report_pipeline(start_dt_utc, end_dt_utc)),
+        ('raw station report', collection, build_station_report_pipeline(start_dt_utc, end_dt_utc)),
+        ('rollup station report', rollup_collection, build_rollup_station_pipeline(start_dt_utc, end_dt_utc)),
+    ]
+    station_ids = known_stations(collection)
+    if station_ids: # The fan-out queries all have the same shape; explain the first station's
+        checks.append((f'station fan-out ({station_ids[0]})', collection,
+                       build_station_fanout_pipeline(station_ids[0], start_dt_utc, end_dt_utc)))
+    for label, target, pipeline in checks:
+        uses_index = check_pipeline_plan(target, pipeline)
+        status = {True: 'index', False: 'COLLSCAN', None: 'explain failed'}[uses_index]
+        click.echo(f"{label}: {status}")
+
+
+# --- Bulk data (flask checks ...) ---
+checks_cli = AppGroup('checks', help='Bulk import and maintenance of pollution check records.')
+
+
+@checks_cli.command('import')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', type=int, default=None,
+              help='Documents per insert_many call (default: IMPORT_BATCH_SIZE or 1000).')
+def import_checks_command(csv_path, batch_size):
+    """Imports checks from a CSV file with columns vehicle_no, vehicle_type, wheels, duration[, check_date]."""
+    from .importer import import_checks_csv
+    from .checks import schema_options
+
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 1000)
+    collection = get_collection()
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+
+    def report_error(line_number, messages):
+        click.echo(f"Line {line_number}: {' '.join(messages)}", err=True)
+
+    # newline='' lets the csv module handle quoted newlines; utf-8-sig strips an Excel BOM
+    with open(csv_path, newline='', encoding='utf-8-sig') as stream:
+        try:
+            result = import_checks_csv(stream, collection, get_rollup_collection(),
+                                       batch_size=batch_size, on_error=report_error,
+                                       schema_options=schema_options(current_app.config))
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    click.echo(f"Imported {result['inserted']} of {result['rows']} rows ({result['rejected']} rejected) "
+               f"in {result['elapsed']:.1f}s, {result['rows_per_sec']:.0f} rows/sec.")
+
+
+def _format_bytes(value):
+    return f"{value / (1024 * 1024):,.1f} MiB"
+
+
+@checks_cli.command('migrate-schema')
+@click.option('--batch-size', type=int, default=1000, help='Documents rewritten per bulk_write.')
+@click.option('--derive-expiry', is_flag=True,
+              help='Drop the stored expiry date (derived on read). Expiry reminders then skip these checks.')
+@click.option('--restart', is_flag=True, help='Ignore an interrupted run\'s checkpoint and start over.')
+def migrate_schema_command(batch_size, derive_expiry, restart):
+    """Rewrites v1 check documents in place in the compact v2 schema. Resumes interrupted runs."""
+    from .schema import migrate_checks_to_v2
+
+    collection = get_collection()
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+    if current_app.config.get('CHECK_SCHEMA_VERSION', 1) != 2:
+        click.echo("Note: CHECK_SCHEMA_VERSION is not 2, so the app keeps writing v1 documents.", err=True)
+
+    stats = migrate_checks_to_v2(collection, batch_size=batch_size, store_expiry=not derive_expiry, restart=restart)
+    click.echo(f"Migrated {stats['migrated']} checks in {stats['elapsed']:.1f}s, {stats['docs_per_sec']:.0f} docs/sec.")
+    before, after = stats['before'], stats['after']
+    if before and after:
+        for key, label in (('avgObjSize', 'Average document'), ('size', 'Data size'),
+                           ('totalIndexSize', 'Index size'), ('storageSize', 'Storage size')):
+            saved = before[key] - after[key]
+            pct = 100.0 * saved / before[key] if before[key] else 0.0
+            value = (lambda v: f"{v:,} B") if key == 'avgObjSize' else _format_bytes
+            click.echo(f"{label}: {value(before[key])} -> {value(after[key])} ({pct:.1f}% saved)")
+        click.echo("Storage size only shrinks once WiredTiger reuses or compacts the freed space (see `compact`).")
+
+
+# --- Expiry reminders (flask reminders ...) ---
+reminders_cli = AppGroup('reminders', help='Find certificates that are about to expire.')
+
+
+@reminders_cli.command('scan')
+@click.option('--days', type=int, default=None, help='Look-ahead window in days (default: REMINDER_DAYS_AHEAD or 7).')
+@click.option('--batch-size', type=int, default=None, help='Checks per batch (default: REMINDER_BATCH_SIZE or 500).')
+@click.option('--restart', is_flag=True, help='Ignore an interrupted run\'s checkpoint and start a new window.')
+def scan_reminders_command(days, batch_size, restart):
+    """Writes reminders for vehicles whose latest certificate expires soon. Resumes interrupted runs."""
+    from .reminders import scan_expiring_checks
+
+    collection = get_collection()
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+
+    stats = scan_expiring_checks(collection,
+                                 days=days or current_app.config.get('REMINDER_DAYS_AHEAD', 7),
+                                 batch_size=batch_size or current_app.config.get('REMINDER_BATCH_SIZE', 500),
+                                 restart=restart)
+    if stats is None:
+        raise click.ClickException("Another reminder scan holds the job lease. Try again later.")
+    click.echo(f"Processed {stats['processed']} checks, created {stats['reminders_created']} reminder(s) "
+               f"in {stats['elapsed']:.1f}s, {stats['docs_per_sec']:.0f} docs/sec.")
+
+
+# --- Cold archive (flask archive ...) ---
+archive_cli = AppGroup('archive', help='Move closed months of checks to compressed files on local disk.')
+
+
+@archive_cli.command('run')
+@click.option('--keep-months', type=int, default=None,
+              help='Closed months to keep in MongoDB before the current one (default: ARCHIVE_KEEP_MONTHS or 13).')
+@click.option('--month', 'months', multiple=True, help='Archive only this IST month (YYYY-MM); repeatable.')
+@click.option('--batch-size', type=int, default=1000, help='Checks deleted from MongoDB per delete_many.')
+def run_archive_command(keep_months, months, batch_size):
+    """Archives every closed month older than the kept ones, oldest first. Resumes interrupted runs."""
+    from .archive import archive_month, archivable_months
+
+    collection = get_collection()
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+    archive = current_app.extensions['archive']
+    if keep_months is None:
+        keep_months = current_app.config.get('ARCHIVE_KEEP_MONTHS', 13)
+
+    try:
+        with archive.exclusive():
+            # Finish interrupted runs first, then everything old enough
+            months = months or sorted(set(archive.interrupted_months()) | set(archivable_months(collection, keep_months)))
+            if not months:
+                click.echo(f"Nothing to archive: no checks older than the last {keep_months} closed months.")
+            for month in months:
+                moved = archive_month(collection, archive, month, batch_size=batch_size)
+                click.echo(f"{month}: archived {moved} checks.")
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+
+@archive_cli.command('status')
+def archive_status_command():
+    """Lists the archived months with their row counts and file sizes."""
+    archive = current_app.extensions['archive']
+    manifest = archive.manifest()
+    if not manifest['months']:
+        click.echo(f"No archived months in {archive.directory}.")
+    for month, entry in sorted(manifest['months'].items()):
+        size = os.path.getsize(os.path.join(archive.directory, entry['file']))
+        click.echo(f"{month}: {entry['rows']} checks, {_format_bytes(size)} ({entry['file']})")
+        if 'deleted' in entry:
+            click.echo(f"{month}: interrupted after deleting {entry['deleted']} of {entry['moved']} checks "
+                       f"from MongoDB, run `flask archive run` to finish.")
+
+
+# --- Prices (flask prices ...) ---
+prices_cli = AppGroup('prices', help='Inspect and publish the price table.')
+
+
+@prices_cli.command('show')
+def show_prices_command():
+    """Lists every price version of the configured source; the one in effect now is marked."""
+    from .pricing import PriceConfigError, price_key
+
+    try:
+        book = current_app.extensions['pricing'].load()
+        current = book.version_at()
+    except PriceConfigError as e:
+        raise click.ClickException(str(e))
+    for version in book.versions:
+        marker = '*' if version is current else ' '
+        prices = ', '.join(f"{price_key(wheels, months)}={price}" for (wheels, months), price in sorted(version.prices.items()))
+        click.echo(f"{marker} from {version.label}: {prices}")
+
+
+@prices_cli.command('publish')
+@click.argument('prices_json', type=click.Path(exists=True, dir_okay=False))
+@click.option('--effective-from', 'effective_from', required=True,
+              help='IST date the prices apply from (YYYY-MM-DD).')
+def publish_prices_command(prices_json, effective_from):
+    """Validates a {"2W_6M": "60", ...} JSON matrix and stores it as a new version (PRICE_SOURCE=mongo)."""
+    from .pricing import publish_price_version, PRICE_VERSIONS_COLLECTION_NAME
+
+    collection = _get_named_collection(PRICE_VERSIONS_COLLECTION_NAME)
+    if collection is None:
+        raise click.ClickException("Database connection is not available. Check server logs.")
+    if current_app.config.get('PRICE_SOURCE') != 'mongo':
+        click.echo("Note: PRICE_SOURCE is not mongo, so the app does not read published versions.", err=True)
+    try:
+        with open(prices_json, encoding='utf-8') as f:
+            version_id = publish_price_version(collection, effective_from, json.load(f))
+    except ValueError as e: # Includes PriceConfigError and invalid JSON or dates
+        raise click.ClickException(str(e))
+    click.echo(f"Published price version {version_id}, effective from {effective_from} (IST). "
+               f"Workers pick it up within PRICE_POLL_SECONDS.")
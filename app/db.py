@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+import pymongo
+from pymongo import MongoClient
+from pymongo.errors import ConfigurationError, PyMongoError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Reconnect backoff after a failed client setup: 1s, 2s, 4s ... capped at 60s
+BACKOFF_INITIAL_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+
+class MongoConnectionManager:
+    """Owns the MongoClient of the current process.
+
+    The client is created lazily on first use and re-created after a fork (the
+    parent's client must not be shared with gunicorn workers), so importing the app
+    never blocks on the network. Setup failures are retried with exponential backoff
+    instead of leaving the process without a database until restart. Callbacks
+    registered with on_connect() run once per process in a background thread, retried
+    with the same backoff, once the server answers.
+    """
+
+    def __init__(self, settings, client_factory=MongoClient, event_listeners=()):
+        self.settings = settings
+        self.client_factory = client_factory
+        self.event_listeners = list(event_listeners)
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+        self._backoff = BACKOFF_INITIAL_SECONDS
+        self._on_connect = []
+        self._hooks_started_pid = None
+        self.last_error = None
+
+    @property
+    def configured(self):
+        """True if every required connection setting is present."""
+        required = ('host', 'port', 'username', 'password', 'auth_source', 'db_name')
+        return all(self.settings.get(key) for key in required)
+
+    def on_connect(self, callback):
+        """Registers callback(db) to run once per process after the server becomes reachable."""
+        self._on_connect.append(callback)
+
+    def _create_client(self):
+        s = self.settings
+        logger.info(f"Creating MongoDB client for {s['host']}:{s['port']} (pid {os.getpid()}, "
+                    f"pool {s.get('min_pool_size', 0)}-{s.get('max_pool_size', 100)}, "
+                    f"read preference {s.get('read_preference', 'primary')}).")
+        return self.client_factory(
+            host=s['host'], port=int(s['port']),
+            username=s['username'], password=s['password'],
+            authSource=s['auth_source'],
+            maxPoolSize=s.get('max_pool_size', 100),
+            minPoolSize=s.get('min_pool_size', 0),
+            waitQueueTimeoutMS=s.get('wait_queue_timeout_ms'),
+            readPreference=s.get('read_preference', 'primary'),
+            serverSelectionTimeoutMS=s.get('server_selection_timeout_ms', 5000),
+            connectTimeoutMS=s.get('connect_timeout_ms', 5000),
+            connect=False, # Defer background monitoring threads until first use (fork safety)
+            event_listeners=self.event_listeners,
+        )
+
+    def get_client(self):
+        """Returns this process's client, creating it if needed. Returns None while backing off."""
+        if not self.configured:
+            return None
+        pid = os.getpid()
+        client = self._client
+        if client is not None and self._pid == pid:
+            return client
+
+        with self._lock:
+            if self._client is not None and self._pid == pid:
+                return self._client
+            if self._client is not None:
+                # Inherited across fork: drop the reference without closing the parent's sockets
+                logger.info(f"Discarding MongoDB client inherited from pid {self._pid}.")
+                self._client = None
+            if time.monotonic() < self._retry_at:
+                return None
+            try:
+                self._client = self._create_client()
+                self._pid = pid
+                self._backoff = BACKOFF_INITIAL_SECONDS
+                self.last_error = None
+            except (ConfigurationError, PyMongoError, ValueError, TypeError) as e:
+                self.last_error = str(e)
+                self._retry_at = time.monotonic() + self._backoff
+                logger.error(f"MongoDB client setup failed, retrying in {self._backoff:.0f}s: {e}")
+                self._backoff = min(self._backoff * 2, BACKOFF_MAX_SECONDS)
+                return None
+
+        self._start_connect_hooks()
+        return self._client
+
+    def get_database(self):
+        """Returns the application database, or None if no client is available."""
+        client = self.get_client()
+        return client[self.settings['db_name']] if client is not None else None
+
+    def get_collection(self, name):
+        """Returns a collection of the application database, or None if no client is available."""
+        db = self.get_database()
+        return db[name] if db is not None else None
+
+    def _start_connect_hooks(self):
+        """Runs the on_connect callbacks once per process, in the background, until they succeed."""
+        pid = os.getpid()
+        if not self._on_connect or self._hooks_started_pid == pid:
+            return
+        self._hooks_started_pid = pid
+
+        def run():
+            backoff = BACKOFF_INITIAL_SECONDS
+            while True:
+                db = self.get_database()
+                try:
+                    if db is not None:
+                        for callback in self._on_connect:
+                            callback(db)
+                        return
+                except PyMongoError as e:
+                    self.last_error = str(e)
+                    logger.warning(f"MongoDB startup tasks failed, retrying in {backoff:.0f}s: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, BACKOFF_MAX_SECONDS)
+
+        threading.Thread(target=run, name='mongo-connect-hooks', daemon=True).start()
+
+    def is_healthy(self, timeout=1.0):
+        """Cheap readiness check: True if the driver can currently reach a readable server.
+
+        Answers from the topology state the driver monitors in the background when it can,
+        and otherwise sends a ping bounded by timeout seconds.
+        """
+        client = self.get_client()
+        if client is None:
+            return False
+        try:
+            if isinstance(client, MongoClient) and client.topology_description.has_readable_server():
+                return True
+            # Monitors only start on the first operation (connect=False) or the server is down
+            with pymongo.timeout(timeout):
+                client.admin.command('ping')
+            return True
+        except PyMongoError as e:
+            self.last_error = str(e)
+            return False
+
+
+def settings_from_env():
+    """Reads the MongoDB connection and pool settings from the environment (.env)."""
+    def int_or_none(name):
+        value = os.getenv(name)
+        return int(value) if value else None
+
+    return {
+        'host': os.getenv('MONGO_IP'),
+        'port': os.getenv('MONGO_PORT'),
+        'username': os.getenv('MONGO_USER'),
+        'password': os.getenv('MONGO_PASS'),
+        'auth_source': os.getenv('MONGO_AUTH_DB'),
+        'db_name': os.getenv('MONGO_DB_NAME'),
+        'max_pool_size': int(os.getenv('MONGO_MAX_POOL_SIZE', '100')),
+        'min_pool_size': int(os.getenv('MONGO_MIN_POOL_SIZE', '0')),
+        'wait_queue_timeout_ms': int_or_none('MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'read_preference': os.getenv('MONGO_READ_PREFERENCE', 'primary'),
+        'server_selection_timeout_ms': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+        'connect_timeout_ms': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+    }
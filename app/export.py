@@ -0,0 +1,108 @@
+import csv
+import heapq
+import io
+import json
+import zlib
+import pytz
+import logging
+
+from .schema import decode_check, stored_projection, V2_FIELDS
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+# Columns written for every exported check, in order
+EXPORT_FIELDS = ['vehicle_no', 'vehicle_type', 'wheels', 'duration_months', 'price', 'check_date', 'expiry_date',
+                 'station_id']
+DATE_FIELDS = ('check_date', 'expiry_date')
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+# Rows are buffered into chunks of roughly this many bytes before being yielded
+CHUNK_BYTES = 64 * 1024
+
+
+def _to_ist_str(dt):
+    """Formats a stored (naive UTC) datetime as an IST timestamp string."""
+    if dt is None:
+        return ''
+    if dt.tzinfo is None:
+        dt = UTC.localize(dt)
+    return dt.astimezone(IST).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def find_checks(collection, start_dt_utc, end_dt_utc, batch_size=5000, archive=None):
+    """Returns an iterator over the checks in [start, end), oldest first, with v1 field names.
+
+    Each schema version is read with its own index-ordered cursor and the two streams are
+    merged, so documents of both versions come out in check_date order without a sort.
+    Checks of archived months are merged in from the archive the same way.
+    """
+    projection = stored_projection(EXPORT_FIELDS)
+    projection['_id'] = 0
+    cursors = [
+        collection.find({date_field: {'$gte': start_dt_utc, '$lt': end_dt_utc}},
+                        projection=projection, batch_size=batch_size).sort(date_field, 1)
+        for date_field in ('check_date', V2_FIELDS['check_date'])
+    ]
+    streams = [map(decode_check, cursor) for cursor in cursors]
+    if archive is not None and archive.covers(start_dt_utc, end_dt_utc):
+        streams.append(archive.iter_checks(start_dt_utc, end_dt_utc))
+    return heapq.merge(*streams, key=lambda check: check['check_date'])
+
+
+def _ist_row(doc):
+    """Returns the export values of a document with its dates converted to IST."""
+    row = {field: doc.get(field) for field in EXPORT_FIELDS}
+    for field in DATE_FIELDS:
+        row[field] = _to_ist_str(row[field])
+    return row
+
+
+def generate_csv(docs):
+    """Yields the documents as CSV text chunks, header first."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for doc in docs:
+        row = _ist_row(doc)
+        writer.writerow(['' if row[field] is None else row[field] for field in EXPORT_FIELDS])
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def generate_ndjson(docs):
+    """Yields the documents as newline-delimited JSON text chunks."""
+    lines, size = [], 0
+    for doc in docs:
+        line = json.dumps(_ist_row(doc), separators=(',', ':')) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield ''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines)
+
+
+def gzip_chunks(chunks):
+    """Compresses a stream of text chunks into a gzip byte stream, one chunk at a time."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # wbits=31 writes a gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(collection, start_dt_utc, end_dt_utc, fmt='csv', compress=False, batch_size=5000, archive=None):
+    """Returns a generator producing the export body for a date range."""
+    docs = find_checks(collection, start_dt_utc, end_dt_utc, batch_size=batch_size, archive=archive)
+    chunks = generate_ndjson(docs) if fmt == 'ndjson' else generate_csv(docs)
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode('utf-8') for chunk in chunks)
@@ -0,0 +1,142 @@
+import csv
+import time
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+import pytz
+import logging
+
+from .checks import validate_check_input, build_check_entry
+from .pricing import PriceConfigError, get_price_book
+from .rollups import apply_entries_to_rollups
+from .stations import validate_station_id
+from .utils import calculate_expiry_date
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+
+# Columns expected in an import file. check_date is optional (IST, 'YYYY-MM-DD HH:MM:SS'
+# or 'YYYY-MM-DD'); rows without it are stamped with the time of the import. station_id is
+# optional too; rows without it get the importing deployment's STATION_ID.
+CSV_COLUMNS = ('vehicle_no', 'vehicle_type', 'wheels', 'duration', 'check_date', 'station_id')
+OPTIONAL_COLUMNS = ('check_date', 'station_id')
+CHECK_DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def build_price_table(when=None):
+    """Returns the {(wheels, duration_months): price} matrix in effect at `when` (default: now)."""
+    return dict(get_price_book().version_at(when).prices)
+
+
+def _parse_check_date(value):
+    """Parses an IST check date from a CSV cell. Returns None if it does not match a known format."""
+    for fmt in CHECK_DATE_FORMATS:
+        try:
+            return IST.localize(datetime.strptime(value, fmt))
+        except ValueError:
+            continue
+    return None
+
+
+def _row_to_entry(row, price_book, schema_options):
+    """Validates one CSV row and prices it as of its check date. Returns (entry, errors)."""
+    errors, cleaned = validate_check_input(row.get('vehicle_no'), (row.get('vehicle_type') or '').strip().lower(),
+                                           row.get('wheels'), (row.get('duration') or '').strip().lower())
+    if errors:
+        return None, errors
+
+    check_date_str = (row.get('check_date') or '').strip()
+    if check_date_str:
+        check_time_ist = _parse_check_date(check_date_str)
+        if check_time_ist is None:
+            return None, [f"Invalid check_date '{check_date_str}' (use YYYY-MM-DD HH:MM:SS, IST)."]
+    else:
+        check_time_ist = datetime.now(IST)
+
+    try:
+        price = price_book.price(cleaned['wheels'], cleaned['duration_months'], check_time_ist)
+    except PriceConfigError as e:
+        return None, [str(e)]
+    if price is None:
+        return None, ["Could not determine price. Check the price configuration."]
+
+    options = schema_options
+    if (row.get('station_id') or '').strip():
+        try:
+            options = {**schema_options, 'station_id': validate_station_id(row['station_id'])}
+        except ValueError as e:
+            return None, [str(e)]
+
+    expiry_time_ist = calculate_expiry_date(check_time_ist, cleaned['duration_months'])
+    entry = build_check_entry(cleaned['vehicle_no'], cleaned['vehicle_type'], cleaned['wheels'],
+                              cleaned['duration_months'], price, check_time_ist, expiry_time_ist,
+                              **options)
+    return entry, []
+
+
+def _flush(batch, collection, rollup_collection, on_error):
+    """Writes one batch with an unordered insert_many. Returns the number of inserted documents."""
+    entries = [entry for _, entry in batch]
+    failed = set()
+    try:
+        collection.insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        for write_error in e.details.get('writeErrors', []):
+            failed.add(write_error['index'])
+            on_error(batch[write_error['index']][0], [f"Database error: {write_error.get('errmsg')}"])
+
+    inserted = [entry for i, entry in enumerate(entries) if i not in failed]
+    if rollup_collection is not None and inserted:
+        try:
+            apply_entries_to_rollups(rollup_collection, inserted)
+        except Exception as e:
+            # The checks are saved; `flask rollups rebuild` repairs the affected days.
+            logger.error(f"Failed to update daily rollups during import: {e}")
+    return len(inserted)
+
+
+def import_checks_csv(stream, collection, rollup_collection=None, batch_size=1000, on_error=None,
+                      schema_options=None):
+    """Streams pollution checks from a CSV file object into MongoDB.
+
+    Rows are validated with the same rules as the data entry form and written in
+    unordered insert_many batches of batch_size, so only one batch is held in memory.
+    on_error(line_number, messages) is called for every rejected row. schema_options are passed
+    to build_check_entry (see checks.schema_options).
+    Returns a dict with rows, inserted, rejected, elapsed seconds and rows_per_sec.
+    """
+    on_error = on_error or (lambda line, messages: None)
+    schema_options = schema_options or {}
+    price_book = get_price_book() # One snapshot for the whole file
+    reader = csv.DictReader(stream)
+    missing = [c for c in CSV_COLUMNS if c not in OPTIONAL_COLUMNS and c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+
+    started = time.perf_counter()
+    rows = inserted = 0
+    batch = []
+    for row in reader:
+        rows += 1
+        entry, errors = _row_to_entry(row, price_book, schema_options)
+        if errors:
+            on_error(reader.line_num, errors)
+            continue
+
+        batch.append((reader.line_num, entry))
+        if len(batch) >= batch_size:
+            inserted += _flush(batch, collection, rollup_collection, on_error)
+            batch = []
+            elapsed = time.perf_counter() - started
+            logger.info(f"Imported {inserted} of {rows} rows ({rows / elapsed:.0f} rows/sec).")
+
+    if batch:
+        inserted += _flush(batch, collection, rollup_collection, on_error)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'rows': rows,
+        'inserted': inserted,
+        'rejected': rows - inserted,
+        'elapsed': elapsed,
+        'rows_per_sec': rows / elapsed if elapsed > 0 else 0.0,
+    }
@@ -0,0 +1,108 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+import logging
+
+from .rollups import ROLLUP_COLLECTION_NAME
+from .reminders import REMINDERS_COLLECTION_NAME
+
+logger = logging.getLogger(__name__)
+
+CHECKS_COLLECTION_NAME = 'pollution_checks'
+
+# --- Index Registry ---
+# Every index the application's queries rely on, per collection. ensure_indexes()
+# creates them idempotently; add new query patterns here rather than ad hoc.
+INDEX_REGISTRY = {
+    CHECKS_COLLECTION_NAME: [
+        # Report range scans. check_date leads, so this also serves plain check_date
+        # range queries, and the trailing fields cover the fields the report reads.
+        # Reports normalise both schema versions in a $project, which fetches documents,
+        # so the trailing fields mainly let the match filter on them without a fetch.
+        IndexModel([('check_date', ASCENDING), ('wheels', ASCENDING), ('duration_months', ASCENDING),
+                    ('vehicle_type', ASCENDING), ('price', ASCENDING)],
+                   name='check_date_report_fields'),
+        # Expiry reminder scans walk this in (expiry_date, _id) order to resume from a checkpoint
+        IndexModel([('expiry_date', ASCENDING), ('_id', ASCENDING)], name='expiry_date_1__id_1'),
+        # Vehicle lookups: latest check for a plate, prefix search
+        IndexModel([('vehicle_no', ASCENDING), ('check_date', DESCENDING)], name='vehicle_no_1_check_date_-1'),
+        # The same three access paths for compact (schema v2) documents. Partial, so each
+        # index only holds the documents of its own schema version while both coexist.
+        IndexModel([('cd', ASCENDING), ('w', ASCENDING), ('dm', ASCENDING), ('ft', ASCENDING), ('pp', ASCENDING)],
+                   name='cd_report_fields', partialFilterExpression={'cd': {'$exists': True}}),
+        IndexModel([('ed', ASCENDING), ('_id', ASCENDING)], name='ed_1__id_1',
+                   partialFilterExpression={'ed': {'$exists': True}}),
+        IndexModel([('vn', ASCENDING), ('cd', DESCENDING)], name='vn_1_cd_-1',
+                   partialFilterExpression={'vn': {'$exists': True}}),
+        # One station's checks in a date range (station reports, see app/stations.py). Partial,
+        # so checks recorded without a station take no space in them.
+        IndexModel([('station_id', ASCENDING), ('check_date', ASCENDING)], name='station_id_1_check_date_1',
+                   partialFilterExpression={'station_id': {'$exists': True}}),
+        IndexModel([('st', ASCENDING), ('cd', ASCENDING)], name='st_1_cd_1',
+                   partialFilterExpression={'st': {'$exists': True}}),
+    ],
+    ROLLUP_COLLECTION_NAME: [
+        IndexModel([('day_start', ASCENDING)], name='day_start_1'),
+    ],
+    REMINDERS_COLLECTION_NAME: [
+        # Notification senders pick up pending reminders in expiry order
+        IndexModel([('status', ASCENDING), ('expiry_date', ASCENDING)], name='status_1_expiry_date_1'),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """Creates every registered index that does not exist yet. Safe to run repeatedly.
+
+    Returns a dict of collection name -> list of index names confirmed.
+    """
+    ensured = {}
+    for collection_name, models in INDEX_REGISTRY.items():
+        try:
+            ensured[collection_name] = db[collection_name].create_indexes(models)
+            logger.info(f"Indexes ensured on '{collection_name}': {', '.join(ensured[collection_name])}")
+        except OperationFailure as e:
+            # Typically an existing index with the same name but a different definition
+            logger.error(f"Could not ensure indexes on '{collection_name}': {e}")
+    return ensured
+
+
+def _find_stages(plan, stage_name):
+    """Recursively collects every plan node whose 'stage' is stage_name."""
+    found = []
+    if isinstance(plan, dict):
+        if plan.get('stage') == stage_name:
+            found.append(plan)
+        for value in plan.values():
+            found.extend(_find_stages(value, stage_name))
+    elif isinstance(plan, list):
+        for item in plan:
+            found.extend(_find_stages(item, stage_name))
+    return found
+
+
+def explain_pipeline(collection, pipeline):
+    """Returns the queryPlanner explain output of an aggregation pipeline."""
+    return collection.database.command(
+        'explain',
+        {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+        verbosity='queryPlanner',
+    )
+
+
+def check_pipeline_plan(collection, pipeline):
+    """Explains a pipeline and logs a warning if the winning plan falls back to a collection scan.
+
+    Returns True if the plan uses an index, False on COLLSCAN, None if explain failed.
+    """
+    try:
+        explain = explain_pipeline(collection, pipeline)
+    except Exception as e:
+        logger.error(f"Could not explain pipeline on '{collection.name}': {e}")
+        return None
+
+    if _find_stages(explain, 'COLLSCAN'):
+        logger.warning(f"Query plan for '{collection.name}' uses COLLSCAN. "
+                       f"Run `flask indexes ensure` or review INDEX_REGISTRY. Pipeline: {pipeline}")
+        return False
+    logger.info(f"Query plan for '{collection.name}' uses an index.")
+    return True
@@ -0,0 +1,166 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+import pytz
+import logging
+
+from .rollups import read_day_counters
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+
+# Events buffered per subscriber; a client that falls this far behind is disconnected
+# (its EventSource reconnects and starts again from a fresh snapshot).
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_SECONDS = 15 # Comment lines keep proxies from closing an idle stream
+
+
+def _today_key():
+    return datetime.now(IST).strftime('%Y-%m-%d')
+
+
+class Subscription:
+    """One viewer's buffered events. closed is set when the viewer is dropped for falling behind."""
+
+    def __init__(self):
+        self.events = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.closed = False
+
+
+class LiveCounters:
+    """In-process pub/sub of today's report counters, for the /reports/live event stream.
+
+    One upstream thread per worker process reads today's daily rollup document and
+    publishes the counters that changed to every subscriber. It reads straight away
+    when nudge() is called after a local insert, and every poll_seconds to pick up
+    checks saved by other workers, but only while someone is subscribed. Database
+    load is therefore one small read per insert (or poll), however many viewers there are.
+
+    Subscribers get a 'snapshot' event with all of today's counters first, then 'delta'
+    events with the change of each counter that moved. A new IST day starts with a
+    fresh snapshot.
+    """
+
+    def __init__(self, app, get_rollup_collection, poll_seconds=2.0):
+        self.app = app
+        self.get_rollup_collection = get_rollup_collection
+        self.poll_seconds = poll_seconds
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _reset(self):
+        """Per-process state; a forked child must not share the parent's thread or subscribers."""
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = set()
+        self._day = None
+        self._counters = None
+
+    def _ensure_started(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._reset()
+            self._pid = pid
+            threading.Thread(target=self._run, name='live-counters', daemon=True).start()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers) if self._pid == os.getpid() else 0
+
+    def subscribe(self):
+        """Returns a Subscription receiving (event, data) tuples; pass it to unsubscribe() when done."""
+        self._ensure_started()
+        subscriber = Subscription()
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._counters is not None:
+                subscriber.events.put_nowait(('snapshot', {'day': self._day, 'counters': dict(self._counters)}))
+        self._wake.set() # Refresh now rather than on the next poll
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def nudge(self):
+        """Tells the upstream that today's counters changed (called after local inserts)."""
+        if self._pid == os.getpid() and self._subscribers:
+            self._wake.set()
+
+    def _publish(self, event, data):
+        """Sends an event to every subscriber. Caller holds self._lock."""
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.events.put_nowait((event, data))
+            except queue.Full:
+                logger.warning("Dropping a live report subscriber that stopped reading.")
+                self._subscribers.discard(subscriber)
+                subscriber.closed = True
+
+    def _refresh(self):
+        rollup_collection = self.get_rollup_collection()
+        if rollup_collection is None:
+            return
+        day = _today_key()
+        counters = read_day_counters(rollup_collection, day)
+        with self._lock:
+            if day != self._day or self._counters is None:
+                self._day, self._counters = day, counters
+                self._publish('snapshot', {'day': day, 'counters': dict(counters)})
+                return
+            delta = {field: value - self._counters[field] for field, value in counters.items()
+                     if value != self._counters[field]}
+            if delta:
+                self._counters = counters
+                self._publish('delta', {'day': day, 'delta': delta})
+
+    def _run(self):
+        while True:
+            # Sleep until nudged, polling only while there are subscribers
+            self._wake.wait(self.poll_seconds if self._subscribers else None)
+            self._wake.clear()
+            if not self._subscribers:
+                with self._lock:
+                    self._counters = None # Re-read when the next viewer arrives
+                continue
+            try:
+                with self.app.app_context():
+                    self._refresh()
+            except Exception as e:
+                logger.error(f"Could not refresh live report counters: {e}")
+
+
+def format_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def event_stream(live, max_seconds):
+    """Yields the Server-Sent Events of one viewer for up to max_seconds.
+
+    Ending the stream periodically frees the worker thread; the browser's EventSource
+    reconnects by itself (after the retry delay sent first) and gets a fresh snapshot.
+    """
+    subscriber = live.subscribe()
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield "retry: 3000\n\n"
+        while not subscriber.closed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event, data = subscriber.events.get(timeout=min(KEEPALIVE_SECONDS, remaining))
+            except queue.Empty:
+                yield ": keepalive\n\n"
+                continue
+            yield format_event(event, data)
+    finally:
+        live.unsubscribe(subscriber)
@@ -0,0 +1,109 @@
+import heapq
+import os
+import re
+import time
+from datetime import datetime
+import pytz
+import logging
+
+from .cache import LRUCache
+from .schema import decode_check, stored_projection, V2_FIELDS
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+LOOKUP_FIELDS = ['vehicle_no', 'vehicle_type', 'wheels', 'duration_months', 'check_date', 'expiry_date']
+LOOKUP_PROJECTION = {**stored_projection(LOOKUP_FIELDS), '_id': 0}
+# (plate field, check date field) of each schema version
+SCHEMA_KEYS = [('vehicle_no', 'check_date'), (V2_FIELDS['vehicle_no'], V2_FIELDS['check_date'])]
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_RESULTS = 50
+
+# Recently looked-up plates -> (latest check document or None, cached_at).
+# dashboard1 drops a plate from here whenever it records a new check for it.
+LOOKUP_CACHE = LRUCache(max_items=int(os.getenv('LOOKUP_CACHE_MAX_ITEMS', '4096')))
+LOOKUP_CACHE_TTL = int(os.getenv('LOOKUP_CACHE_TTL_SECONDS', '60'))
+
+
+def _as_utc(dt):
+    """PyMongo returns naive UTC datetimes by default; make them timezone aware."""
+    return UTC.localize(dt) if dt.tzinfo is None else dt.astimezone(UTC)
+
+
+def normalize_vehicle_no(vehicle_no):
+    """Normalises a plate the same way dashboard1 stores it."""
+    return (vehicle_no or '').strip().upper()
+
+
+def serialize_check(doc, now=None):
+    """Returns a JSON-friendly view of a check, with IST dates and certificate validity."""
+    now = now or datetime.now(UTC)
+    expiry = _as_utc(doc['expiry_date']) if doc.get('expiry_date') else None
+    return {
+        'vehicle_no': doc.get('vehicle_no'),
+        'vehicle_type': doc.get('vehicle_type'),
+        'wheels': doc.get('wheels'),
+        'duration_months': doc.get('duration_months'),
+        'check_date': _as_utc(doc['check_date']).astimezone(IST).isoformat() if doc.get('check_date') else None,
+        'expiry_date': expiry.astimezone(IST).isoformat() if expiry else None,
+        'is_valid': bool(expiry and expiry > now),
+        'days_remaining': max((expiry - now).days, 0) if expiry else 0,
+    }
+
+
+def _sort_key(check):
+    """Plate ascending, then newest check first."""
+    return check['vehicle_no'], -_as_utc(check['check_date']).timestamp()
+
+
+def latest_check(collection, vehicle_no):
+    """Returns the most recent check for an exact plate (v1 field names), or None.
+
+    Served by the (plate, check date desc) index of each schema version, one index seek each.
+    """
+    cached = LOOKUP_CACHE.get(vehicle_no)
+    if cached is not None and time.monotonic() - cached[1] < LOOKUP_CACHE_TTL:
+        return cached[0]
+
+    found = [decode_check(collection.find_one({plate_field: vehicle_no}, projection=LOOKUP_PROJECTION,
+                                              sort=[(date_field, -1)]))
+             for plate_field, date_field in SCHEMA_KEYS]
+    found = [check for check in found if check is not None]
+    doc = min(found, key=_sort_key) if found else None
+    LOOKUP_CACHE.put(vehicle_no, (doc, time.monotonic()))
+    return doc
+
+
+def search_prefix(collection, prefix, limit=10):
+    """Returns the latest check of up to limit plates starting with prefix, in plate order.
+
+    The anchored, case-sensitive regex becomes a bounded range scan on the
+    (vehicle_no, check_date desc) index. The cursor is abandoned as soon as
+    enough distinct plates have been seen.
+    """
+    limit = max(1, min(limit, MAX_PREFIX_RESULTS))
+    cursors = [collection.find({plate_field: {'$regex': '^' + re.escape(prefix)}},
+                               projection=LOOKUP_PROJECTION, batch_size=limit * 4)
+               .sort([(plate_field, 1), (date_field, -1)])
+               for plate_field, date_field in SCHEMA_KEYS]
+    results = []
+    last_plate = None
+    try:
+        # Both cursors are in (plate, newest first) order; merging keeps that order across versions
+        for doc in heapq.merge(*(map(decode_check, cursor) for cursor in cursors), key=_sort_key):
+            if doc.get('vehicle_no') == last_plate:
+                continue # Older check of a plate we already have
+            last_plate = doc.get('vehicle_no')
+            results.append(doc)
+            if len(results) >= limit:
+                break
+    finally:
+        for cursor in cursors:
+            cursor.close()
+    return results
+
+
+def invalidate_vehicle(vehicle_no):
+    """Drops a plate from the lookup cache after a new check was recorded for it."""
+    LOOKUP_CACHE.pop(vehicle_no)
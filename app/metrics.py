@@ -0,0 +1,217 @@
+import bisect
+import functools
+import threading
+import time
+from collections import defaultdict
+from flask import g, has_request_context, request, before_render_template, template_rendered
+from pymongo import monitoring
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond Mongo round-trips to slow reports
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Endpoints that get a Server-Timing header when SERVER_TIMING is enabled
+SERVER_TIMING_ENDPOINTS = ('main.dashboard1', 'main.dashboard2')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, escaped)) + '}'
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(label_names)
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with optional labels, rendered in Prometheus text format."""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help_text, self.label_names = name, help_text, tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    labels = _format_labels(self.label_names + ('le',), label_values + (repr(bound),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.label_names + ('le',), label_values + ('+Inf',))
+                lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+                base = _format_labels(self.label_names, label_values)
+                lines.append(f'{self.name}_sum{base} {series[-2]}')
+                lines.append(f'{self.name}_count{base} {series[-1]}')
+        return lines
+
+
+class Registry:
+    """Holds metrics plus gauge callbacks that are evaluated at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = {} # name -> (help, label_names, callback returning {label values: value})
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_gauge(self, name, help_text, callback, label_names=()):
+        """Adds a gauge, or replaces the one of the same name (e.g. from a previous create_app)."""
+        self._gauges[name] = (help_text, tuple(label_names), callback)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, (help_text, label_names, callback) in self._gauges.items():
+            lines.extend([f'# HELP {name} {help_text}', f'# TYPE {name} gauge'])
+            try:
+                for label_values, value in sorted(callback().items()):
+                    lines.append(f'{name}{_format_labels(label_names, label_values)} {value}')
+            except Exception as e:
+                logger.error(f"Metrics gauge {name} failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', 'HTTP requests handled.', ('endpoint', 'method', 'status')))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ('endpoint', 'method')))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    'mongo_command_duration_seconds', 'MongoDB command round-trip time.', ('command',)))
+MONGO_FAILURES = REGISTRY.register(Counter(
+    'mongo_command_failures_total', 'MongoDB commands that returned an error.', ('command',)))
+FUNCTION_LATENCY = REGISTRY.register(Histogram(
+    'app_function_duration_seconds', 'Time spent in instrumented application functions.', ('function',)))
+TEMPLATE_LATENCY = REGISTRY.register(Histogram(
+    'template_render_duration_seconds', 'Jinja template rendering time.', ('template',)))
+WRITE_BEHIND_FLUSH_LATENCY = REGISTRY.register(Histogram(
+    'write_behind_flush_duration_seconds', 'Time to insert one write-behind batch into MongoDB.'))
+WRITE_BEHIND_FLUSHED = REGISTRY.register(Counter(
+    'write_behind_flushed_total', 'Checks inserted into MongoDB by the write-behind queue.'))
+WRITE_BEHIND_FAILURES = REGISTRY.register(Counter(
+    'write_behind_flush_failures_total', 'Write-behind batches that failed and were retried.'))
+WRITE_BEHIND_DEAD_LETTERED = REGISTRY.register(Counter(
+    'write_behind_dead_lettered_total', 'Checks MongoDB refused for good, moved to the dead-letter file.'))
+
+
+def _add_server_timing(name, seconds):
+    """Accumulates time spent in a phase of the current request for the Server-Timing header."""
+    if has_request_context():
+        timings = g.setdefault('server_timings', defaultdict(float))
+        timings[name] += seconds
+
+
+def timed(name):
+    """Decorator recording a function's latency under app_function_duration_seconds{function=name}."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                FUNCTION_LATENCY.observe(elapsed, name)
+                _add_server_timing(name, elapsed)
+        return wrapper
+    return decorator
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Records the duration of every MongoDB command sent by the client."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.observe(seconds, event.command_name)
+        _add_server_timing('mongo', seconds)
+
+    def failed(self, event):
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.observe(seconds, event.command_name)
+        MONGO_FAILURES.inc(event.command_name)
+        _add_server_timing('mongo', seconds)
+
+
+def render_metrics():
+    """Returns every registered metric in Prometheus text exposition format."""
+    return REGISTRY.render()
+
+
+def init_app(app):
+    """Registers request timing hooks, template timing and the Server-Timing header on the app."""
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_LATENCY.observe(elapsed, endpoint, request.method)
+        HTTP_REQUESTS.inc(endpoint, request.method, str(response.status_code))
+
+        if app.config.get('SERVER_TIMING') and endpoint in SERVER_TIMING_ENDPOINTS:
+            timings = g.get('server_timings') or {}
+            parts = [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items()]
+            parts.append(f'total;dur={elapsed * 1000:.2f}')
+            response.headers['Server-Timing'] = ', '.join(parts)
+        return response
+
+    def _template_started(sender, template, context, **extra):
+        g.setdefault('template_started', {})[template.name] = time.perf_counter()
+
+    def _template_finished(sender, template, context, **extra):
+        started = g.get('template_started', {}).pop(template.name, None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            TEMPLATE_LATENCY.observe(elapsed, template.name or 'string')
+            _add_server_timing('template', elapsed)
+
+    # weak=False: the receivers are closures that would otherwise be garbage collected
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
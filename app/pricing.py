@@ -0,0 +1,292 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from dotenv import dotenv_values, find_dotenv
+from flask import current_app
+from pymongo.errors import PyMongoError
+import pytz
+import logging
+
+from .checks import DURATION_MONTHS, VALID_WHEELS
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+# --- Price tables ---
+# A price version is the full wheels x duration matrix plus the moment it takes effect.
+# Versions come from one source (PRICE_SOURCE):
+#   env   - PRICE_<w>W_<m>M variables; a single version in effect since forever. Edits to .env
+#           are picked up without a restart.
+#   file  - a JSON file (PRICE_FILE): {"versions": [{"effective_from": "YYYY-MM-DD", "prices": {"2W_6M": "60", ...}}]}
+#           effective_from is an IST date (the version applies from its midnight).
+#   mongo - documents in the price_versions collection, published with `flask prices publish`.
+# Every version is validated when loaded: a missing, non-numeric or non-positive price is an error.
+PRICE_SOURCES = ('env', 'file', 'mongo')
+PRICE_VERSIONS_COLLECTION_NAME = 'price_versions'
+ALWAYS = UTC.localize(datetime(1970, 1, 1))
+ENV_PRICE_PATTERN = re.compile(r'^PRICE_(\d+W_\d+M)$') # Not PRICE_SOURCE, PRICE_FILE, ...
+
+
+class PriceConfigError(ValueError):
+    """A price version is incomplete or invalid, or no version is in effect."""
+
+
+def price_key(wheels, duration_months):
+    """Matrix key of a combination, e.g. '2W_6M' (the env variable is PRICE_2W_6M)."""
+    return f"{wheels}W_{duration_months}M"
+
+
+def parse_matrix(raw, where):
+    """Validates a {'2W_6M': '60', ...} mapping and returns {(wheels, duration_months): Decimal}.
+
+    Every combination of VALID_WHEELS and DURATION_MONTHS must have a positive price
+    with at most two decimal places. Raises PriceConfigError listing every problem.
+    """
+    prices, problems = {}, []
+    expected = set()
+    for wheels in VALID_WHEELS:
+        for duration_months in DURATION_MONTHS.values():
+            key = price_key(wheels, duration_months)
+            expected.add(key)
+            value = raw.get(key)
+            if value is None or not str(value).strip():
+                problems.append(f"{key} is missing")
+                continue
+            try:
+                price = Decimal(str(value).strip())
+            except InvalidOperation:
+                problems.append(f"{key}={value!r} is not a number")
+                continue
+            if not price.is_finite() or price <= 0 or price != price.quantize(Decimal('0.01')):
+                problems.append(f"{key}={value} must be a positive amount with at most 2 decimals")
+                continue
+            prices[(wheels, duration_months)] = price
+    problems.extend(f"{key} is not a known combination" for key in sorted(set(raw) - expected))
+    if problems:
+        raise PriceConfigError(f"Invalid prices in {where}: {'; '.join(problems)}.")
+    return prices
+
+
+def _ist_midnight_utc(date_str):
+    return IST.localize(datetime.strptime(date_str, '%Y-%m-%d')).astimezone(UTC)
+
+
+class PriceVersion:
+    """One validated price matrix and the moment (UTC) it takes effect."""
+
+    def __init__(self, effective_from, prices, label):
+        self.effective_from = effective_from
+        self.prices = prices
+        self.label = label
+
+
+class PriceBook:
+    """All price versions of a source, ordered by effective date.
+
+    price() is a bisect over the (few) versions plus a dict lookup; bulk callers can
+    hold on to version_at(...).prices for plain dict lookups.
+    """
+
+    def __init__(self, versions):
+        if not versions:
+            raise PriceConfigError("No price versions are configured.")
+        self.versions = sorted(versions, key=lambda version: version.effective_from)
+        self._starts = [version.effective_from for version in self.versions]
+
+    def version_at(self, when=None):
+        """Returns the PriceVersion in effect at `when` (aware datetime, default now)."""
+        when = when or datetime.now(UTC)
+        if when.tzinfo is None:
+            when = UTC.localize(when)
+        index = bisect.bisect_right(self._starts, when) - 1
+        if index < 0:
+            raise PriceConfigError(f"No price version is in effect at {when.isoformat()}.")
+        return self.versions[index]
+
+    def price(self, wheels, duration_months, when=None):
+        """Returns the Decimal price of a combination at `when`, or None if it is not a priced combination."""
+        return self.version_at(when).prices.get((wheels, duration_months))
+
+
+class EnvPriceSource:
+    """PRICE_* environment variables; edits to the .env file are picked up by mtime.
+
+    The first load uses the process environment (where python-dotenv put the .env
+    values at startup); once .env changes, its PRICE_* values win.
+    """
+
+    def __init__(self, dotenv_path=None):
+        self.dotenv_path = dotenv_path if dotenv_path is not None else find_dotenv(usecwd=True)
+        self._startup_token = self.token()
+
+    def token(self):
+        try:
+            return os.stat(self.dotenv_path).st_mtime_ns if self.dotenv_path else None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _matrix(variables):
+        return {match.group(1): value for match, value in
+                ((ENV_PRICE_PATTERN.match(name), value) for name, value in variables.items()) if match}
+
+    def load(self):
+        raw = self._matrix(os.environ)
+        if self.dotenv_path and self.token() != self._startup_token:
+            raw.update(self._matrix(dotenv_values(self.dotenv_path)))
+        return [PriceVersion(ALWAYS, parse_matrix(raw, 'PRICE_* settings'), 'env')]
+
+
+class FilePriceSource:
+    """Effective-dated versions from a JSON file, reloaded when its mtime changes."""
+
+    def __init__(self, path):
+        if not path:
+            raise PriceConfigError("PRICE_SOURCE=file needs PRICE_FILE to be set.")
+        self.path = path
+
+    def token(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise PriceConfigError(f"Could not read price file {self.path}: {e}") from None
+        if not isinstance(data, dict) or not isinstance(data.get('versions', []), list):
+            raise PriceConfigError(f"Price file {self.path} must be an object with a list of versions.")
+        versions = []
+        for i, version in enumerate(data.get('versions', [])):
+            where = f"{self.path} version {i + 1}"
+            if not isinstance(version, dict) or not isinstance(version.get('prices') or {}, dict):
+                raise PriceConfigError(f"{where} must be an object with an effective_from date and a prices object.")
+            try:
+                effective_from = _ist_midnight_utc(version['effective_from'])
+            except (KeyError, TypeError, ValueError):
+                raise PriceConfigError(f"{where} needs an effective_from date (YYYY-MM-DD).") from None
+            versions.append(PriceVersion(effective_from, parse_matrix(version.get('prices') or {}, where),
+                                         version['effective_from']))
+        return versions
+
+
+class MongoPriceSource:
+    """Effective-dated versions from the price_versions collection.
+
+    Versions are append-only (publish a new one to change prices), so the number of
+    documents and the newest _id identify the collection's state cheaply.
+    """
+
+    def __init__(self, get_collection):
+        self.get_collection = get_collection
+
+    def _collection(self):
+        collection = self.get_collection()
+        if collection is None:
+            raise PriceConfigError("Database connection is not available to load prices.")
+        return collection
+
+    def token(self):
+        try:
+            state = list(self._collection().aggregate([
+                {'$group': {'_id': None, 'count': {'$sum': 1}, 'newest': {'$max': '$_id'}}},
+            ]))
+        except PyMongoError as e:
+            raise PriceConfigError(f"Could not read price versions: {e}") from None
+        return (state[0]['count'], state[0]['newest']) if state else None
+
+    def load(self):
+        try:
+            docs = list(self._collection().find())
+        except PyMongoError as e:
+            raise PriceConfigError(f"Could not read price versions: {e}") from None
+        versions = []
+        for doc in docs:
+            effective_from = doc.get('effective_from')
+            if not isinstance(effective_from, datetime):
+                raise PriceConfigError(f"price version {doc['_id']} needs an effective_from date.")
+            if effective_from.tzinfo is None:
+                effective_from = UTC.localize(effective_from)
+            versions.append(PriceVersion(effective_from, parse_matrix(doc.get('prices') or {}, f"price version {doc['_id']}"),
+                                         effective_from.astimezone(IST).strftime('%Y-%m-%d')))
+        return versions
+
+
+class PriceTable:
+    """The app's prices: a validated PriceBook, refreshed from its source without a restart.
+
+    book() checks the source's change token at most every poll_seconds (a stat() or one
+    small aggregation) and reloads only when it changed. A reload that fails validation
+    is logged and the previous prices stay in use.
+    """
+
+    def __init__(self, source, poll_seconds=5.0):
+        self.source = source
+        self.poll_seconds = poll_seconds
+        self._book = None
+        self._token = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Loads and validates every version now. Raises PriceConfigError."""
+        token = self.source.token()
+        self._book = PriceBook(self.source.load())
+        self._token, self._checked_at = token, time.monotonic()
+        logger.info(f"Loaded {len(self._book.versions)} price version(s) from {type(self.source).__name__}.")
+        return self._book
+
+    def book(self):
+        """Returns the current PriceBook, reloading it first if the source changed."""
+        if self._book is None:
+            return self.load()
+        # One thread per process polls; the others keep using the current book meanwhile
+        if time.monotonic() - self._checked_at >= self.poll_seconds and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = time.monotonic()
+                if self.source.token() != self._token:
+                    self.load()
+            except Exception as e:
+                logger.error(f"Keeping the current prices, reloading them failed: {e}")
+            finally:
+                self._lock.release()
+        return self._book
+
+
+def create_price_table(config, get_collection):
+    """Builds the PriceTable for the PRICE_SOURCE in config."""
+    source_name = config.get('PRICE_SOURCE', 'env')
+    if source_name == 'file':
+        source = FilePriceSource(config.get('PRICE_FILE'))
+    elif source_name == 'mongo':
+        source = MongoPriceSource(lambda: get_collection(PRICE_VERSIONS_COLLECTION_NAME))
+    elif source_name == 'env':
+        source = EnvPriceSource()
+    else:
+        raise PriceConfigError(f"PRICE_SOURCE must be one of: {', '.join(PRICE_SOURCES)}.")
+    return PriceTable(source, poll_seconds=config.get('PRICE_POLL_SECONDS', 5.0))
+
+
+def get_price_book():
+    """The PriceBook of the current app."""
+    return current_app.extensions['pricing'].book()
+
+
+def publish_price_version(collection, effective_from_ist_date, raw_prices):
+    """Validates a matrix and stores it as a new version taking effect at the given IST date. Returns its _id."""
+    prices = parse_matrix(raw_prices, 'the new price version')
+    doc = {
+        'effective_from': _ist_midnight_utc(effective_from_ist_date),
+        'prices': {price_key(wheels, months): str(price) for (wheels, months), price in prices.items()},
+        'created_at': datetime.now(UTC),
+    }
+    return collection.insert_one(doc).inserted_id
@@ -0,0 +1,181 @@
+import heapq
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import pytz
+import logging
+
+from .schema import decode_check, match_either, normalize_stage, stored_projection, V2_FIELDS
+
+logger = logging.getLogger(__name__)
+UTC = pytz.utc
+
+REMINDERS_COLLECTION_NAME = 'expiry_reminders'
+CHECKPOINTS_COLLECTION_NAME = 'job_checkpoints'
+JOB_ID = 'expiry_reminder_scan'
+LEASE_SECONDS = 300 # A crashed run releases its lease after this long
+
+
+def _acquire_lease(checkpoints, owner, now):
+    """Claims the scan job so only one process walks the range at a time. Returns True on success."""
+    try:
+        checkpoints.update_one(
+            {'_id': JOB_ID, '$or': [{'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now}}]},
+            {'$set': {'lease_owner': owner, 'lease_until': now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        # The job document exists and its lease is still held by another run
+        return False
+
+
+def _latest_check_ids(collection, vehicle_nos):
+    """Returns {vehicle_no: _id of its most recent check} using the (plate, check date) indexes."""
+    pipeline = [
+        {'$match': match_either('vehicle_no', {'$in': list(vehicle_nos)})},
+        normalize_stage(),
+        {'$sort': {'vehicle_no': 1, 'check_date': -1}},
+        {'$group': {'_id': '$vehicle_no', 'latest_id': {'$first': '$_id'}}},
+    ]
+    return {doc['_id']: doc['latest_id'] for doc in collection.aggregate(pipeline)}
+
+
+def _expiring_batch(collection, state, batch_size):
+    """Returns the next batch_size checks after the checkpoint, in (expiry_date, _id) order.
+
+    Each schema version is read from its own (expiry date, _id) index and the two sorted
+    batches are merged. Checks whose v2 document does not store an expiry date are not seen.
+    """
+    batches = []
+    for expiry_field in ('expiry_date', V2_FIELDS['expiry_date']):
+        query = {expiry_field: {'$gte': state['window_start'], '$lt': state['window_end']}}
+        if state['last_id'] is not None:
+            query['$or'] = [
+                {expiry_field: {'$gt': state['last_expiry']}},
+                {expiry_field: state['last_expiry'], '_id': {'$gt': state['last_id']}},
+            ]
+        cursor = (collection.find(query, projection=stored_projection(['vehicle_no', 'expiry_date', 'check_date']))
+                  .sort([(expiry_field, 1), ('_id', 1)])
+                  .limit(batch_size))
+        batches.append(map(decode_check, cursor))
+    merged = heapq.merge(*batches, key=lambda check: (check['expiry_date'], check['_id']))
+    return [check for _, check in zip(range(batch_size), merged)]
+
+
+def scan_expiring_checks(collection, days=7, batch_size=500, restart=False, now=None):
+    """Writes a reminder for every vehicle whose latest certificate expires within the next `days` days.
+
+    Walks the (expiry_date, _id) index in batches and persists a checkpoint after each one,
+    so an interrupted run resumes where it stopped. Reminders are keyed by the check _id,
+    which makes re-running a window idempotent. Returns a stats dict, or None if another
+    run holds the job lease.
+    """
+    db = collection.database
+    checkpoints = db[CHECKPOINTS_COLLECTION_NAME]
+    reminders = db[REMINDERS_COLLECTION_NAME]
+    now = now or datetime.now(UTC)
+    owner = uuid.uuid4().hex
+
+    if not _acquire_lease(checkpoints, owner, now):
+        logger.info("Expiry reminder scan is already running elsewhere. Skipping.")
+        return None
+
+    try:
+        state = checkpoints.find_one({'_id': JOB_ID}) or {}
+        if restart or state.get('status') != 'running':
+            # Start a new window; otherwise resume the interrupted one from its checkpoint
+            state = {
+                'status': 'running',
+                'window_start': now,
+                'window_end': now + timedelta(days=days),
+                'last_expiry': None,
+                'last_id': None,
+                'processed': 0,
+                'reminders_created': 0,
+                'started_at': now,
+            }
+            checkpoints.update_one({'_id': JOB_ID}, {'$set': state})
+        else:
+            logger.info(f"Resuming expiry reminder scan after {state.get('last_expiry')} / {state.get('last_id')}.")
+
+        started = time.perf_counter()
+        processed = created = 0
+        while True:
+            batch = _expiring_batch(collection, state, batch_size)
+            if not batch:
+                break
+
+            latest_ids = _latest_check_ids(collection, {doc['vehicle_no'] for doc in batch})
+            upserts = [
+                UpdateOne({'_id': f"{doc['vehicle_no']}:{doc['_id']}"},
+                          {'$setOnInsert': {
+                              'vehicle_no': doc['vehicle_no'],
+                              'check_id': doc['_id'],
+                              'check_date': doc.get('check_date'),
+                              'expiry_date': doc['expiry_date'],
+                              'status': 'pending',
+                              'created_at': datetime.now(UTC),
+                          }},
+                          upsert=True)
+                for doc in batch
+                # A newer check for the same vehicle supersedes this certificate
+                if latest_ids.get(doc['vehicle_no']) == doc['_id']
+            ]
+            batch_created = reminders.bulk_write(upserts, ordered=False).upserted_count if upserts else 0
+            created += batch_created
+            processed += len(batch)
+
+            state['last_expiry'] = batch[-1]['expiry_date']
+            state['last_id'] = batch[-1]['_id']
+            checkpoints.update_one({'_id': JOB_ID, 'lease_owner': owner}, {
+                '$set': {'last_expiry': state['last_expiry'], 'last_id': state['last_id'],
+                         'lease_until': datetime.now(UTC) + timedelta(seconds=LEASE_SECONDS)},
+                '$inc': {'processed': len(batch), 'reminders_created': batch_created},
+            })
+            elapsed = time.perf_counter() - started
+            logger.info(f"Expiry reminder scan: {processed} checks processed ({processed / elapsed:.0f} docs/sec).")
+
+            if len(batch) < batch_size:
+                break
+
+        elapsed = time.perf_counter() - started
+        checkpoints.update_one({'_id': JOB_ID}, {'$set': {'status': 'completed', 'completed_at': datetime.now(UTC)}})
+        return {
+            'processed': processed,
+            'reminders_created': created,
+            'elapsed': elapsed,
+            'docs_per_sec': processed / elapsed if elapsed > 0 else 0.0,
+        }
+    finally:
+        checkpoints.update_one({'_id': JOB_ID, 'lease_owner': owner}, {'$unset': {'lease_owner': '', 'lease_until': ''}})
+
+
+def start_reminder_scheduler(app, get_collection, interval_minutes):
+    """Runs the expiry reminder scan every interval_minutes in a daemon thread.
+
+    Safe to start in every worker: the job lease lets only one process scan at a time.
+    """
+    def run():
+        while True:
+            time.sleep(interval_minutes * 60)
+            with app.app_context():
+                collection = get_collection()
+                if collection is None:
+                    continue
+                try:
+                    stats = scan_expiring_checks(collection,
+                                                 days=app.config.get('REMINDER_DAYS_AHEAD', 7),
+                                                 batch_size=app.config.get('REMINDER_BATCH_SIZE', 500))
+                    if stats:
+                        logger.info(f"Scheduled expiry reminder scan finished: {stats}")
+                except Exception as e:
+                    logger.error(f"Scheduled expiry reminder scan failed: {e}", exc_info=True)
+
+    thread = threading.Thread(target=run, name='expiry-reminder-scheduler', daemon=True)
+    thread.start()
+    logger.info(f"Expiry reminder scan scheduled every {interval_minutes} minute(s).")
+    return thread
@@ -0,0 +1,274 @@
+from datetime import datetime, timedelta
+import pytz
+import logging
+
+from .schema import match_either, normalize_stage
+
+logger = logging.getLogger(__name__)
+
+# Timezone name understood by MongoDB date operators ($dateToString, $hour, ...)
+IST_TZ_NAME = 'Asia/Kolkata'
+IST = pytz.timezone(IST_TZ_NAME)
+UTC = pytz.utc
+
+# Counters produced by the report $group stage. The daily rollup documents
+# store exactly these field names so both report paths share one $project.
+# Sales are summed in integer paise, so totals are exact.
+REPORT_COUNTER_FIELDS = [
+    'total_sales_paise',
+    'total_checks',
+    'wheels_2',
+    'wheels_3',
+    'wheels_4',
+    'duration_6m',
+    'duration_12m',
+    'type_petrol_3_4',
+    'type_diesel_3_4',
+]
+
+
+def report_group_fields():
+    """Returns the $group accumulators that compute the report counters from normalized checks."""
+    return {
+        'total_sales_paise': {'$sum': '$price_paise'},
+        'total_checks': {'$sum': 1},
+        'wheels_2': {'$sum': {'$cond': [{'$eq': ['$wheels', 2]}, 1, 0]}},
+        'wheels_3': {'$sum': {'$cond': [{'$eq': ['$wheels', 3]}, 1, 0]}},
+        'wheels_4': {'$sum': {'$cond': [{'$eq': ['$wheels', 4]}, 1, 0]}},
+        'duration_6m': {'$sum': {'$cond': [{'$eq': ['$duration_months', 6]}, 1, 0]}},
+        'duration_12m': {'$sum': {'$cond': [{'$eq': ['$duration_months', 12]}, 1, 0]}},
+        # Count fuel types only for 3 and 4 wheelers
+        'type_petrol_3_4': {'$sum': {'$cond': [{'$and': [
+            {'$in': ['$wheels', [3, 4]]}, # Wheels is 3 or 4
+            {'$eq': ['$vehicle_type', 'petrol']}
+        ]}, 1, 0]}},
+        'type_diesel_3_4': {'$sum': {'$cond': [{'$and': [
+            {'$in': ['$wheels', [3, 4]]}, # Wheels is 3 or 4
+            {'$eq': ['$vehicle_type', 'diesel']}
+        ]}, 1, 0]}},
+    }
+
+
+def report_projection():
+    """Returns the $project stage that reshapes grouped counters into the report_data layout."""
+    return {
+        '$project': { # Reshape the output
+            '_id': 0,
+            # Use $ifNull to ensure fields exist even if no documents match
+            'total_sales': {'$divide': [{'$ifNull': ['$total_sales_paise', 0]}, 100]},
+            'total_checks': {'$ifNull': ['$total_checks', 0]},
+            'counts_by_wheel': {
+                '2': {'$ifNull': ['$wheels_2', 0]},
+                '3': {'$ifNull': ['$wheels_3', 0]},
+                '4': {'$ifNull': ['$wheels_4', 0]}
+            },
+            'counts_by_duration': {
+                '6': {'$ifNull': ['$duration_6m', 0]},
+                '12': {'$ifNull': ['$duration_12m', 0]}
+            },
+            'counts_by_fuel_3_4': {
+                'petrol': {'$ifNull': ['$type_petrol_3_4', 0]},
+                'diesel': {'$ifNull': ['$type_diesel_3_4', 0]}
+            }
+        }
+    }
+
+
+def counters_to_report(counters):
+    """Shapes a dict of REPORT_COUNTER_FIELDS the way report_projection() does, in Python."""
+    counters = {field: counters.get(field) or 0 for field in REPORT_COUNTER_FIELDS}
+    return {
+        'total_sales': counters['total_sales_paise'] / 100,
+        'total_checks': counters['total_checks'],
+        'counts_by_wheel': {'2': counters['wheels_2'], '3': counters['wheels_3'], '4': counters['wheels_4']},
+        'counts_by_duration': {'6': counters['duration_6m'], '12': counters['duration_12m']},
+        'counts_by_fuel_3_4': {'petrol': counters['type_petrol_3_4'], 'diesel': counters['type_diesel_3_4']},
+    }
+
+
+def add_counters(total, counters):
+    """Adds the REPORT_COUNTER_FIELDS of counters into total, in place. Returns total."""
+    for field in REPORT_COUNTER_FIELDS:
+        total[field] = (total.get(field) or 0) + (counters.get(field) or 0)
+    return total
+
+
+def check_date_match(start_dt_utc, end_dt_utc):
+    """Returns the $match stage selecting checks of either schema version in [start, end)."""
+    return {
+        '$match': match_either('check_date', {
+            '$gte': start_dt_utc,
+            '$lt': end_dt_utc # Use $lt for end date (exclusive)
+        })
+    }
+
+
+def build_report_pipeline(start_dt_utc, end_dt_utc, project=True):
+    """Builds the aggregation pipeline that summarises raw checks in [start, end).
+
+    project=False leaves the result as raw REPORT_COUNTER_FIELDS (for merging with other sources).
+    """
+    pipeline = [
+        check_date_match(start_dt_utc, end_dt_utc),
+        normalize_stage(),
+        {
+            '$group': {
+                '_id': None, # Group all documents in the range
+                **report_group_fields(),
+            }
+        },
+    ]
+    if project:
+        pipeline.append(report_projection())
+    return pipeline
+
+
+def run_report_counters(collection, start_dt_utc, end_dt_utc):
+    """Returns the REPORT_COUNTER_FIELDS of the raw checks in [start, end), zero if there are none."""
+    results = list(collection.aggregate(build_report_pipeline(start_dt_utc, end_dt_utc, project=False)))
+    counters = results[0] if results else {}
+    return {field: counters.get(field) or 0 for field in REPORT_COUNTER_FIELDS}
+
+
+def run_report(collection, start_dt_utc, end_dt_utc, archive=None):
+    """Runs the report pipeline over raw checks. Returns the report dict or None if no records.
+
+    If part of the range has been moved to the check archive (see app/archive.py), the
+    archived months are counted from there and added to the live counters before shaping.
+    """
+    if archive is not None and archive.covers(start_dt_utc, end_dt_utc):
+        counters = run_report_counters(collection, start_dt_utc, end_dt_utc)
+        add_counters(counters, archive.report_counters(start_dt_utc, end_dt_utc))
+        return counters_to_report(counters) if counters['total_checks'] else None
+    results = list(collection.aggregate(build_report_pipeline(start_dt_utc, end_dt_utc)))
+    return results[0] if results else None
+
+
+# --- Trend Reports ---
+# $dateToString formats that name the IST day, ISO week or month a check falls in
+TREND_GRANULARITIES = {
+    'day': '%Y-%m-%d',
+    'week': '%G-W%V', # ISO week, Monday to Sunday
+    'month': '%Y-%m',
+}
+
+
+def build_trend_facet(date_field, group_fields, granularity, project=True):
+    """Returns a $facet stage computing the overall report and per-bucket reports in one pass.
+
+    date_field is the date expression to bucket by (e.g. '$check_date'); group_fields are the
+    $group accumulators producing REPORT_COUNTER_FIELDS. project=False leaves the raw
+    counters, with the bucket label in _id.
+    """
+    bucket_projection = report_projection()
+    bucket_projection['$project']['bucket'] = '$_id'
+    return {
+        '$facet': {
+            'totals': [
+                {'$group': {'_id': None, **group_fields}},
+            ] + ([report_projection()] if project else []),
+            'buckets': [
+                {'$group': {
+                    '_id': {'$dateToString': {'format': TREND_GRANULARITIES[granularity],
+                                              'date': date_field, 'timezone': IST_TZ_NAME}},
+                    **group_fields,
+                }},
+                {'$sort': {'_id': 1}},
+            ] + ([bucket_projection] if project else []),
+        }
+    }
+
+
+def build_trend_pipeline(start_dt_utc, end_dt_utc, granularity, project=True):
+    """Builds the pipeline that summarises raw checks in [start, end) overall and per IST bucket."""
+    return [
+        check_date_match(start_dt_utc, end_dt_utc),
+        normalize_stage(),
+        build_trend_facet('$check_date', report_group_fields(), granularity, project=project),
+    ]
+
+
+def trend_buckets(start_dt_utc, end_dt_utc, granularity):
+    """Returns (label, first instant in UTC) of every bucket in [start, end), in order.
+
+    Labels are formatted like $dateToString does; the first bucket starts at start_dt_utc.
+    """
+    buckets = []
+    day = start_dt_utc.astimezone(IST).date()
+    last_day = (end_dt_utc.astimezone(IST) - timedelta(microseconds=1)).date()
+    while day <= last_day:
+        if granularity == 'week':
+            iso_year, iso_week, _ = day.isocalendar()
+            label = f'{iso_year}-W{iso_week:02d}'
+        else:
+            label = day.strftime('%Y-%m-%d' if granularity == 'day' else '%Y-%m')
+        if not buckets:
+            buckets.append((label, start_dt_utc))
+        elif buckets[-1][0] != label:
+            buckets.append((label, IST.localize(datetime(day.year, day.month, day.day)).astimezone(UTC)))
+        day += timedelta(days=1)
+    return buckets
+
+
+def trend_bucket_labels(start_dt_utc, end_dt_utc, granularity):
+    """Returns every bucket label in [start, end), in order, formatted like $dateToString does."""
+    return [label for label, _ in trend_buckets(start_dt_utc, end_dt_utc, granularity)]
+
+
+def _empty_report():
+    """The report_data layout with every counter at zero."""
+    return {
+        'total_sales': 0, 'total_checks': 0,
+        'counts_by_wheel': {'2': 0, '3': 0, '4': 0},
+        'counts_by_duration': {'6': 0, '12': 0},
+        'counts_by_fuel_3_4': {'petrol': 0, 'diesel': 0},
+    }
+
+
+def summarize_trend(results, start_dt_utc, end_dt_utc, granularity):
+    """Shapes the $facet output into {'granularity', 'totals', 'buckets'}.
+
+    Buckets without checks are filled with zero counters so charts show gaps as zero.
+    Returns None if the range has no checks.
+    """
+    facet = results[0] if results else {}
+    totals = (facet.get('totals') or [None])[0]
+    if not totals or not totals.get('total_checks'):
+        return None
+
+    found = {bucket.pop('bucket'): bucket for bucket in facet.get('buckets', [])}
+    buckets = [{'bucket': label, **(found.get(label) or _empty_report())}
+               for label in trend_bucket_labels(start_dt_utc, end_dt_utc, granularity)]
+    return {'granularity': granularity, 'totals': totals, 'buckets': buckets}
+
+
+def run_trend_report(collection, start_dt_utc, end_dt_utc, granularity, archive=None):
+    """Runs the trend pipeline over raw checks in a single aggregation. Returns summarize_trend()'s dict or None.
+
+    Archived months in the range are counted from the archive and merged bucket by bucket.
+    """
+    if archive is None or not archive.covers(start_dt_utc, end_dt_utc):
+        results = list(collection.aggregate(build_trend_pipeline(start_dt_utc, end_dt_utc, granularity)))
+        return summarize_trend(results, start_dt_utc, end_dt_utc, granularity)
+
+    results = list(collection.aggregate(build_trend_pipeline(start_dt_utc, end_dt_utc, granularity, project=False)))
+    merged = merge_archived_trend(results, archive.report_counters(start_dt_utc, end_dt_utc),
+                                  archive.bucket_counters(start_dt_utc, end_dt_utc, granularity))
+    return summarize_trend(merged, start_dt_utc, end_dt_utc, granularity)
+
+
+def merge_archived_trend(results, archived_totals, archived_buckets):
+    """Adds archived counters to the output of build_trend_pipeline(..., project=False).
+
+    Returns the merged results in the projected layout summarize_trend() expects.
+    """
+    facet = results[0] if results else {}
+    totals = add_counters({}, (facet.get('totals') or [{}])[0])
+    add_counters(totals, archived_totals)
+    buckets = {bucket['_id']: add_counters({}, bucket) for bucket in facet.get('buckets', [])}
+    for label, counters in archived_buckets.items():
+        add_counters(buckets.setdefault(label, {}), counters)
+    return [{
+        'totals': [counters_to_report(totals)],
+        'buckets': [{**counters_to_report(counters), 'bucket': label} for label, counters in sorted(buckets.items())],
+    }]
@@ -0,0 +1,209 @@
+import itertools
+from collections import defaultdict
+from datetime import datetime
+from pymongo import ReplaceOne, UpdateOne
+import pytz
+import logging
+
+from .reports import (IST_TZ_NAME, REPORT_COUNTER_FIELDS, report_group_fields, report_projection,
+                      build_trend_facet, summarize_trend, check_date_match)
+from .schema import decode_check, normalize_stage, rupees_to_paise
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+# One document per IST day, keyed by 'YYYY-MM-DD'. Each document carries the
+# report counters for the day plus an hourly breakdown under 'hours.HH', and the
+# counters of each station's checks under 'stations.<station_id>'.
+ROLLUP_COLLECTION_NAME = 'daily_rollups'
+
+
+def _as_utc(dt):
+    """PyMongo returns naive UTC datetimes by default; make them timezone aware."""
+    return UTC.localize(dt) if dt.tzinfo is None else dt.astimezone(UTC)
+
+
+def ist_day_start_utc(day_key):
+    """Returns the UTC instant at which the IST day 'YYYY-MM-DD' begins."""
+    day = datetime.strptime(day_key, '%Y-%m-%d')
+    return IST.localize(day).astimezone(UTC)
+
+
+def rollup_increments(entry):
+    """Returns (day_key, {field: increment}) for a single check document of either schema version."""
+    check = decode_check(entry)
+    check_time_ist = _as_utc(check['check_date']).astimezone(IST)
+    day_key = check_time_ist.strftime('%Y-%m-%d')
+    hour_key = check_time_ist.strftime('%H')
+    price_paise = check.get('price_paise', 0) or 0
+    wheels = check.get('wheels')
+
+    incs = {'total_sales_paise': price_paise, 'total_checks': 1}
+    if wheels in (2, 3, 4):
+        incs[f'wheels_{wheels}'] = 1
+    if check.get('duration_months') in (6, 12):
+        incs[f"duration_{check['duration_months']}m"] = 1
+    if wheels in (3, 4) and check.get('vehicle_type') in ('petrol', 'diesel'):
+        incs[f"type_{check['vehicle_type']}_3_4"] = 1
+    if check.get('station_id'):
+        incs.update({f"stations.{check['station_id']}.{field}": value for field, value in list(incs.items())})
+    incs[f'hours.{hour_key}.total_checks'] = 1
+    incs[f'hours.{hour_key}.total_sales_paise'] = price_paise
+    return day_key, incs
+
+
+def build_rollup_updates(entries):
+    """Folds check documents into one $inc upsert per IST day."""
+    per_day = defaultdict(lambda: defaultdict(int))
+    for entry in entries:
+        day_key, incs = rollup_increments(entry)
+        for field, value in incs.items():
+            per_day[day_key][field] += value
+
+    return [
+        UpdateOne({'_id': day_key},
+                  {'$inc': dict(incs), '$setOnInsert': {'day_start': ist_day_start_utc(day_key)}},
+                  upsert=True)
+        for day_key, incs in per_day.items()
+    ]
+
+
+def apply_entries_to_rollups(rollup_collection, entries):
+    """Atomically adds freshly inserted checks to their daily rollup documents."""
+    updates = build_rollup_updates(entries)
+    if updates:
+        rollup_collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def rollup_sum_fields():
+    """Returns the $group accumulators that add up rollup documents.
+
+    Rollups written before sales were kept in paise carry a float total_sales (rupees)
+    instead; it is counted too until `flask rollups rebuild` rewrites those days.
+    """
+    sums = {field: {'$sum': f'${field}'} for field in REPORT_COUNTER_FIELDS}
+    sums['total_sales_paise'] = {'$sum': {'$add': [
+        {'$ifNull': ['$total_sales_paise', 0]},
+        rupees_to_paise({'$ifNull': ['$total_sales', 0]}),
+    ]}}
+    return sums
+
+
+def build_rollup_report_pipeline(start_dt_utc, end_dt_utc):
+    """Builds the pipeline that sums the rollup documents of every IST day in [start, end)."""
+    return [
+        {'$match': {'day_start': {'$gte': start_dt_utc, '$lt': end_dt_utc}}},
+        {'$group': {'_id': None, **rollup_sum_fields()}},
+        report_projection(),
+    ]
+
+
+# Fields of a daily rollup document that make up its report counters
+DAY_COUNTER_PROJECTION = {field: 1 for field in REPORT_COUNTER_FIELDS + ['total_sales']}
+
+
+def day_counters(doc):
+    """Returns the REPORT_COUNTER_FIELDS of a daily rollup document (zeros if doc is None)."""
+    counters = {field: (doc or {}).get(field) or 0 for field in REPORT_COUNTER_FIELDS}
+    if doc and doc.get('total_sales'): # Written before sales were kept in paise
+        counters['total_sales_paise'] += round(doc['total_sales'] * 100)
+    return counters
+
+
+def read_day_counters(rollup_collection, day_key):
+    """Returns the REPORT_COUNTER_FIELDS of one IST day's rollup (zeros if it has no checks yet)."""
+    return day_counters(rollup_collection.find_one({'_id': day_key}, projection=DAY_COUNTER_PROJECTION))
+
+
+def summarize_rollups(rollup_collection, start_dt_utc, end_dt_utc):
+    """Sums the rollup documents of every IST day in [start, end) into the report_data layout.
+
+    The range must be aligned to IST day boundaries, which get_utc_date_range guarantees.
+    Returns None if no day in the range has any checks.
+    """
+    results = list(rollup_collection.aggregate(build_rollup_report_pipeline(start_dt_utc, end_dt_utc)))
+    if not results or not results[0].get('total_checks'):
+        return None
+    return results[0]
+
+
+def build_rollup_trend_pipeline(start_dt_utc, end_dt_utc, granularity):
+    """Builds the pipeline that sums rollup documents in [start, end) overall and per IST bucket."""
+    return [
+        {'$match': {'day_start': {'$gte': start_dt_utc, '$lt': end_dt_utc}}},
+        # day_start is the UTC instant of IST midnight, so it buckets into its own IST day
+        build_trend_facet('$day_start', rollup_sum_fields(), granularity),
+    ]
+
+
+def summarize_rollup_trend(rollup_collection, start_dt_utc, end_dt_utc, granularity):
+    """Trend report from the daily rollups. Same result as reports.run_trend_report, or None."""
+    results = list(rollup_collection.aggregate(build_rollup_trend_pipeline(start_dt_utc, end_dt_utc, granularity)))
+    return summarize_trend(results, start_dt_utc, end_dt_utc, granularity)
+
+
+def rebuild_rollups(collection, rollup_collection, start_dt_utc, end_dt_utc, archive=None):
+    """Recomputes the rollups of every IST day in [start, end) from the raw checks.
+
+    Each day's rollup document is replaced atomically, and days without any checks
+    are removed, so live $inc updates never see a missing or duplicate day. Checks
+    inserted while the rebuild runs may be missed; re-run the rebuild for the
+    affected days if that matters.
+    Checks of archived months are counted from the archive (see app/archive.py).
+    Returns the number of day documents written.
+    """
+    pipeline = [
+        check_date_match(start_dt_utc, end_dt_utc),
+        normalize_stage(),
+        {
+            '$group': {
+                '_id': {
+                    'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$check_date', 'timezone': IST_TZ_NAME}},
+                    'hour': {'$hour': {'date': '$check_date', 'timezone': IST_TZ_NAME}},
+                    'station_id': '$station_id',
+                },
+                **report_group_fields(),
+            }
+        },
+    ]
+
+    hour_docs = collection.aggregate(pipeline, allowDiskUse=True)
+    if archive is not None and archive.covers(start_dt_utc, end_dt_utc):
+        hour_docs = itertools.chain(hour_docs, archive.hour_counters(start_dt_utc, end_dt_utc))
+
+    days = {}
+    for hour_doc in hour_docs:
+        day_key = hour_doc['_id']['day']
+        hour_key = f"{hour_doc['_id']['hour']:02d}"
+        day_doc = days.setdefault(day_key, {
+            '_id': day_key,
+            'day_start': ist_day_start_utc(day_key),
+            'hours': {},
+            'stations': {},
+            **{field: 0 for field in REPORT_COUNTER_FIELDS},
+        })
+        station_id = hour_doc['_id'].get('station_id')
+        station = (day_doc['stations'].setdefault(station_id, dict.fromkeys(REPORT_COUNTER_FIELDS, 0))
+                   if station_id else {})
+        for field in REPORT_COUNTER_FIELDS:
+            day_doc[field] += hour_doc.get(field, 0) or 0
+            if station_id:
+                station[field] += hour_doc.get(field, 0) or 0
+        # An hour can come from several stations, and from both MongoDB and the archive
+        # (checks imported after archiving)
+        hour = day_doc['hours'].setdefault(hour_key, {'total_checks': 0, 'total_sales_paise': 0})
+        hour['total_checks'] += hour_doc.get('total_checks', 0) or 0
+        hour['total_sales_paise'] += hour_doc.get('total_sales_paise', 0) or 0
+
+    # Replace day by day rather than delete-then-insert: an $inc upsert landing between
+    # the two would be lost or would recreate the day before the insert
+    if days:
+        rollup_collection.bulk_write([ReplaceOne({'_id': day_key}, day_doc, upsert=True)
+                                      for day_key, day_doc in days.items()], ordered=False)
+    deleted = rollup_collection.delete_many({'day_start': {'$gte': start_dt_utc, '$lt': end_dt_utc},
+                                             '_id': {'$nin': list(days)}})
+    logger.info(f"Rebuilt {len(days)} daily rollups (removed {deleted.deleted_count} empty days) "
+                f"for {start_dt_utc} to {end_dt_utc}.")
+    return len(days)
@@ -1,9 +1,24 @@
-from flask import render_template, request, redirect, url_for, flash, current_app, Blueprint
-# VVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVVV
-from decimal import Decimal # <-- ADD THIS IMPORT
-# ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
-from .utils import get_price, calculate_expiry_date, generate_pie_chart, get_utc_date_range
-from . import IST, UTC, get_collection # Import IST/UTC from __init__ and get_collection helper
+from flask import (render_template, request, redirect, url_for, flash, current_app, Blueprint, abort,
+                   make_response, jsonify, Response, stream_with_context)
+from decimal import Decimal
+from .utils import (get_price, calculate_expiry_date, make_chart_spec, make_trend_chart_spec, chart_spec_url,
+                    get_utc_date_range, get_rendered_chart, decode_chart_spec, CHART_CACHE)
+from . import IST, UTC, get_collection, get_rollup_collection # Import IST/UTC from __init__ and collection helpers
+from .reports import (run_report, build_report_pipeline, run_trend_report, build_trend_pipeline,
+                      TREND_GRANULARITIES)
+from .rollups import (apply_entries_to_rollups, summarize_rollups, build_rollup_report_pipeline,
+                      summarize_rollup_trend, build_rollup_trend_pipeline, read_day_counters)
+from .live import event_stream
+from .stations import (run_station_report, build_station_report_pipeline, summarize_rollup_stations,
+                       build_rollup_station_pipeline, run_station_fanout)
+from .indexes import check_pipeline_plan
+from .cache import REPORT_CACHE
+from .checks import validate_check_input, build_check_entry, schema_options
+from .schema import decode_check
+from .export import export_stream, EXPORT_FORMATS
+from .metrics import REGISTRY, render_metrics
+from .lookup import (latest_check, search_prefix, serialize_check, normalize_vehicle_no,
+                     invalidate_vehicle, MIN_PREFIX_LENGTH)
 from datetime import datetime
 from bson import ObjectId # If you need to query by _id later
 import pytz
@@ -21,29 +36,11 @@ def dashboard1():
     submitted_data = request.form if request.method == 'POST' else {} # Keep submitted data on error
 
     if request.method == 'POST':
-        vehicle_no = request.form.get('vehicle_no', '').strip().upper()
-        vehicle_type = request.form.get('vehicle_type') # petrol/diesel
-        wheels_str = request.form.get('wheels')
-        duration_str = request.form.get('duration') # six_months/one_year
-
         # --- Basic Validation ---
-        errors = []
-        if not vehicle_no: errors.append("Vehicle Number is required.")
-        # Add regex validation for vehicle_no if needed (e.g., using re module)
-        if not vehicle_type or vehicle_type not in ['petrol', 'diesel']: errors.append("Invalid Vehicle Fuel Type selected.")
-        if not wheels_str or not wheels_str.isdigit(): errors.append("Invalid Number of Wheels selected.")
-        if not duration_str or duration_str not in ['six_months', 'one_year']: errors.append("Invalid Duration Period selected.")
-
-        # Proceed with further checks only if basic types are okay
-        wheels = 0
-        if wheels_str and wheels_str.isdigit():
-             wheels = int(wheels_str)
-             if wheels not in [2, 3, 4]: errors.append("Wheels must be 2, 3, or 4.")
-             # Check fuel type compatibility *after* confirming wheels is valid
-             if wheels == 2 and vehicle_type == 'diesel': errors.append("2-Wheelers cannot be Diesel type.")
-        elif wheels_str: # If it's not empty but not a digit
-            errors.append("Number of Wheels must be a number (2, 3, or 4).")
-
+        errors, cleaned = validate_check_input(request.form.get('vehicle_no', ''),
+                                               request.form.get('vehicle_type'), # petrol/diesel
+                                               request.form.get('wheels'),
+                                               request.form.get('duration')) # six_months/one_year
 
         if errors:
             for error in errors:
@@ -52,35 +49,35 @@ def dashboard1():
             return render_template('dashboard1.html', submitted_data=submitted_data)
 
         # --- Process Valid Data ---
-        duration_months = 6 if duration_str == 'six_months' else 12
+        vehicle_no = cleaned['vehicle_no']
+        duration_months = cleaned['duration_months']
 
-        price = get_price(wheels, duration_months)
+        check_time_ist = datetime.now(IST)
+        price = get_price(cleaned['wheels'], duration_months, check_time_ist)
         # Check if price calculation failed (get_price returns Decimal('0.0') on error)
-        if price == Decimal('0.0'): # <--- THIS LINE CAUSED THE ERROR
-             flash("Could not determine price. Check price configuration in .env file.", "danger")
+        if price == Decimal('0.0'):
+             flash("Could not determine price. Check the price configuration.", "danger")
              return render_template('dashboard1.html', submitted_data=submitted_data)
 
 
-        check_time_ist = datetime.now(IST)
         expiry_time_ist = calculate_expiry_date(check_time_ist, duration_months)
 
-        # Convert dates to UTC for storage
-        check_time_utc = check_time_ist.astimezone(UTC)
-        expiry_time_utc = expiry_time_ist.astimezone(UTC)
-
-        # --- Prepare Data for MongoDB ---
-        entry = {
-            "vehicle_no": vehicle_no,
-            "vehicle_type": vehicle_type,
-            "wheels": wheels,
-            "duration_months": duration_months,
-            "price": float(price), # Store as float/double in MongoDB for wider compatibility
-            "check_date": check_time_utc, # Store as native BSON Date (UTC)
-            "expiry_date": expiry_time_utc, # Store as native BSON Date (UTC)
-            # Storing strings is optional, can format on retrieval if needed
-            # "check_date_ist_str": check_time_ist.strftime('%Y-%m-%d %H:%M:%S %Z%z'),
-            # "expiry_date_ist_str": expiry_time_ist.strftime('%Y-%m-%d %H:%M:%S %Z%z'),
-        }
+        # --- Prepare Data for MongoDB (dates converted to UTC for storage) ---
+        entry = build_check_entry(vehicle_no, cleaned['vehicle_type'], cleaned['wheels'], duration_months,
+                                  price, check_time_ist, expiry_time_ist, **schema_options(current_app.config))
+
+        # --- Write-behind: journal locally, insert into MongoDB in the background ---
+        write_behind = current_app.extensions.get('write_behind')
+        if write_behind is not None:
+            try:
+                record_id = write_behind.submit(entry)
+                flash(f"Pollution check added successfully! Record ID: {record_id}", 'success')
+                logger.info(f"Journaled record for {vehicle_no} with ID: {record_id}")
+                return redirect(url_for('main.dashboard1')) # Redirect to clear form on success
+            except OSError as e:
+                logger.error(f"Failed to journal pollution check: {e}")
+                flash(f"Could not save data. Details: {e}", 'danger')
+                return render_template('dashboard1.html', submitted_data=submitted_data)
 
         # --- Insert into MongoDB ---
         collection = get_collection()
@@ -89,6 +86,7 @@ def dashboard1():
                 result = collection.insert_one(entry)
                 flash(f"Pollution check added successfully! Record ID: {result.inserted_id}", 'success')
                 logger.info(f"Inserted record for {vehicle_no} with ID: {result.inserted_id}")
+                after_checks_saved([entry])
                 return redirect(url_for('main.dashboard1')) # Redirect to clear form on success
             except Exception as e:
                 logger.error(f"Failed to insert data into MongoDB: {e}")
@@ -106,13 +104,185 @@ def dashboard1():
     return render_template('dashboard1.html', submitted_data={})
 
 
+def after_checks_saved(entries):
+    """Post-insert bookkeeping for new checks, whether inserted directly or by the write-behind queue."""
+    _update_rollups(entries)
+    notify_checks_saved(entries, current_app.extensions.get('live'))
+
+
+def notify_checks_saved(entries, live=None):
+    """Drops cached state that new checks made stale and wakes /reports/live viewers."""
+    checks = [decode_check(entry) for entry in entries]
+    REPORT_CACHE.bump_generation() # Reports covering today are now stale
+    # Checks dated before today (e.g. replayed from a write-behind journal) also change past ranges
+    today_start_utc = IST.localize(datetime.combine(datetime.now(IST).date(), datetime.min.time())).astimezone(UTC)
+    if any(_aware_utc(check['check_date']) < today_start_utc for check in checks):
+        REPORT_CACHE.invalidate_closed()
+    for vehicle_no in {check['vehicle_no'] for check in checks}:
+        invalidate_vehicle(vehicle_no)
+    if live is not None:
+        live.nudge() # Push the new counters to /reports/live viewers
+
+
+def _aware_utc(dt):
+    return UTC.localize(dt) if dt.tzinfo is None else dt
+
+
+def _update_rollups(entries):
+    """Adds inserted checks to the daily rollups. Failures are logged, never raised to the user."""
+    rollup_collection = get_rollup_collection()
+    if rollup_collection is None:
+        return
+    try:
+        apply_entries_to_rollups(rollup_collection, entries)
+    except Exception as e:
+        # The check itself is saved; `flask rollups rebuild` repairs the affected day.
+        logger.error(f"Failed to update daily rollups: {e}")
+
+
+def report_chart_specs(report_data):
+    """Returns the specs of the pie charts shown under a report, by name."""
+    specs = {}
+    # Ensure data exists before generating charts
+    if report_data.get('total_checks', 0) > 0:
+        # 1. Wheels Chart
+        wheel_labels = ['2 Wheeler', '3 Wheeler', '4 Wheeler']
+        wheel_data = [report_data['counts_by_wheel'].get('2', 0),
+                      report_data['counts_by_wheel'].get('3', 0),
+                      report_data['counts_by_wheel'].get('4', 0)]
+        wheel_colors = ['#66b3ff', '#ffcc99', '#99ff99'] # Example Colors
+        specs['wheels'] = make_chart_spec(wheel_data, wheel_labels, "Checks by Vehicle Wheels", wheel_colors)
+
+        # 2. Duration Chart
+        duration_labels = ['6 Months', '1 Year']
+        duration_data = [report_data['counts_by_duration'].get('6', 0),
+                         report_data['counts_by_duration'].get('12', 0)]
+        duration_colors = ['#ff9999', '#c2c2f0']
+        specs['duration'] = make_chart_spec(duration_data, duration_labels, "Checks by Duration", duration_colors)
+
+        # 3. Fuel Type Chart (3 & 4 Wheelers only)
+        fuel_labels = ['Petrol (3/4 W)', 'Diesel (3/4 W)']
+        fuel_data = [report_data['counts_by_fuel_3_4'].get('petrol', 0),
+                     report_data['counts_by_fuel_3_4'].get('diesel', 0)]
+        fuel_colors = ['#ffb3e6', '#ffb366']
+        # Only generate fuel chart if there is data for 3/4 wheelers
+        if sum(fuel_data) > 0:
+             specs['fuel'] = make_chart_spec(fuel_data, fuel_labels, "Fuel Type (3 & 4 Wheelers)", fuel_colors)
+        else:
+             logger.info("No data for 3/4 wheeler fuel types chart.")
+    return specs
+
+
+def trend_chart_specs(trend):
+    """Returns the specs of the sales and checks-by-wheels trend charts of a trend report, by name."""
+    labels = [bucket['bucket'] for bucket in trend['buckets']]
+    period = trend['granularity'].capitalize()
+    return {
+        'trend_sales': make_trend_chart_spec(labels, [('Sales (₹)', [b['total_sales'] for b in trend['buckets']])],
+                                             f"Sales per {period}", kind='line'),
+        'trend_wheels': make_trend_chart_spec(
+            labels,
+            [(f'{wheels} Wheeler', [b['counts_by_wheel'].get(wheels, 0) for b in trend['buckets']])
+             for wheels in ('2', '3', '4')],
+            f"Checks per {period} by Wheels", kind='bar', colors=['#66b3ff', '#ffcc99', '#99ff99']),
+    }
+
+
+def _chart_urls(specs):
+    """Renders (or reuses) each chart and returns the URLs of those with something to plot."""
+    urls = {name: chart_spec_url(spec) for name, spec in specs.items()}
+    return {name: url for name, url in urls.items() if url}
+
+
+def _build_report_charts(report_data):
+    """Renders the pie charts shown under a report and returns their URLs."""
+    return _chart_urls(report_chart_specs(report_data))
+
+
+def _build_trend_charts(trend):
+    """Renders the sales and checks-by-wheels trend charts of a trend report and returns their URLs."""
+    return _chart_urls(trend_chart_specs(trend))
+
+
+def report_cache_source(config, use_rollups, granularity, by_station):
+    """The REPORT_CACHE source of a /reports request: what the cached result was computed from."""
+    source = 'rollups' if use_rollups else 'raw'
+    if granularity:
+        source = f'{source}:{granularity}'
+    if by_station:
+        source = f"{source}:stations:{config.get('STATION_REPORT_MODE')}"
+    return source
+
+
+def live_baseline_day(start_dt_utc, end_dt_utc):
+    """Today's IST day key if the range includes today (the report gets live updates), else None."""
+    now = datetime.now(UTC)
+    if not start_dt_utc <= now < end_dt_utc:
+        return None
+    return now.astimezone(IST).strftime('%Y-%m-%d')
+
+
+def _live_baseline(start_dt_utc, end_dt_utc):
+    """Today's counters if the range includes today, so the page can apply live updates on top.
+
+    Read right after the report itself; the client uses it to catch up on checks saved since.
+    """
+    day = live_baseline_day(start_dt_utc, end_dt_utc)
+    if day is None:
+        return None
+    rollup_collection = get_rollup_collection()
+    if rollup_collection is None:
+        return None
+    return {'day': day, 'counters': read_day_counters(rollup_collection, day)}
+
+
+def _run_trend(collection, use_rollups, start_dt_utc, end_dt_utc, granularity):
+    """Runs the single-pass trend report on the rollups or the raw checks."""
+    if current_app.config.get('QUERY_DIAGNOSTICS'):
+        build_pipeline = build_rollup_trend_pipeline if use_rollups else build_trend_pipeline
+        check_pipeline_plan(collection, build_pipeline(start_dt_utc, end_dt_utc, granularity))
+    if use_rollups:
+        return summarize_rollup_trend(collection, start_dt_utc, end_dt_utc, granularity)
+    return run_trend_report(collection, start_dt_utc, end_dt_utc, granularity,
+                            archive=current_app.extensions.get('archive'))
+
+
+def _run_station_breakdown(use_rollups, start_dt_utc, end_dt_utc):
+    """Runs the per-station report in the configured STATION_REPORT_MODE."""
+    archive = current_app.extensions.get('archive')
+    if current_app.config.get('STATION_REPORT_MODE') == 'fanout':
+        collection = get_collection() # Fan-out always reads the raw checks, through the station indexes
+        if collection is None:
+            raise RuntimeError("Database connection is not available.")
+        return run_station_fanout(collection, start_dt_utc, end_dt_utc,
+                                  max_workers=current_app.config.get('STATION_REPORT_WORKERS', 4), archive=archive)
+
+    collection = get_rollup_collection() if use_rollups else get_collection()
+    if collection is None:
+        raise RuntimeError("Database connection is not available.")
+    if current_app.config.get('QUERY_DIAGNOSTICS'):
+        build_pipeline = build_rollup_station_pipeline if use_rollups else build_station_report_pipeline
+        check_pipeline_plan(collection, build_pipeline(start_dt_utc, end_dt_utc))
+    if use_rollups:
+        return summarize_rollup_stations(collection, start_dt_utc, end_dt_utc)
+    return run_station_report(collection, start_dt_utc, end_dt_utc, archive=archive)
+
+
 @main_bp.route('/reports', methods=['GET', 'POST'])
 def dashboard2():
     """Handles the reports generation (Dashboard 2)."""
     report_data = None
     charts = {}
+    trend = None
+    live = None
+    stations = None
     start_date_str = request.form.get('start_date', "") # Default to empty string
     end_date_str = request.form.get('end_date', "")   # Default to empty string
+    granularity = request.form.get('granularity', "") # '' = totals only, else day/week/month trend
+    if granularity and granularity not in TREND_GRANULARITIES:
+        flash("Invalid trend period selected. Showing totals only.", "warning")
+        granularity = ""
+    by_station = request.form.get('by_station') == '1' # Adds a per-station breakdown table
 
     if request.method == 'POST':
         # start_date_str = request.form.get('start_date') # Already got above
@@ -124,99 +294,48 @@ def dashboard2():
             start_dt_utc, end_dt_utc = get_utc_date_range(start_date_str, end_date_str)
 
             if start_dt_utc and end_dt_utc:
-                collection = get_collection()
+                use_rollups = current_app.config.get('USE_REPORT_ROLLUPS', False)
+                collection = get_rollup_collection() if use_rollups else get_collection()
                 if collection is not None:
                     try:
-                        # --- MongoDB Aggregation Pipeline ---
-                        pipeline = [
-                            {
-                                '$match': {
-                                    'check_date': {
-                                        '$gte': start_dt_utc,
-                                        '$lt': end_dt_utc # Use $lt for end date (exclusive)
-                                    }
-                                }
-                            },
-                            {
-                                '$group': {
-                                    '_id': None, # Group all documents in the range
-                                    'total_sales': {'$sum': '$price'},
-                                    'total_checks': {'$sum': 1},
-                                    'wheels_2': {'$sum': {'$cond': [{'$eq': ['$wheels', 2]}, 1, 0]}},
-                                    'wheels_3': {'$sum': {'$cond': [{'$eq': ['$wheels', 3]}, 1, 0]}},
-                                    'wheels_4': {'$sum': {'$cond': [{'$eq': ['$wheels', 4]}, 1, 0]}},
-                                    'duration_6m': {'$sum': {'$cond': [{'$eq': ['$duration_months', 6]}, 1, 0]}},
-                                    'duration_12m': {'$sum': {'$cond': [{'$eq': ['$duration_months', 12]}, 1, 0]}},
-                                    # Count fuel types only for 3 and 4 wheelers
-                                    'type_petrol_3_4': {'$sum': {'$cond': [{'$and': [
-                                        {'$in': ['$wheels', [3, 4]]}, # Wheels is 3 or 4
-                                        {'$eq': ['$vehicle_type', 'petrol']}
-                                    ]}, 1, 0]}},
-                                     'type_diesel_3_4': {'$sum': {'$cond': [{'$and': [
-                                        {'$in': ['$wheels', [3, 4]]}, # Wheels is 3 or 4
-                                        {'$eq': ['$vehicle_type', 'diesel']}
-                                    ]}, 1, 0]}},
-                                }
-                            },
-                            {
-                                '$project': { # Reshape the output
-                                    '_id': 0,
-                                    # Use $ifNull to ensure fields exist even if no documents match
-                                    'total_sales': {'$ifNull': ['$total_sales', 0]},
-                                    'total_checks': {'$ifNull': ['$total_checks', 0]},
-                                    'counts_by_wheel': {
-                                        '2': {'$ifNull': ['$wheels_2', 0]},
-                                        '3': {'$ifNull': ['$wheels_3', 0]},
-                                        '4': {'$ifNull': ['$wheels_4', 0]}
-                                    },
-                                    'counts_by_duration': {
-                                        '6': {'$ifNull': ['$duration_6m', 0]},
-                                        '12': {'$ifNull': ['$duration_12m', 0]}
-                                    },
-                                     'counts_by_fuel_3_4': {
-                                        'petrol': {'$ifNull': ['$type_petrol_3_4', 0]},
-                                        'diesel': {'$ifNull': ['$type_diesel_3_4', 0]}
-                                    }
-                                }
-                            }
-                        ]
-
-                        results = list(collection.aggregate(pipeline))
-
-                        if results:
-                            report_data = results[0] # Aggregation returns a list, get the first doc
-                            logger.info(f"Report generated for {start_date_str} to {end_date_str}: {report_data}")
-
-                            # --- Generate Charts ---
-                            # Ensure data exists before generating charts
-                            if report_data.get('total_checks', 0) > 0:
-                                # 1. Wheels Chart
-                                wheel_labels = ['2 Wheeler', '3 Wheeler', '4 Wheeler']
-                                wheel_data = [report_data['counts_by_wheel'].get('2', 0),
-                                              report_data['counts_by_wheel'].get('3', 0),
-                                              report_data['counts_by_wheel'].get('4', 0)]
-                                wheel_colors = ['#66b3ff', '#ffcc99', '#99ff99'] # Example Colors
-                                charts['wheels'] = generate_pie_chart(wheel_data, wheel_labels, "Checks by Vehicle Wheels", wheel_colors)
-
-                                # 2. Duration Chart
-                                duration_labels = ['6 Months', '1 Year']
-                                duration_data = [report_data['counts_by_duration'].get('6', 0),
-                                                 report_data['counts_by_duration'].get('12', 0)]
-                                duration_colors = ['#ff9999', '#c2c2f0']
-                                charts['duration'] = generate_pie_chart(duration_data, duration_labels, "Checks by Duration", duration_colors)
-
-                                # 3. Fuel Type Chart (3 & 4 Wheelers only)
-                                fuel_labels = ['Petrol (3/4 W)', 'Diesel (3/4 W)']
-                                fuel_data = [report_data['counts_by_fuel_3_4'].get('petrol', 0),
-                                             report_data['counts_by_fuel_3_4'].get('diesel', 0)]
-                                fuel_colors = ['#ffb3e6', '#ffb366']
-                                # Only generate fuel chart if there is data for 3/4 wheelers
-                                if sum(fuel_data) > 0:
-                                     charts['fuel'] = generate_pie_chart(fuel_data, fuel_labels, "Fuel Type (3 & 4 Wheelers)", fuel_colors)
+                        source = report_cache_source(current_app.config, use_rollups, granularity, by_station)
+                        cache_version = REPORT_CACHE.version() # Before querying, so a concurrent insert is not cached over
+                        cached = REPORT_CACHE.get(start_dt_utc, end_dt_utc, source=source)
+                        if cached is not None:
+                            report_data, charts, trend = cached['report_data'], cached['charts'], cached['trend']
+                            live, stations = cached['live'], cached['stations']
+                            logger.info(f"Report for {start_date_str} to {end_date_str} served from cache.")
+                        else:
+                            if by_station:
+                                stations = _run_station_breakdown(use_rollups, start_dt_utc, end_dt_utc)
+                            if granularity:
+                                # Totals and per-bucket counters come from the same aggregation
+                                trend = _run_trend(collection, use_rollups, start_dt_utc, end_dt_utc, granularity)
+                                report_data = trend['totals'] if trend else None
+                            elif by_station and current_app.config.get('STATION_REPORT_MODE') != 'fanout':
+                                # The grouped pass covers every check, so its totals are the report
+                                report_data = stations['totals'] if stations else None
+                            else:
+                                if current_app.config.get('QUERY_DIAGNOSTICS'):
+                                    build_pipeline = build_rollup_report_pipeline if use_rollups else build_report_pipeline
+                                    check_pipeline_plan(collection, build_pipeline(start_dt_utc, end_dt_utc))
+                                if use_rollups:
+                                    report_data = summarize_rollups(collection, start_dt_utc, end_dt_utc)
                                 else:
-                                     logger.info("No data for 3/4 wheeler fuel types chart.")
-
-
+                                    report_data = run_report(collection, start_dt_utc, end_dt_utc,
+                                                             archive=current_app.extensions.get('archive'))
+                            live = _live_baseline(start_dt_utc, end_dt_utc)
+                            # --- Generate Charts ---
+                            charts = _build_report_charts(report_data) if report_data else {}
+                            if trend:
+                                charts.update(_build_trend_charts(trend))
+                            REPORT_CACHE.put(start_dt_utc, end_dt_utc,
+                                             {'report_data': report_data, 'charts': charts, 'trend': trend,
+                                              'live': live, 'stations': stations},
+                                             source=source, version=cache_version)
+
+                        if report_data:
+                            logger.info(f"Report generated for {start_date_str} to {end_date_str}: {report_data}")
                         else:
                             # No results found for the date range
                             flash(f"No records found for the selected date range ({start_date_str} to {end_date_str}).", "info")
@@ -241,5 +360,189 @@ def dashboard2():
     return render_template('dashboard2.html',
                            report_data=report_data,
                            charts=charts,
+                           trend=trend,
+                           live=live,
+                           stations=stations,
+                           by_station=by_station,
+                           granularity=granularity,
                            start_date=start_date_str,
-                           end_date=end_date_str)
\ No newline at end of file
+                           end_date=end_date_str)
+
+
+@main_bp.route('/reports/live')
+def live_report_stream():
+    """Streams today's report counters as Server-Sent Events: a snapshot, then deltas as checks are saved."""
+    body = event_stream(current_app.extensions['live'], current_app.config.get('LIVE_STREAM_MAX_SECONDS', 300))
+    response = Response(stream_with_context(body), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no' # Ask nginx not to buffer the stream
+    return response
+
+
+@main_bp.route('/api/reports/trend')
+def trend_report_api():
+    """Returns totals plus per-day/week/month counters for a date range, from one aggregation."""
+    start_date_str = request.args.get('start_date', '')
+    end_date_str = request.args.get('end_date', '')
+    granularity = request.args.get('granularity', 'day').lower()
+    if granularity not in TREND_GRANULARITIES:
+        return jsonify({'error': f"granularity must be one of: {', '.join(TREND_GRANULARITIES)}."}), 400
+    start_dt_utc, end_dt_utc = get_utc_date_range(start_date_str, end_date_str)
+    if not start_dt_utc or not end_dt_utc:
+        return jsonify({'error': 'start_date and end_date must be valid YYYY-MM-DD dates.'}), 400
+
+    use_rollups = current_app.config.get('USE_REPORT_ROLLUPS', False)
+    collection = get_rollup_collection() if use_rollups else get_collection()
+    if collection is None:
+        return jsonify({'error': 'Database connection is not available.'}), 503
+
+    try:
+        trend = _run_trend(collection, use_rollups, start_dt_utc, end_dt_utc, granularity)
+    except Exception as e:
+        logger.error(f"Trend report failed for {start_date_str} to {end_date_str}: {e}", exc_info=True)
+        return jsonify({'error': 'Trend report failed.'}), 500
+
+    return jsonify({
+        'start_date': start_date_str,
+        'end_date': end_date_str,
+        'granularity': granularity,
+        'totals': trend['totals'] if trend else None,
+        'buckets': trend['buckets'] if trend else [],
+        'charts': _build_trend_charts(trend) if trend else {},
+    })
+
+
+@main_bp.route('/reports/export')
+def export_checks():
+    """Streams the raw checks of a report range as CSV or NDJSON, optionally gzipped."""
+    start_date_str = request.args.get('start_date', '')
+    end_date_str = request.args.get('end_date', '')
+    fmt = request.args.get('format', 'csv').lower()
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+    if fmt not in EXPORT_FORMATS:
+        flash(f"Unsupported export format '{fmt}'. Use csv or ndjson.", "warning")
+        return redirect(url_for('main.dashboard2'))
+
+    start_dt_utc, end_dt_utc = get_utc_date_range(start_date_str, end_date_str)
+    if not start_dt_utc or not end_dt_utc:
+        flash("Invalid date range selected or format incorrect (use YYYY-MM-DD).", "warning")
+        return redirect(url_for('main.dashboard2'))
+
+    collection = get_collection()
+    if collection is None:
+        flash("Database connection is not available. Cannot export data.", "danger")
+        return redirect(url_for('main.dashboard2'))
+
+    logger.info(f"Exporting checks for {start_date_str} to {end_date_str} as {fmt}{' (gzip)' if compress else ''}.")
+    body = export_stream(collection, start_dt_utc, end_dt_utc, fmt=fmt, compress=compress,
+                         batch_size=current_app.config.get('EXPORT_BATCH_SIZE', 5000),
+                         archive=current_app.extensions.get('archive'))
+    filename = f"pollution_checks_{start_date_str}_{end_date_str}.{fmt}" + ('.gz' if compress else '')
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@main_bp.route('/api/vehicles/<vehicle_no>')
+def vehicle_lookup(vehicle_no):
+    """Returns the latest check for a plate and whether its certificate is still valid."""
+    vehicle_no = normalize_vehicle_no(vehicle_no)
+    collection = get_collection()
+    if collection is None:
+        return jsonify({'error': 'Database connection is not available.'}), 503
+
+    try:
+        doc = latest_check(collection, vehicle_no)
+    except Exception as e:
+        logger.error(f"Vehicle lookup failed for {vehicle_no}: {e}")
+        return jsonify({'error': 'Lookup failed.'}), 500
+
+    latest = serialize_check(doc) if doc else None
+    return jsonify({
+        'vehicle_no': vehicle_no,
+        'found': latest is not None,
+        'has_valid_certificate': bool(latest and latest['is_valid']),
+        'latest': latest,
+    })
+
+
+@main_bp.route('/api/vehicles')
+def vehicle_search():
+    """Prefix search over plates. Returns the latest check of each matching plate."""
+    prefix = normalize_vehicle_no(request.args.get('prefix'))
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return jsonify({'error': f'prefix must be at least {MIN_PREFIX_LENGTH} characters.'}), 400
+    limit = request.args.get('limit', 10, type=int)
+
+    collection = get_collection()
+    if collection is None:
+        return jsonify({'error': 'Database connection is not available.'}), 503
+
+    try:
+        docs = search_prefix(collection, prefix, limit=limit)
+    except Exception as e:
+        logger.error(f"Vehicle search failed for prefix {prefix}: {e}")
+        return jsonify({'error': 'Search failed.'}), 500
+
+    return jsonify({'prefix': prefix, 'results': [serialize_check(doc) for doc in docs]})
+
+
+@main_bp.route('/charts/<chart_key>')
+def chart_image(chart_key):
+    """Serves a rendered chart by its signed key, with a strong ETag and long-lived caching."""
+    # The key fully determines the image bytes, so a matching ETag never needs a re-render
+    if request.if_none_match.contains(chart_key):
+        response = make_response('', 304)
+        response.set_etag(chart_key)
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+    encoded_spec = request.args.get('s')
+    spec = decode_chart_spec(encoded_spec) if encoded_spec else None
+    if encoded_spec and spec is None:
+        abort(400)
+    rendered = get_rendered_chart(chart_key, spec) # None for unknown keys and specs the key does not sign
+    if rendered is None:
+        abort(404)
+
+    image_bytes, mimetype = rendered
+    response = make_response(image_bytes)
+    response.mimetype = mimetype
+    response.set_etag(chart_key)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@main_bp.route('/healthz')
+def healthz():
+    """Readiness probe: 200 when MongoDB is reachable from this worker, 503 otherwise."""
+    mongo = current_app.extensions['mongo']
+    if mongo.is_healthy(timeout=current_app.config.get('HEALTHZ_TIMEOUT_SECONDS', 1.0)):
+        return jsonify({'status': 'ok'})
+    return jsonify({'status': 'unavailable', 'error': mongo.last_error}), 503
+
+
+@main_bp.route('/metrics')
+def metrics_endpoint():
+    """Exposes request, MongoDB, chart and template timings in Prometheus text format."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+def _cache_gauges():
+    """Current cache counters, exported as gauges on every /metrics scrape."""
+    values = {}
+    for cache_name, stats in (('charts', CHART_CACHE.stats()), ('reports', REPORT_CACHE.stats())):
+        for stat in ('entries', 'bytes', 'hits', 'misses', 'evictions', 'hit_ratio'):
+            values[(cache_name, stat)] = stats[stat]
+    return values
+
+REGISTRY.register_gauge('app_cache_stat', 'In-process cache size and hit/miss counters.',
+                        _cache_gauges, label_names=('cache', 'stat'))
+
+
+@main_bp.route('/cache-stats')
+def cache_stats():
+    """Returns hit/miss counters of the in-process caches as JSON."""
+    return jsonify({'charts': CHART_CACHE.stats(), 'reports': REPORT_CACHE.stats()})
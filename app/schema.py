@@ -0,0 +1,237 @@
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from pymongo import ReplaceOne
+import pytz
+import logging
+
+from .utils import calculate_expiry_date
+
+logger = logging.getLogger(__name__)
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+# --- Check document schemas ---
+# v1 (no 'sv' field): vehicle_no, vehicle_type ('petrol'/'diesel'), wheels, duration_months,
+#     price (float rupees), check_date, expiry_date, and station_id if the check was recorded
+#     at a named station (STATION_ID).
+# v2 ('sv': 2): the same data under short keys, the fuel type as a small integer, the price as
+#     integer paise (exact sums) and, optionally, no stored expiry date (derived on read).
+# Both versions can live in one collection. Code that reads checks goes through decode_check()
+# or normalize_stage(), which present every document with the v1 field names, plus
+# price_paise, whatever version it is stored in.
+SCHEMA_VERSIONS = (1, 2)
+V2_FIELDS = {
+    'vehicle_no': 'vn',
+    'vehicle_type': 'ft',
+    'wheels': 'w',
+    'duration_months': 'dm',
+    'price_paise': 'pp',
+    'check_date': 'cd',
+    'expiry_date': 'ed',
+    'station_id': 'st',
+}
+FUEL_CODES = {'petrol': 1, 'diesel': 2}
+FUEL_NAMES = {code: name for name, code in FUEL_CODES.items()}
+
+MIGRATION_JOB_ID = 'check_schema_v2_migration'
+
+
+def _as_utc(dt):
+    """PyMongo returns naive UTC datetimes by default; make them timezone aware."""
+    return UTC.localize(dt) if dt.tzinfo is None else dt.astimezone(UTC)
+
+
+def to_paise(price):
+    """Converts a rupee amount (Decimal, float or str) to integer paise, rounding half up."""
+    return int((Decimal(str(price)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def derive_expiry_date(check_date, duration_months):
+    """Recomputes a stored check's expiry the way it was computed at check time (in IST).
+
+    The result is naive UTC if check_date is, like the dates PyMongo returns.
+    """
+    check_time_ist = _as_utc(check_date).astimezone(IST)
+    expiry_date = calculate_expiry_date(check_time_ist, duration_months).astimezone(UTC)
+    return expiry_date.replace(tzinfo=None) if check_date.tzinfo is None else expiry_date
+
+
+def encode_check(check, version=2, store_expiry=True):
+    """Builds the stored document for a check given with v1 field names (price in rupees).
+
+    Version 1 returns the v1 layout unchanged. store_expiry=False leaves the v2 expiry date
+    out; it is derived from check_date and duration_months on read.
+    """
+    if version == 1:
+        doc = {key: check[key] for key in ('vehicle_no', 'vehicle_type', 'wheels', 'duration_months',
+                                           'check_date', 'expiry_date')}
+        doc['price'] = float(check['price']) if 'price' in check else check['price_paise'] / 100
+        if check.get('station_id'):
+            doc['station_id'] = check['station_id']
+    else:
+        doc = {
+            'sv': 2,
+            'vn': check['vehicle_no'],
+            'ft': FUEL_CODES[check['vehicle_type']],
+            'w': check['wheels'],
+            'dm': check['duration_months'],
+            'pp': check['price_paise'] if 'price_paise' in check else to_paise(check['price']),
+            'cd': check['check_date'],
+        }
+        if store_expiry and check.get('expiry_date') is not None:
+            doc['ed'] = check['expiry_date']
+        if check.get('station_id'):
+            doc['st'] = check['station_id']
+    if '_id' in check:
+        doc = {'_id': check['_id'], **doc}
+    return doc
+
+
+def decode_check(doc):
+    """Returns a stored check of either version with v1 field names plus price_paise.
+
+    Fields missing from doc (e.g. left out by a projection) are left out of the result.
+    """
+    if doc is None:
+        return None
+    if 'sv' not in doc and 'vn' not in doc and 'cd' not in doc:
+        check = dict(doc)
+        if check.get('price') is not None:
+            check['price_paise'] = to_paise(check['price'])
+        check['schema_version'] = 1
+        return check
+
+    check = {'_id': doc['_id']} if '_id' in doc else {}
+    for field, short in V2_FIELDS.items():
+        if short in doc:
+            check[field] = doc[short]
+    if 'vehicle_type' in check:
+        check['vehicle_type'] = FUEL_NAMES.get(check['vehicle_type'])
+    if 'price_paise' in check:
+        check['price'] = check['price_paise'] / 100
+    if 'expiry_date' not in check and 'check_date' in check and 'duration_months' in check:
+        check['expiry_date'] = derive_expiry_date(check['check_date'], check['duration_months'])
+    check['schema_version'] = doc.get('sv', 2)
+    return check
+
+
+def stored_projection(fields):
+    """Returns a projection fetching the given v1 fields from documents of either version."""
+    projection = {'sv': 1}
+    for field in fields:
+        projection[field] = 1
+        projection[V2_FIELDS['price_paise'] if field == 'price' else V2_FIELDS[field]] = 1
+    if 'expiry_date' in fields:
+        # A v2 document without a stored expiry derives it from these
+        projection.update({V2_FIELDS['check_date']: 1, V2_FIELDS['duration_months']: 1})
+    return projection
+
+
+def match_either(field, condition):
+    """Returns a filter applying condition to a v1 field in either schema version.
+
+    Each branch of the $or is served by its own index, so range and equality
+    queries stay index scans while both versions are present.
+    """
+    return {'$or': [{field: condition}, {V2_FIELDS[field]: condition}]}
+
+
+def rupees_to_paise(expression):
+    """Aggregation expression rounding a non-negative rupee amount to whole paise.
+
+    Rounds half up like to_paise(). $floor(x + 0.5) rather than $round, which the mongomock
+    benchmark backend (benchmarks/run.py) cannot evaluate.
+    """
+    return {'$floor': {'$add': [{'$multiply': [expression, 100]}, 0.5]}}
+
+
+def normalize_stage():
+    """Returns a $project stage presenting checks of either version with v1 field names.
+
+    price_paise is exact for v2 documents and the rounded float price for v1 ones.
+    Put it after the $match so the match can still use the indexes.
+    """
+    return {
+        '$project': {
+            'vehicle_no': {'$ifNull': ['$vn', '$vehicle_no']},
+            'vehicle_type': {'$ifNull': [
+                {'$switch': {
+                    'branches': [{'case': {'$eq': ['$ft', code]}, 'then': name} for name, code in FUEL_CODES.items()],
+                    'default': None,
+                }},
+                '$vehicle_type',
+            ]},
+            'wheels': {'$ifNull': ['$w', '$wheels']},
+            'duration_months': {'$ifNull': ['$dm', '$duration_months']},
+            'price_paise': {'$ifNull': ['$pp', rupees_to_paise('$price')]},
+            'check_date': {'$ifNull': ['$cd', '$check_date']},
+            'station_id': {'$ifNull': ['$st', '$station_id']},
+        }
+    }
+
+
+def collection_storage_stats(collection):
+    """Returns count, data size, average document size, storage and index sizes (bytes), or None."""
+    try:
+        stats = next(collection.aggregate([{'$collStats': {'storageStats': {}}}]))['storageStats']
+    except Exception as e:
+        logger.warning(f"Could not read storage stats of '{collection.name}': {e}")
+        return None
+    return {key: stats.get(key, 0) for key in ('count', 'size', 'avgObjSize', 'storageSize', 'totalIndexSize')}
+
+
+def migrate_checks_to_v2(collection, batch_size=1000, store_expiry=True, restart=False):
+    """Rewrites v1 check documents in place as v2, in _id order, one batch at a time.
+
+    The last migrated _id is checkpointed after every batch, so an interrupted run
+    resumes where it stopped. Each replace only applies if the document is still v1,
+    so running alongside the app (which may write v2 documents) is safe. Returns stats
+    including the collection's storage before and after.
+    """
+    from .reminders import CHECKPOINTS_COLLECTION_NAME # reminders imports this module
+    checkpoints = collection.database[CHECKPOINTS_COLLECTION_NAME]
+    state = checkpoints.find_one({'_id': MIGRATION_JOB_ID}) or {}
+    if restart or state.get('status') != 'running':
+        state = {'status': 'running', 'last_id': None, 'migrated': 0,
+                 'before': collection_storage_stats(collection)}
+        checkpoints.replace_one({'_id': MIGRATION_JOB_ID}, state, upsert=True)
+    else:
+        logger.info(f"Resuming check schema migration after _id {state['last_id']}.")
+
+    started = time.perf_counter()
+    migrated = 0
+    while True:
+        query = {'sv': {'$exists': False}}
+        if state['last_id'] is not None:
+            query['_id'] = {'$gt': state['last_id']}
+        batch = list(collection.find(query).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+
+        replaces = []
+        for doc in batch:
+            try:
+                replacement = encode_check(decode_check(doc), version=2, store_expiry=store_expiry)
+            except (KeyError, TypeError, ValueError) as e:
+                # Malformed legacy document: leave it as v1, reads handle both versions
+                logger.warning(f"Skipping check {doc['_id']} in schema migration: {e!r}")
+                continue
+            replaces.append(ReplaceOne({'_id': doc['_id'], 'sv': {'$exists': False}}, replacement))
+        batch_migrated = collection.bulk_write(replaces, ordered=False).modified_count if replaces else 0
+        migrated += batch_migrated
+        state['last_id'] = batch[-1]['_id']
+        checkpoints.update_one({'_id': MIGRATION_JOB_ID},
+                               {'$set': {'last_id': state['last_id']}, '$inc': {'migrated': batch_migrated}})
+        elapsed = time.perf_counter() - started
+        logger.info(f"Check schema migration: {migrated} documents rewritten ({migrated / elapsed:.0f} docs/sec).")
+
+    elapsed = time.perf_counter() - started
+    after = collection_storage_stats(collection)
+    checkpoints.update_one({'_id': MIGRATION_JOB_ID}, {'$set': {'status': 'completed', 'after': after}})
+    return {
+        'migrated': migrated,
+        'elapsed': elapsed,
+        'docs_per_sec': migrated / elapsed if elapsed > 0 else 0.0,
+        'before': state.get('before'),
+        'after': after,
+    }
@@ -4,12 +4,16 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initialize form handling
     initFormValidation();
     initFormDependencies(); // Call this after validation setup
+    initVehicleLookup();
 
     // Initialize dashboard animations
     initDashboardAnimations();
 
     // Initialize chart interactions
     initChartInteractions();
+
+    // Follow today's new checks on the reports page
+    initLiveReport();
 });
 
 // Form validation with visual feedback
@@ -177,6 +181,50 @@ function initFormDependencies() {
     }
 }
 
+// Warn about duplicate submissions: look up the plate once the user stops typing
+function initVehicleLookup() {
+    const vehicleInput = document.getElementById('vehicle_no');
+    if (!vehicleInput || !vehicleInput.dataset.lookupUrl) return;
+    const statusEl = vehicleInput.parentElement.querySelector('.vehicle-lookup-status');
+    let debounceTimer = null;
+    let lastPlate = '';
+
+    const lookup = async () => {
+        const plate = vehicleInput.value.trim().toUpperCase();
+        if (plate === lastPlate) return;
+        lastPlate = plate;
+        if (statusEl) {
+            statusEl.textContent = '';
+            statusEl.classList.remove('text-warning', 'text-muted');
+        }
+        if (plate.length < 4) return;
+
+        try {
+            const url = vehicleInput.dataset.lookupUrl.replace('__PLATE__', encodeURIComponent(plate));
+            const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+            if (!response.ok || plate !== vehicleInput.value.trim().toUpperCase()) return; // Stale answer
+            const result = await response.json();
+            if (!statusEl) return;
+            if (result.has_valid_certificate) {
+                const expiry = new Date(result.latest.expiry_date).toLocaleDateString();
+                statusEl.textContent = `${plate} already has a valid certificate until ${expiry}.`;
+                statusEl.classList.add('text-warning');
+            } else if (result.found) {
+                statusEl.textContent = `Previous certificate for ${plate} has expired.`;
+                statusEl.classList.add('text-muted');
+            }
+        } catch (err) {
+            console.error('Vehicle lookup failed:', err); // Lookup is advisory only
+        }
+    };
+
+    vehicleInput.addEventListener('input', () => {
+        clearTimeout(debounceTimer);
+        debounceTimer = setTimeout(lookup, 400);
+    });
+    vehicleInput.addEventListener('blur', lookup);
+}
+
 // --- REVISED FUNCTION using DOM methods ---
 function updateVehicleTypeOptions(wheelsValue) {
     const vehicleTypeSelect = document.getElementById('vehicle_type');
@@ -283,6 +331,7 @@ function animateValue(element, start, end, duration) {
     const decimalPlaces = 2; // For currency
 
     const step = (timestamp) => {
+        if (element.dataset.liveValue !== undefined) return; // A live update replaced the value
         if (!startTimestamp) startTimestamp = timestamp;
         const progress = Math.min((timestamp - startTimestamp) / duration, 1);
         // Calculate value, potentially non-integer for currency
@@ -301,6 +350,57 @@ function animateValue(element, start, end, duration) {
     window.requestAnimationFrame(step);
 }
 
+// Live report cards: today's counters pushed by /reports/live (Server-Sent Events)
+function initLiveReport() {
+    const container = document.querySelector('.reports-container[data-live-url]');
+    if (!container || !window.EventSource) return;
+
+    const day = container.dataset.liveDay;
+    // Today's counters as of the rendered report; later events are applied relative to them
+    let baseline = JSON.parse(container.dataset.liveBaseline || '{}');
+    const fields = {};
+    container.querySelectorAll('[data-live-field]').forEach(el => {
+        const field = el.dataset.liveField;
+        const shown = parseFloat(el.textContent.replace(/[^0-9.]+/g, '')) || 0;
+        // Sales are kept in paise so repeated additions stay exact
+        const value = field === 'total_sales_paise' ? Math.round(shown * 100) : shown;
+        fields[field] = { el: el, value: value };
+    });
+
+    function applyChange(field, change) {
+        const entry = fields[field];
+        if (!entry || !change) return;
+        entry.value += change;
+        entry.el.dataset.liveValue = entry.value;
+        entry.el.textContent = field === 'total_sales_paise'
+            ? `₹ ${(entry.value / 100).toFixed(2)}`
+            : String(entry.value);
+        // Restart the highlight animation
+        entry.el.classList.remove('live-updated');
+        void entry.el.offsetWidth;
+        entry.el.classList.add('live-updated');
+    }
+
+    const source = new EventSource(container.dataset.liveUrl);
+    source.addEventListener('snapshot', event => {
+        const data = JSON.parse(event.data);
+        if (data.day !== day) { source.close(); return; } // Today moved past the report's range
+        // Catch up on checks saved between rendering the page and (re)connecting
+        Object.keys(data.counters).forEach(field => {
+            applyChange(field, data.counters[field] - (baseline[field] || 0));
+        });
+        baseline = data.counters;
+    });
+    source.addEventListener('delta', event => {
+        const data = JSON.parse(event.data);
+        if (data.day !== day) { source.close(); return; }
+        Object.keys(data.delta).forEach(field => {
+            applyChange(field, data.delta[field]);
+            baseline[field] = (baseline[field] || 0) + data.delta[field];
+        });
+    });
+}
+
 // Chart interactions (basic hover effect)
 function initChartInteractions() {
     // Animate charts on load using Intersection Observer
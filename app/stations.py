@@ -0,0 +1,175 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+from .reports import REPORT_COUNTER_FIELDS, add_counters, counters_to_report, check_date_match, report_group_fields
+from .rollups import rollup_sum_fields
+from .schema import V2_FIELDS, normalize_stage
+
+logger = logging.getLogger(__name__)
+
+# --- Stations ---
+# Each deployment at a testing centre sets STATION_ID; the checks it records carry it
+# (station_id, or 'st' in schema v2) and the daily rollups keep per-station counters.
+# Checks recorded without a station (older data, single-centre installs) are reported
+# as unassigned. Station ids are used as rollup field names, hence the restricted format.
+STATION_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,31}$')
+# grouped: one aggregation grouped by station, over the daily rollups or the raw checks (USE_REPORT_ROLLUPS)
+# fanout:  one (station_id, check_date) index range aggregation per station, run concurrently; suits
+#          collections sharded or otherwise partitioned by station. Unassigned checks are left out.
+STATION_REPORT_MODES = ('grouped', 'fanout')
+
+
+def validate_station_id(value):
+    """Returns a cleaned station id, or None if value is empty. Raises ValueError if it is malformed."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if not STATION_ID_PATTERN.match(value):
+        raise ValueError(f"Invalid station id {value!r}: use up to 32 letters, digits, '-' or '_', "
+                         f"starting with a letter or digit.")
+    return value
+
+
+def station_match(station_id, start_dt_utc, end_dt_utc):
+    """Returns a filter selecting one station's checks of either schema version in [start, end).
+
+    Each branch of the $or is a range scan on its own (station, check date) index.
+    """
+    date_range = {'$gte': start_dt_utc, '$lt': end_dt_utc}
+    return {'$or': [
+        {'station_id': station_id, 'check_date': date_range},
+        {V2_FIELDS['station_id']: station_id, V2_FIELDS['check_date']: date_range},
+    ]}
+
+
+def summarize_stations(station_counters):
+    """Shapes {station_id: REPORT_COUNTER_FIELDS} into {'totals', 'stations'} in the report_data layout.
+
+    stations is a list of report dicts plus 'station_id', ordered by station id with
+    unassigned checks (None) last. Returns None if there are no checks.
+    """
+    totals = {}
+    for counters in station_counters.values():
+        add_counters(totals, counters)
+    if not totals.get('total_checks'):
+        return None
+    ordered = sorted(station_counters.items(), key=lambda item: (item[0] is None, item[0] or ''))
+    return {
+        'totals': counters_to_report(totals),
+        'stations': [{'station_id': station_id, **counters_to_report(counters)}
+                     for station_id, counters in ordered if counters.get('total_checks')],
+    }
+
+
+def build_station_report_pipeline(start_dt_utc, end_dt_utc):
+    """Builds the pipeline that summarises raw checks in [start, end) per station, in one pass."""
+    return [
+        check_date_match(start_dt_utc, end_dt_utc),
+        normalize_stage(),
+        {'$group': {'_id': '$station_id', **report_group_fields()}},
+    ]
+
+
+def run_station_report(collection, start_dt_utc, end_dt_utc, archive=None):
+    """Per-station report over raw checks in one grouped aggregation. Returns summarize_stations()'s dict or None.
+
+    Archived months in the range are counted from the archive and merged per station.
+    """
+    stations = {doc['_id']: add_counters({}, doc)
+                for doc in collection.aggregate(build_station_report_pipeline(start_dt_utc, end_dt_utc))}
+    if archive is not None and archive.covers(start_dt_utc, end_dt_utc):
+        merge_archived_stations(stations, archive.station_counters(start_dt_utc, end_dt_utc))
+    return summarize_stations(stations)
+
+
+def merge_archived_stations(stations, archived, station_ids=None):
+    """Adds archived {station_id: counters} into stations, in place.
+
+    With station_ids (a set) only those stations are merged.
+    """
+    for station_id, counters in archived.items():
+        if station_ids is None or station_id in station_ids:
+            add_counters(stations.setdefault(station_id, {}), counters)
+    return stations
+
+
+def build_rollup_station_pipeline(start_dt_utc, end_dt_utc):
+    """Builds the pipeline that sums rollup documents in [start, end) overall and per station."""
+    return [
+        {'$match': {'day_start': {'$gte': start_dt_utc, '$lt': end_dt_utc}}},
+        {'$facet': {
+            'totals': [{'$group': {'_id': None, **rollup_sum_fields()}}],
+            'stations': [
+                {'$project': {'station': {'$objectToArray': {'$ifNull': ['$stations', {}]}}}},
+                {'$unwind': '$station'},
+                {'$group': {'_id': '$station.k',
+                            **{field: {'$sum': f'$station.v.{field}'} for field in REPORT_COUNTER_FIELDS}}},
+            ],
+        }},
+    ]
+
+
+def summarize_rollup_stations(rollup_collection, start_dt_utc, end_dt_utc):
+    """Per-station report from the daily rollups. Same result as run_station_report, or None."""
+    results = list(rollup_collection.aggregate(build_rollup_station_pipeline(start_dt_utc, end_dt_utc)))
+    return summarize_rollup_station_results(results)
+
+
+def summarize_rollup_station_results(results):
+    """Shapes the output of build_rollup_station_pipeline() like summarize_stations(), or None."""
+    facet = results[0] if results else {}
+    totals = add_counters({}, (facet.get('totals') or [{}])[0])
+    stations = {doc['_id']: add_counters({}, doc) for doc in facet.get('stations', [])}
+    # Checks without a station have no per-station counters; they are what the stations leave of the totals
+    unassigned = {field: totals[field] - sum(counters[field] for counters in stations.values())
+                  for field in REPORT_COUNTER_FIELDS}
+    if unassigned['total_checks']:
+        stations[None] = unassigned
+    return summarize_stations(stations)
+
+
+def known_stations(collection):
+    """Returns every station id with checks in collection, read from the station indexes."""
+    station_ids = set()
+    for field in ('station_id', V2_FIELDS['station_id']):
+        station_ids.update(collection.distinct(field, {field: {'$exists': True}}))
+    return sorted(station_ids)
+
+
+def build_station_fanout_pipeline(station_id, start_dt_utc, end_dt_utc):
+    """Builds the pipeline that summarises one station's raw checks in [start, end)."""
+    return [
+        {'$match': station_match(station_id, start_dt_utc, end_dt_utc)},
+        normalize_stage(),
+        {'$group': {'_id': None, **report_group_fields()}},
+    ]
+
+
+def _station_counters(collection, station_id, start_dt_utc, end_dt_utc):
+    results = list(collection.aggregate(build_station_fanout_pipeline(station_id, start_dt_utc, end_dt_utc)))
+    return add_counters({}, results[0] if results else {})
+
+
+def run_station_fanout(collection, start_dt_utc, end_dt_utc, station_ids=None, max_workers=4, archive=None):
+    """Per-station report with one index range aggregation per station, max_workers at a time.
+
+    Each aggregation only reads its own station's index range, so on a collection sharded
+    by station every one of them targets a single shard. station_ids defaults to every
+    known station. Unassigned checks are not counted. Returns summarize_stations()'s dict or None.
+    """
+    requested = None if station_ids is None else set(station_ids)
+    station_ids = known_stations(collection) if station_ids is None else sorted(requested)
+    stations = {}
+    if station_ids:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(station_ids))),
+                                thread_name_prefix='station-report') as pool:
+            futures = {station_id: pool.submit(_station_counters, collection, station_id, start_dt_utc, end_dt_utc)
+                       for station_id in station_ids}
+            stations = {station_id: future.result() for station_id, future in futures.items()}
+    if archive is not None and archive.covers(start_dt_utc, end_dt_utc):
+        # Unassigned checks are not in any station's index range, so they are left out here too
+        archived = {station_id: counters for station_id, counters
+                    in archive.station_counters(start_dt_utc, end_dt_utc).items() if station_id is not None}
+        merge_archived_stations(stations, archived, station_ids=requested)
+    return summarize_stations(stations)
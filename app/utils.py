@@ -2,34 +2,36 @@
 
 import os
 from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg') # Use non-interactive backend suitable for web servers
-import matplotlib.pyplot as plt
 from io import BytesIO
 import base64
+import hashlib
+import hmac
+import json
+import math
 import pytz
 import logging
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
+from flask import current_app, has_app_context, url_for
+from .cache import LRUCache
+from .metrics import timed
+from .charts import render_pie_svg, render_trend_svg, is_valid_color
 
 logger = logging.getLogger(__name__)
 IST = pytz.timezone('Asia/Kolkata')
 UTC = pytz.utc
 
 # --- Price Calculation ---
-# ... (get_price function remains the same) ...
-def get_price(wheels: int, duration_months: int) -> Decimal:
-    """Gets the price based on wheels and duration from environment variables."""
-    price_key = f"PRICE_{wheels}W_{duration_months}M"
-    price_str = os.getenv(price_key)
+def get_price(wheels: int, duration_months: int, when: datetime = None) -> Decimal:
+    """Gets the price in effect at `when` (default: now) from the app's price table (app/pricing.py)."""
+    from .pricing import PriceConfigError, get_price_book # pricing imports checks, which imports this module
     try:
-        if price_str is None:
-            raise ValueError(f"Price configuration not found for key: {price_key}")
-        price = Decimal(price_str)
+        price = get_price_book().price(wheels, duration_months, when)
+        if price is None:
+            raise PriceConfigError(f"No price for {wheels} wheels, {duration_months} months.")
         return price
-    except (InvalidOperation, ValueError) as e:
-        logger.error(f"Invalid price configuration for {price_key}: {price_str}. Error: {e}")
-        # Return a default or raise a specific error
-        return Decimal('0.0') # Or raise Exception("Invalid price configuration")
+    except PriceConfigError as e:
+        logger.error(f"Price lookup failed: {e}")
+        return Decimal('0.0') # Callers treat zero as "price unavailable"
 
 
 # --- Date Calculation ---
@@ -58,8 +60,25 @@ def calculate_expiry_date(check_date: datetime, duration_months: int) -> datetim
 
 
 # --- Chart Generation ---
-def generate_pie_chart(data, labels, title, colors=None):
-    """Generates a pie chart using Matplotlib and returns a base64 encoded image string."""
+CHART_BACKENDS = ('svg', 'matplotlib')
+
+def chart_backend(config=None):
+    """Returns the configured chart backend ('svg' by default, 'matplotlib' optional).
+
+    Reads config if given, else the current app's config, else the environment.
+    """
+    if config is not None:
+        backend = config.get('CHART_BACKEND', 'svg')
+    elif has_app_context():
+        backend = current_app.config.get('CHART_BACKEND', 'svg')
+    else:
+        backend = os.getenv('CHART_BACKEND', 'svg')
+    return backend if backend in CHART_BACKENDS else 'svg'
+
+
+@timed('chart_render')
+def render_pie_chart(data, labels, title, colors=None, backend=None):
+    """Renders a pie chart and returns (image_bytes, mimetype), or None if there is nothing to plot."""
     if not data or not labels or len(data) != len(labels):
         logger.warning(f"Invalid data or labels for chart '{title}'. Skipping chart generation.")
         return None
@@ -67,6 +86,198 @@ def generate_pie_chart(data, labels, title, colors=None):
         logger.info(f"No data to plot for chart '{title}'. Skipping chart generation.")
         return None
 
+    backend = backend or chart_backend()
+    if backend == 'matplotlib':
+        try:
+            return _render_pie_matplotlib(data, labels, title, colors), 'image/png'
+        except ImportError:
+            logger.warning("CHART_BACKEND=matplotlib but Matplotlib is not installed. Falling back to SVG.")
+    return render_pie_svg(data, labels, title, colors).encode('utf-8'), 'image/svg+xml'
+
+
+@timed('chart_render')
+def render_trend_chart(labels, series, title, kind='line', colors=None):
+    """Renders a bar/line trend chart and returns (image_bytes, mimetype), or None if there is nothing to plot.
+
+    Always SVG: the Matplotlib backend only covers the report pie charts.
+    """
+    if not labels or not series or any(len(values) != len(labels) for _, values in series):
+        logger.warning(f"Invalid labels or series for chart '{title}'. Skipping chart generation.")
+        return None
+    return render_trend_svg(labels, series, title, kind, colors).encode('utf-8'), 'image/svg+xml'
+
+
+def generate_pie_chart(data, labels, title, colors=None):
+    """Generates a pie chart and returns it as a base64 encoded data URI."""
+    rendered = render_pie_chart(data, labels, title, colors)
+    if rendered is None:
+        return None
+    image_bytes, mimetype = rendered
+    chart_base64 = base64.b64encode(image_bytes).decode('utf-8')
+    return f"data:{mimetype};base64,{chart_base64}"
+
+
+# --- Content-Addressed Chart Serving ---
+# Rendered chart bytes keyed by chart_key(). Bounded by entry count and total bytes.
+CHART_CACHE = LRUCache(max_items=int(os.getenv('CHART_CACHE_MAX_ITEMS', '256')),
+                       max_bytes=int(os.getenv('CHART_CACHE_MAX_BYTES', str(16 * 1024 * 1024))))
+
+def make_chart_spec(data, labels, title, colors=None):
+    """Returns the canonical, JSON-serialisable description of a pie chart."""
+    return {
+        'type': 'pie',
+        'data': [int(v) for v in data],
+        'labels': [str(l) for l in labels],
+        'title': str(title),
+        'colors': list(colors) if colors else None,
+    }
+
+
+def make_trend_chart_spec(labels, series, title, kind='line', colors=None):
+    """Returns the canonical, JSON-serialisable description of a trend chart."""
+    return {
+        'type': 'trend',
+        'kind': 'bar' if kind == 'bar' else 'line',
+        'labels': [str(l) for l in labels],
+        'series': [[str(name), [round(float(v), 2) for v in values]] for name, values in series],
+        'title': str(title),
+        'colors': list(colors) if colors else None,
+    }
+
+
+def chart_key(spec, backend, secret_key=None):
+    """Returns the key identifying the image rendered from spec with backend.
+
+    The key is an HMAC of the spec under SECRET_KEY (secret_key, else the current app's,
+    else the environment's), so only specs built by the server map to a valid key.
+    """
+    if secret_key is None:
+        secret_key = current_app.config['SECRET_KEY'] if has_app_context() else os.getenv('SECRET_KEY', 'dev_secret_key')
+    canonical = json.dumps([backend, spec], sort_keys=True, separators=(',', ':'))
+    return hmac.new(str(secret_key).encode('utf-8'), canonical.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def encode_chart_spec(spec):
+    """Encodes a chart spec for use in a URL query string."""
+    raw = json.dumps(spec, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_chart_spec(encoded):
+    """Decodes a spec produced by encode_chart_spec. Returns None if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        spec = json.loads(raw)
+        return spec if isinstance(spec, dict) else None
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Invalid chart spec in request: {e}")
+        return None
+
+
+# Upper bounds for a chart spec: a daily trend chart covers up to ten years
+MAX_PIE_SLICES = 16
+MAX_TREND_POINTS = 3660
+MAX_TREND_SERIES = 8
+MAX_CHART_TEXT_LENGTH = 200
+
+
+def _check_texts(values, name, max_count):
+    if not isinstance(values, list) or not 0 < len(values) <= max_count:
+        raise ValueError(f"{name} must be a list of 1 to {max_count} items")
+    if not all(isinstance(v, str) and len(v) <= MAX_CHART_TEXT_LENGTH for v in values):
+        raise ValueError(f"{name} must be strings of up to {MAX_CHART_TEXT_LENGTH} characters")
+
+
+def _check_numbers(values, name, count):
+    if not isinstance(values, list) or len(values) != count:
+        raise ValueError(f"{name} must be a list of {count} numbers")
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) and v >= 0
+               for v in values):
+        raise ValueError(f"{name} must be non-negative numbers")
+
+
+def validate_chart_spec(spec):
+    """Checks that spec is a well-formed pie or trend spec within the size limits. Raises ValueError if not."""
+    if not isinstance(spec, dict):
+        raise ValueError("spec must be an object")
+    if not isinstance(spec.get('title', ''), str) or len(spec.get('title', '')) > MAX_CHART_TEXT_LENGTH:
+        raise ValueError(f"title must be a string of up to {MAX_CHART_TEXT_LENGTH} characters")
+    colors = spec.get('colors')
+    if colors is not None and (not isinstance(colors, list) or len(colors) > max(MAX_PIE_SLICES, MAX_TREND_SERIES)
+                               or not all(is_valid_color(c) for c in colors)):
+        raise ValueError("colors must be a short list of hex or named colors")
+
+    if spec.get('type') == 'pie':
+        _check_texts(spec.get('labels'), 'labels', MAX_PIE_SLICES)
+        _check_numbers(spec.get('data'), 'data', len(spec['labels']))
+    elif spec.get('type') == 'trend':
+        if spec.get('kind', 'line') not in ('line', 'bar'):
+            raise ValueError("kind must be 'line' or 'bar'")
+        _check_texts(spec.get('labels'), 'labels', MAX_TREND_POINTS)
+        series = spec.get('series')
+        if not isinstance(series, list) or not 0 < len(series) <= MAX_TREND_SERIES:
+            raise ValueError(f"series must be a list of 1 to {MAX_TREND_SERIES} items")
+        for item in series:
+            if not isinstance(item, list) or len(item) != 2:
+                raise ValueError("each series must be a [name, values] pair")
+            _check_texts([item[0]], 'series names', 1)
+            _check_numbers(item[1], 'series values', len(spec['labels']))
+    else:
+        raise ValueError(f"unknown chart type {spec.get('type')!r}")
+    return spec
+
+
+def render_chart_spec(spec, backend=None):
+    """Renders a chart spec. Returns (image_bytes, mimetype), or None if it is invalid or has nothing to plot."""
+    try:
+        validate_chart_spec(spec)
+    except ValueError as e:
+        logger.warning(f"Invalid chart spec: {e}")
+        return None
+    if spec.get('type') == 'pie':
+        return render_pie_chart(spec.get('data'), spec.get('labels'), spec.get('title', ''),
+                                spec.get('colors'), backend=backend)
+    return render_trend_chart(spec.get('labels'), spec.get('series'), spec.get('title', ''),
+                              spec.get('kind', 'line'), spec.get('colors'))
+
+
+def get_rendered_chart(key, spec=None, backend=None):
+    """Returns (image_bytes, mimetype) for a chart key, rendering and caching it from spec on a miss.
+
+    The spec must be signed by key (see chart_key), so a client cannot render a chart the
+    server did not build. Returns None if the chart is not cached and cannot be rendered.
+    """
+    rendered = CHART_CACHE.get(key)
+    if rendered is not None:
+        return rendered
+    if spec is None:
+        return None
+    backend = backend or chart_backend()
+    if not hmac.compare_digest(chart_key(spec, backend), key):
+        logger.warning(f"Chart spec does not match key {key}.")
+        return None
+    rendered = render_chart_spec(spec, backend=backend)
+    if rendered is not None:
+        CHART_CACHE.put(key, rendered, size=len(rendered[0]))
+    return rendered
+
+
+def chart_spec_url(spec):
+    """Renders (or reuses) the chart described by spec and returns its signed URL, or None if there is nothing to plot."""
+    backend = chart_backend()
+    key = chart_key(spec, backend)
+    if get_rendered_chart(key, spec, backend=backend) is None:
+        return None
+    # The spec travels with the URL so any worker can re-render after a cache miss
+    return url_for('main.chart_image', chart_key=key, s=encode_chart_spec(spec))
+
+
+def _render_pie_matplotlib(data, labels, title, colors=None):
+    """Renders the pie chart with Matplotlib and returns PNG bytes. Imported lazily: Matplotlib is optional."""
+    import matplotlib
+    matplotlib.use('Agg') # Use non-interactive backend suitable for web servers
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(figsize=(6, 4.5)) # Slightly taller figure for better label spacing
 
     # Use provided colors or default cycle
@@ -118,14 +329,11 @@ def generate_pie_chart(data, labels, title, colors=None):
     # Use bbox_inches='tight' to include legend, increase dpi for better quality
     plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
     plt.close(fig) # Close the figure to free memory
-    img.seek(0)
-
-    # Encode in base64
-    chart_base64 = base64.b64encode(img.getvalue()).decode('utf-8')
-    return f"data:image/png;base64,{chart_base64}"
+    return img.getvalue()
 
 # --- Date Range Handling for Queries ---
 # ... (get_utc_date_range function remains the same) ...
+@timed('get_utc_date_range')
 def get_utc_date_range(start_date_str, end_date_str):
     """Parses IST date strings and returns a UTC datetime range for querying."""
     try:
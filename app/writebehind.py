@@ -0,0 +1,305 @@
+import atexit
+import fcntl
+import glob
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+import logging
+
+from .metrics import (WRITE_BEHIND_FLUSH_LATENCY, WRITE_BEHIND_FLUSHED, WRITE_BEHIND_FAILURES,
+                      WRITE_BEHIND_DEAD_LETTERED)
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PATTERN = 'checks-*.ndjson'
+DEAD_LETTER_NAME = 'dead-letter.ndjson' # Checks MongoDB refused (e.g. validation errors), one JSON line each
+DUPLICATE_KEY_ERROR = 11000
+RETRY_INITIAL_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+JOURNAL_COMPACT_BYTES = 4 * 1024 * 1024 # Rewrite a busy journal down to its unflushed entries past this size
+
+
+class WriteBehindQueue:
+    """Accepts check documents durably and inserts them into MongoDB in the background.
+
+    submit() appends the document (with a pre-assigned _id) to this process's journal
+    file and fsyncs it before returning, so an accepted check survives a crash. A worker
+    thread drains the queue with insert_many, at most max_batch documents at a time and
+    no later than max_delay seconds after the oldest one was queued. The journal is
+    truncated whenever everything written to it has been flushed, and rewritten with
+    just the unflushed entries once it grows past JOURNAL_COMPACT_BYTES, so it stays
+    small under sustained load too.
+
+    Each process owns a journal of its own, held under an exclusive flock. On start, journals
+    left behind by dead processes (their lock is free) are taken over and replayed.
+    Because _id is assigned up front, a replayed document that already reached MongoDB
+    fails with a duplicate key and is skipped, so replay is idempotent.
+
+    A batch that fails as a whole (network errors) is retried with backoff; its documents
+    that then turn out to be duplicates were written by the failed attempt and count as
+    inserted. Documents MongoDB refuses for another reason (e.g. schema validation) are
+    never retried: they are appended to the dead-letter file in journal_dir instead.
+
+    on_flushed(entries) runs in an app context after each batch with the documents
+    that were newly inserted (rollups, caches).
+    """
+
+    def __init__(self, app, get_collection, on_flushed=None, journal_dir=None, max_batch=500, max_delay=0.2):
+        self.app = app
+        self.get_collection = get_collection
+        self.on_flushed = on_flushed
+        self.journal_dir = journal_dir or os.path.join(app.instance_path, 'journal')
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _reset(self):
+        """Per-process state; a forked child must not share the parent's journal or thread."""
+        self._cond = threading.Condition()
+        self._pending = [] # Journaled, not yet taken by the worker
+        self._inflight = 0 # Taken by the worker, insert not confirmed yet
+        self._oldest_queued_at = None
+        self._closed = False
+        self._maybe_written = set() # _ids of documents whose insert failed with an unknown outcome
+        os.makedirs(self.journal_dir, exist_ok=True)
+        # pids are reused across restarts, so the name also carries a random suffix
+        self._journal_path = os.path.join(self.journal_dir, f'checks-{os.getpid()}-{uuid.uuid4().hex[:8]}.ndjson')
+        self._journal = self._open_locked_journal([])
+
+    def _open_locked_journal(self, lines):
+        """Writes lines to a new file locked by this process and moves it to the journal path.
+
+        The file is locked under a name other processes do not scan, then renamed into place:
+        visible unlocked, it could be taken for an orphan, replayed and removed under us.
+        """
+        temp_path = os.path.join(os.path.dirname(self._journal_path), f'.{os.path.basename(self._journal_path)}.tmp')
+        journal = open(temp_path, 'a', encoding='utf-8') # Appends go to the end, also after truncate(0)
+        fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        journal.truncate(0) # Left over from an interrupted compaction
+        if lines:
+            journal.write(''.join(lines))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.rename(temp_path, self._journal_path)
+        return journal
+
+    def _compact_journal(self):
+        """Replaces the journal with one holding only the entries not flushed yet. Call with _cond held."""
+        old = self._journal
+        self._journal = self._open_locked_journal([json_util.dumps(entry) + '\n' for entry in self._pending])
+        old.close()
+
+    def ensure_started(self):
+        """Opens the journal, replays orphaned journals and starts the worker, once per process."""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._start_lock:
+            if self._pid == pid:
+                return
+            self._reset()
+            replayed = self._replay_orphans()
+            self._pid = pid
+            threading.Thread(target=self._run, name='write-behind-flusher', daemon=True).start()
+            atexit.register(self.close)
+        logger.info(f"Write-behind queue started with journal {self._journal_path}"
+                    + (f" ({replayed} entries replayed)." if replayed else "."))
+
+    @property
+    def depth(self):
+        """Checks accepted but not yet confirmed in MongoDB by this process."""
+        if self._pid != os.getpid():
+            return 0
+        with self._cond:
+            return len(self._pending) + self._inflight
+
+    def _write_journal(self, lines):
+        self._journal.write(''.join(lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def submit(self, entry):
+        """Journals one check document and queues it for insertion. Returns its _id.
+
+        Raises OSError if the journal cannot be written; the check is not accepted then.
+        """
+        self.ensure_started()
+        entry.setdefault('_id', ObjectId())
+        line = json_util.dumps(entry) + '\n'
+        with self._cond:
+            self._write_journal([line])
+            self._pending.append(entry)
+            if self._oldest_queued_at is None:
+                self._oldest_queued_at = time.monotonic()
+            self._cond.notify()
+        return entry['_id']
+
+    def _replay_orphans(self):
+        """Moves the entries of journals whose owner process is gone into this process's journal."""
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, JOURNAL_PATTERN))):
+            if path == self._journal_path:
+                continue
+            try:
+                orphan = open(path, 'r+', encoding='utf-8')
+            except FileNotFoundError:
+                continue # Another process replayed it first
+            with orphan:
+                try:
+                    fcntl.flock(orphan, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue # Owned by a live process
+                if not os.path.exists(path):
+                    continue # Replayed and removed between our open() and flock()
+                lines, entries = [], []
+                for line_no, line in enumerate(orphan, start=1):
+                    try:
+                        entries.append(json_util.loads(line))
+                        lines.append(line if line.endswith('\n') else line + '\n')
+                    except ValueError:
+                        # A torn final line from a crash mid-write was never acknowledged
+                        logger.warning(f"Skipping unreadable journal line {line_no} in {path}.")
+                if entries:
+                    self._write_journal(lines)
+                    self._pending.extend(entries)
+                    self._oldest_queued_at = time.monotonic()
+                    replayed += len(entries)
+                os.remove(path)
+                logger.info(f"Replaying {len(entries)} journaled check(s) from {path}.")
+        return replayed
+
+    def _next_batch(self):
+        """Blocks until a batch is due (full, or max_delay old) and takes it off the queue."""
+        with self._cond:
+            while True:
+                if self._pending:
+                    waited = time.monotonic() - self._oldest_queued_at
+                    if len(self._pending) >= self.max_batch or waited >= self.max_delay or self._closed:
+                        break
+                    self._cond.wait(self.max_delay - waited)
+                elif self._closed:
+                    return []
+                else:
+                    self._cond.wait()
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            self._inflight = len(batch)
+            self._oldest_queued_at = time.monotonic() if self._pending else None
+            return batch
+
+    def _insert(self, batch):
+        """Inserts a batch. Returns (inserted, rejected).
+
+        inserted are the documents this process wrote to MongoDB; rejected are (document,
+        error message) pairs MongoDB refused for good. Raises if the batch should be retried.
+        """
+        collection = self.get_collection()
+        if collection is None:
+            raise RuntimeError("Database connection is not available.")
+        try:
+            collection.insert_many(batch, ordered=False)
+            return batch, []
+        except BulkWriteError as e:
+            # Unordered: every document without a write error was inserted
+            errors = {error['index']: error for error in e.details.get('writeErrors', [])}
+            if e.details.get('writeConcernErrors'):
+                logger.warning(f"Write-behind flush inserted without the requested write concern: "
+                               f"{e.details['writeConcernErrors']}")
+            inserted, rejected = [], []
+            for index, entry in enumerate(batch):
+                error = errors.get(index)
+                if error is None:
+                    inserted.append(entry)
+                elif error.get('code') == DUPLICATE_KEY_ERROR:
+                    if entry['_id'] in self._maybe_written:
+                        inserted.append(entry) # Written by an earlier attempt that failed as a whole
+                else:
+                    rejected.append((entry, error.get('errmsg', str(error))))
+            return inserted, rejected
+
+    def _dead_letter(self, rejected):
+        """Appends documents MongoDB refused to the dead-letter file, so they stop blocking the queue."""
+        path = os.path.join(self.journal_dir, DEAD_LETTER_NAME)
+        now = datetime.now(timezone.utc)
+        lines = ''.join(json_util.dumps({'check': entry, 'error': message, 'rejected_at': now}) + '\n'
+                        for entry, message in rejected)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        WRITE_BEHIND_DEAD_LETTERED.inc(amount=len(rejected))
+        for entry, message in rejected:
+            logger.error(f"MongoDB refused journaled check {entry['_id']}, moved to {path}: {message}")
+
+    def _run(self):
+        retry = RETRY_INITIAL_SECONDS
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            started = time.perf_counter()
+            try:
+                with self.app.app_context():
+                    inserted, rejected = self._insert(batch)
+            except Exception as e:
+                # Some documents may have been written before the failure
+                self._maybe_written.update(entry['_id'] for entry in batch)
+                WRITE_BEHIND_FAILURES.inc()
+                logger.error(f"Write-behind flush of {len(batch)} check(s) failed, retrying in {retry:.0f}s: {e}")
+                with self._cond:
+                    self._pending[:0] = batch # Keep journal order
+                    self._inflight = 0
+                    self._oldest_queued_at = time.monotonic()
+                time.sleep(retry)
+                retry = min(retry * 2, RETRY_MAX_SECONDS)
+                continue
+            retry = RETRY_INITIAL_SECONDS
+            self._maybe_written.difference_update(entry['_id'] for entry in batch)
+            if rejected:
+                try:
+                    self._dead_letter(rejected)
+                except OSError as e:
+                    logger.error(f"Could not write the dead-letter file ({e}); refused checks: "
+                                 f"{json_util.dumps([entry for entry, _ in rejected])}")
+            WRITE_BEHIND_FLUSH_LATENCY.observe(time.perf_counter() - started)
+            WRITE_BEHIND_FLUSHED.inc(amount=len(inserted))
+
+            with self._cond:
+                self._inflight = 0
+                if not self._pending:
+                    # Everything journaled so far is in MongoDB
+                    self._journal.truncate(0)
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+                elif os.fstat(self._journal.fileno()).st_size >= JOURNAL_COMPACT_BYTES:
+                    try:
+                        self._compact_journal()
+                    except OSError as e:
+                        logger.error(f"Could not compact the write-behind journal {self._journal_path}: {e}")
+                self._cond.notify_all()
+
+            if inserted and self.on_flushed:
+                try:
+                    with self.app.app_context():
+                        self.on_flushed(inserted)
+                except Exception as e:
+                    logger.error(f"Post-insert hook failed after write-behind flush: {e}")
+
+    def close(self, timeout=5.0):
+        """Tries to drain the queue before the process exits; anything left stays journaled."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            while (self._pending or self._inflight) and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            if self._pending or self._inflight:
+                logger.warning(f"Exiting with {len(self._pending) + self._inflight} check(s) still journaled "
+                               f"in {self._journal_path}; they will be replayed on next start.")
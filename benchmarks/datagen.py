@@ -0,0 +1,121 @@
+"""Seeded synthetic pollution check data for benchmarks.
+
+The same seed always produces the same rows, so two benchmark runs compare like with like.
+
+    python -m benchmarks.datagen --rows 1000000 --db-name pollution_bench
+    python -m benchmarks.datagen --rows 1000000 --stations 50
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from app.checks import build_check_entry
+from app.importer import build_price_table
+from app.utils import calculate_expiry_date
+
+IST = pytz.timezone('Asia/Kolkata')
+
+# Registration state codes, weighted towards the states a single station would mostly see
+STATE_CODES = ['AP', 'TS', 'KA', 'TN', 'MH', 'KL', 'OD', 'DL']
+STATE_WEIGHTS = [55, 20, 8, 6, 4, 3, 2, 2]
+
+# Category mix observed at a typical counter
+WHEELS_WEIGHTS = {2: 70, 3: 10, 4: 20}
+DIESEL_SHARE_3_4 = 0.4 # Two wheelers are always petrol
+DURATION_WEIGHTS = {6: 60, 12: 40}
+
+# Relative number of checks per IST hour of day (station open 08:00-20:00, peaks mid-morning and evening)
+HOUR_WEIGHTS = [0] * 8 + [4, 9, 10, 8, 6, 5, 6, 7, 8, 9, 7, 3] + [0] * 4
+
+
+def random_plate(rng):
+    """Returns a plate such as 'AP21BK4821'."""
+    state = rng.choices(STATE_CODES, STATE_WEIGHTS)[0]
+    series = ''.join(rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ') for _ in range(rng.choice((1, 2))))
+    return f'{state}{rng.randint(1, 39):02d}{series}{rng.randint(1, 9999):04d}'
+
+
+def station_ids(stations):
+    """Returns the ids of `stations` generated stations: 'ST001', 'ST002', ..."""
+    return [f'ST{i:03d}' for i in range(1, stations + 1)]
+
+
+def generate_checks(rows, seed=42, end_date=None, days=365, repeat_share=0.15, schema_options=None, stations=0):
+    """Yields `rows` check documents with IST check times spread over the `days` days before end_date.
+
+    About repeat_share of the checks are for plates seen before, like renewals.
+    schema_options are passed to build_check_entry (see app.checks.schema_options).
+    With stations > 0 every check is recorded at one of that many stations, chosen uniformly.
+    """
+    schema_options = schema_options or {}
+    station_options = [{**schema_options, 'station_id': station_id} for station_id in station_ids(stations)]
+    rng = random.Random(seed)
+    price_table = build_price_table()
+    end_date = end_date or datetime.now(IST).date()
+    first_day = end_date - timedelta(days=days - 1)
+    wheels_values, wheels_weights = zip(*WHEELS_WEIGHTS.items())
+    duration_values, duration_weights = zip(*DURATION_WEIGHTS.items())
+    hours = range(24)
+    plates = []
+
+    for _ in range(rows):
+        if plates and rng.random() < repeat_share:
+            vehicle_no, wheels, vehicle_type = rng.choice(plates)
+        else:
+            wheels = rng.choices(wheels_values, wheels_weights)[0]
+            vehicle_type = 'diesel' if wheels != 2 and rng.random() < DIESEL_SHARE_3_4 else 'petrol'
+            vehicle_no = random_plate(rng)
+            if len(plates) < 100000:
+                plates.append((vehicle_no, wheels, vehicle_type))
+        duration_months = rng.choices(duration_values, duration_weights)[0]
+
+        day = first_day + timedelta(days=rng.randrange(days))
+        check_time_ist = IST.localize(datetime(day.year, day.month, day.day,
+                                               rng.choices(hours, HOUR_WEIGHTS)[0], rng.randrange(60), rng.randrange(60)))
+        # Drawn last, so the rest of the dataset is the same with or without stations
+        options = rng.choice(station_options) if station_options else schema_options
+        yield build_check_entry(vehicle_no, vehicle_type, wheels, duration_months,
+                                price_table[(wheels, duration_months)], check_time_ist,
+                                calculate_expiry_date(check_time_ist, duration_months), **options)
+
+
+def load_checks(collection, rows, seed=42, end_date=None, days=365, batch_size=5000, schema_options=None,
+                stations=0):
+    """Inserts a generated dataset in batches. Returns (rows inserted, seconds taken)."""
+    started = time.perf_counter()
+    batch, inserted = [], 0
+    for entry in generate_checks(rows, seed=seed, end_date=end_date, days=days, schema_options=schema_options,
+                                 stations=stations):
+        batch.append(entry)
+        if len(batch) >= batch_size:
+            inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+            batch = []
+    if batch:
+        inserted += len(collection.insert_many(batch, ordered=False).inserted_ids)
+    return inserted, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=365, help='Days of history the checks are spread over.')
+    parser.add_argument('--stations', type=int, default=0, help='Stations the checks are spread over (0: none).')
+    parser.add_argument('--db-name', default='pollution_bench',
+                        help='Database to drop and reload. Must differ from MONGO_DB_NAME.')
+    args = parser.parse_args()
+
+    from benchmarks.run import open_bench_app, prepare_dataset
+    app, _ = open_bench_app('mongod', args.db_name)
+    with app.app_context():
+        stats = prepare_dataset(app, args.rows, args.seed, datetime.now(IST).date(), args.days,
+                                stations=args.stations)
+    print(f"Loaded {stats['rows']} checks into '{args.db_name}' in {stats['load_seconds']:.1f}s "
+          f"({stats['load_rows_per_sec']:.0f} rows/sec); rollups rebuilt in {stats['rollup_rebuild_seconds']:.1f}s.")
+
+
+if __name__ == '__main__':
+    main()
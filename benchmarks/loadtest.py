@@ -0,0 +1,166 @@
+"""Load test: dashboard requests per second under concurrency, e.g. WSGI (run.py) against ASGI (asgi.py).
+
+    gunicorn -w 2 -k gthread --threads 8 -b 127.0.0.1:5000 run:app
+    uvicorn asgi:app --workers 2 --port 8000
+    python -m benchmarks.loadtest --target wsgi=http://127.0.0.1:5000 --target asgi=http://127.0.0.1:8000
+
+Each of --concurrency simulated users sends requests back to back for --duration seconds:
+report pages (/reports) over random ranges of --ranges days ending in the last --days days,
+so most miss the report cache, plus a --submit-share of entry form submissions (/).
+Submissions are real inserts: point the servers at a throw-away database (MONGO_DB_NAME),
+e.g. one loaded with `python -m benchmarks.datagen`. Give both servers the same number of
+worker processes, and run the load test on other cores than the servers (or another host).
+Use a real mongod on a separate host: the results depend mostly on the database round trip.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from benchmarks.datagen import random_plate
+from benchmarks.run import summarize
+
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise SystemExit("The load test needs httpx: pip install -r benchmarks/requirements.txt") from None
+    return httpx
+
+
+def _report_form(rng, end_date, days, ranges):
+    length = rng.choice(ranges)
+    end = end_date - timedelta(days=rng.randrange(max(1, days - length)))
+    return {'start_date': (end - timedelta(days=length - 1)).isoformat(), 'end_date': end.isoformat()}
+
+
+def _submit_form(rng):
+    wheels = rng.choice(['2', '3', '4'])
+    return {
+        'vehicle_no': random_plate(rng),
+        'vehicle_type': rng.choice(['petrol', 'diesel']) if wheels != '2' else 'petrol',
+        'wheels': wheels,
+        'duration': rng.choice(['six_months', 'one_year']),
+    }
+
+
+async def _user(base_url, rng, deadline, args, samples, errors):
+    """One simulated user: sends the next request as soon as the previous one is answered."""
+    httpx = _httpx()
+    # A client (one keep-alive connection) per user: a pool shared by hundreds of users costs the load generator more CPU than the server
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_connections=1),
+                                 timeout=args.timeout) as client:
+        while time.monotonic() < deadline:
+            if rng.random() < args.submit_share:
+                kind, path, form = 'submit', '/', _submit_form(rng)
+            else:
+                kind, path, form = 'report', '/reports', _report_form(rng, args.end_date, args.days, args.ranges)
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, data=form)
+                ok = response.status_code < 400 # Successful submissions redirect back to the form
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if ok:
+                samples[kind].append(elapsed)
+            else:
+                errors[kind] += 1
+
+
+async def run_level(base_url, concurrency, duration, args):
+    """Runs concurrency users against base_url for duration seconds. Returns throughput and latency."""
+    samples = {'report': [], 'submit': []}
+    errors = {'report': 0, 'submit': 0}
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(_user(base_url, random.Random(args.seed + i), deadline, args, samples, errors)
+                           for i in range(concurrency)))
+    elapsed = time.monotonic() - started
+    completed = sum(len(s) for s in samples.values())
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'requests': completed,
+        'errors': sum(errors.values()),
+        'requests_per_sec': completed / elapsed if elapsed > 0 else 0.0,
+        **{kind: {**summarize(s), 'errors': errors[kind]} for kind, s in samples.items() if s},
+    }
+
+
+def _target(value):
+    name, sep, url = value.partition('=')
+    if not sep or not url.startswith('http'):
+        raise argparse.ArgumentTypeError("use NAME=URL, e.g. asgi=http://127.0.0.1:8000")
+    return name, url.rstrip('/')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', type=_target, action='append', required=True,
+                        help='NAME=URL of a running server; repeat to compare servers.')
+    parser.add_argument('--concurrency', type=lambda s: [int(c) for c in s.split(',')], default=[1, 10, 50, 200],
+                        help='Simultaneous users per level, comma separated.')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds per level.')
+    parser.add_argument('--warmup', type=float, default=3.0, help='Seconds of load before the first level (not recorded).')
+    parser.add_argument('--submit-share', type=float, default=0.1, help='Share of requests that submit a check.')
+    parser.add_argument('--days', type=int, default=365, help='Days of history report ranges are drawn from.')
+    parser.add_argument('--end-date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(),
+                        default=datetime.now(IST).date(), help='Last IST day of the dataset (default: today).')
+    parser.add_argument('--ranges', type=lambda s: [int(d) for d in s.split(',')], default=[1, 7, 30, 90],
+                        help='Report range sizes in days, comma separated.')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds.')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the results JSON here.')
+    args = parser.parse_args()
+    logging.getLogger('httpx').setLevel(logging.WARNING) # One log line per request otherwise
+
+    results = {}
+    for name, url in args.target:
+        print(f"Load testing {name} ({url})...")
+        if args.warmup > 0:
+            asyncio.run(run_level(url, max(args.concurrency), args.warmup, args))
+        results[name] = []
+        for concurrency in args.concurrency:
+            level = asyncio.run(run_level(url, concurrency, args.duration, args))
+            results[name].append(level)
+            print(f"  {concurrency:>4} users: {level['requests_per_sec']:8.1f} req/s, {level['errors']} errors"
+                  + (f", report p95 {level['report']['p95_ms']:.0f} ms" if 'report' in level else ''))
+
+    output = {
+        'meta': {
+            'timestamp': datetime.now(UTC).isoformat(),
+            'targets': dict(args.target),
+            'duration': args.duration,
+            'submit_share': args.submit_share,
+            'ranges': args.ranges,
+            'days': args.days,
+            'end_date': args.end_date.isoformat(),
+        },
+        'results': results,
+    }
+    if len(args.target) > 1:
+        baseline, _ = args.target[0]
+        print(f"\nRequests per second relative to {baseline}:")
+        for name, _ in args.target[1:]:
+            for base_level, level in zip(results[baseline], results[name]):
+                base_rps = base_level['requests_per_sec']
+                ratio = f"{level['requests_per_sec'] / base_rps:.2f}x" if base_rps else 'n/a'
+                print(f"  {name} @ {level['concurrency']:>4} users: {ratio}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
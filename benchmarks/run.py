@@ -0,0 +1,406 @@
+"""Benchmarks check inserts, reports, chart rendering, expiry dates and startup; writes the results as JSON.
+
+    python -m benchmarks.run --rows 1000000 --output before.json
+    python -m benchmarks.run --rows 1000000 --compare before.json
+    python -m benchmarks.run --rows 1000000 --stations 50
+    python -m benchmarks.run --backend mongomock --rows 10000
+
+`mongod` (the default) uses the MONGO_* settings from .env with a separate, throw-away
+database (--db-name, dropped and reloaded on every run). `mongomock` runs against an
+in-memory stand-in (`pip install mongomock`); it needs no server but is only meaningful
+for comparing the Python-side cost of two revisions, not for query performance. It
+cannot evaluate every aggregation operator the app uses ($round, $dateToString with a
+timezone): rollups are built in Python there, and report benchmarks whose queries it
+cannot run are reported as skipped.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pymongo
+import pytz
+
+from benchmarks.datagen import load_checks
+
+IST = pytz.timezone('Asia/Kolkata')
+UTC = pytz.utc
+DEFAULT_RANGES = (1, 7, 30, 90, 365)
+
+
+def summarize(samples):
+    """Returns latency statistics, in milliseconds, of a list of durations in seconds."""
+    ordered = sorted(samples)
+    return {
+        'n': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'min_ms': ordered[0] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def open_bench_app(backend, db_name):
+    """Creates the app against the benchmark database. Returns (app, create_app seconds)."""
+    from app import create_app # Loads .env
+
+    if db_name == os.getenv('MONGO_DB_NAME'):
+        sys.exit(f"Refusing to benchmark against '{db_name}': it is the application database (MONGO_DB_NAME).")
+    os.environ['MONGO_DB_NAME'] = db_name
+
+    test_config = {
+        # Nothing may run in the background while the database is dropped and reloaded
+        'ENSURE_INDEXES_ON_STARTUP': False,
+        'WRITE_BEHIND': False,
+        'REMINDER_SCAN_INTERVAL_MINUTES': 0,
+    }
+    if backend == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("The mongomock backend needs `pip install mongomock`.")
+        client = mongomock.MongoClient()
+        test_config['MONGO_CLIENT_FACTORY'] = lambda **kwargs: client
+        # The stand-in needs no credentials, but the connection manager expects complete settings
+        for name in ('MONGO_IP', 'MONGO_PORT', 'MONGO_USER', 'MONGO_PASS', 'MONGO_AUTH_DB'):
+            os.environ.setdefault(name, 'mongomock' if name != 'MONGO_PORT' else '27017')
+
+    started = time.perf_counter()
+    app = create_app(test_config)
+    return app, time.perf_counter() - started
+
+
+def reset_bench_db(app):
+    """Drops the benchmark database and returns a handle to the now empty database."""
+    db = app.extensions['mongo'].get_database()
+    if db is None:
+        sys.exit("MongoDB is not available. Check the MONGO_* settings in .env.")
+    db.client.drop_database(db.name)
+    return db
+
+
+def build_rollups_in_python(collection, rollup_collection):
+    """Builds the daily rollups from rollup_increments() instead of the rebuild aggregation.
+
+    For the mongomock backend, which cannot evaluate that pipeline. Returns the number of days.
+    """
+    from app.rollups import rollup_increments, ist_day_start_utc
+
+    days = {}
+    for doc in collection.find():
+        day_key, incs = rollup_increments(doc)
+        day_doc = days.setdefault(day_key, {'_id': day_key, 'day_start': ist_day_start_utc(day_key)})
+        for path, value in incs.items(): # e.g. 'hours.09.total_checks'
+            *parents, field = path.split('.')
+            target = day_doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[field] = target.get(field, 0) + value
+    if days:
+        rollup_collection.insert_many(list(days.values()))
+    return len(days)
+
+
+def prepare_dataset(app, rows, seed, end_date, days, stations=0, backend='mongod'):
+    """Loads the seeded dataset, builds its rollups and indexes. Returns load statistics.
+
+    Checks are written in the schema version the app is configured for (CHECK_SCHEMA_VERSION),
+    spread over `stations` stations if given.
+    """
+    from app.checks import schema_options
+    from app.indexes import ensure_indexes, CHECKS_COLLECTION_NAME
+    from app.rollups import rebuild_rollups, ROLLUP_COLLECTION_NAME
+
+    db = reset_bench_db(app)
+    ensure_indexes(db) # Before loading, as in production
+    inserted, load_seconds = load_checks(db[CHECKS_COLLECTION_NAME], rows, seed=seed, end_date=end_date, days=days,
+                                         schema_options=schema_options(app.config), stations=stations)
+
+    start_utc, end_utc = _range_utc(end_date, days)
+    started = time.perf_counter()
+    if backend == 'mongomock':
+        build_rollups_in_python(db[CHECKS_COLLECTION_NAME], db[ROLLUP_COLLECTION_NAME])
+    else:
+        rebuild_rollups(db[CHECKS_COLLECTION_NAME], db[ROLLUP_COLLECTION_NAME], start_utc, end_utc)
+    return {
+        'rows': inserted,
+        'load_seconds': load_seconds,
+        'load_rows_per_sec': inserted / load_seconds if load_seconds else 0.0,
+        'rollup_rebuild_seconds': time.perf_counter() - started,
+    }
+
+
+def bench_import_time(repeat=3):
+    """Seconds to import the app package in a fresh interpreter (module-level work, .env, imports)."""
+    code = 'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)'
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = [float(subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True,
+                                    text=True, check=True).stdout.strip().splitlines()[-1])
+               for _ in range(repeat)]
+    return summarize(samples)
+
+
+def bench_inserts(app, count):
+    """dashboard1 form submissions, end to end through the WSGI stack."""
+    client = app.test_client()
+    samples, failures = [], 0
+    for i in range(count):
+        form = {'vehicle_no': f'BENCH{i:06d}', 'vehicle_type': 'petrol', 'wheels': ('2', '3', '4')[i % 3],
+                'duration': ('six_months', 'one_year')[i % 2]}
+        started = time.perf_counter()
+        response = client.post('/', data=form)
+        samples.append(time.perf_counter() - started)
+        if response.status_code != 302: # Success redirects back to the form
+            failures += 1
+    result = summarize(samples)
+    result.update(failures=failures, per_sec=count / sum(samples))
+    return result
+
+
+def _range_utc(end_date, days):
+    first_day = end_date - timedelta(days=days - 1)
+    return (IST.localize(datetime(first_day.year, first_day.month, first_day.day)).astimezone(UTC),
+            IST.localize(datetime(end_date.year, end_date.month, end_date.day) + timedelta(days=1)).astimezone(UTC))
+
+
+def unsupported(app, query, end_date):
+    """Runs query(start_utc, end_utc) once over the last week. Returns why the backend cannot run it, or None.
+
+    /reports logs query errors instead of failing, so a report the backend cannot
+    evaluate would otherwise be timed as if it had worked.
+    """
+    with app.app_context():
+        try:
+            query(*_range_utc(end_date, 7))
+        except (pymongo.errors.OperationFailure, NotImplementedError) as e:
+            return str(e)
+    return None
+
+
+def _report_queries():
+    from app import get_collection, get_rollup_collection
+    from app.reports import run_report
+    from app.rollups import summarize_rollups
+    from app.stations import run_station_fanout, run_station_report, summarize_rollup_stations
+    return {
+        'rollups': lambda s, e: summarize_rollups(get_rollup_collection(), s, e),
+        'raw': lambda s, e: run_report(get_collection(), s, e),
+        'grouped_rollups': lambda s, e: summarize_rollup_stations(get_rollup_collection(), s, e),
+        'grouped_raw': lambda s, e: run_station_report(get_collection(), s, e),
+        'fanout': lambda s, e: run_station_fanout(get_collection(), s, e),
+    }
+
+
+def bench_reports(app, end_date, ranges, repeat, probe=False):
+    """dashboard2 latency per range size, cold (caches cleared) and warm, for both report sources.
+
+    With probe, sources whose query the backend cannot evaluate are reported as skipped.
+    """
+    from app.cache import REPORT_CACHE
+    from app.utils import CHART_CACHE
+
+    client = app.test_client()
+    results = {}
+    queries = _report_queries()
+    for source, use_rollups in (('rollups', True), ('raw', False)):
+        reason = unsupported(app, queries[source], end_date) if probe else None
+        if reason:
+            print(f"  Skipping {source} reports: the backend cannot run them ({reason}).")
+            results[source] = {'skipped': reason}
+            continue
+        app.config['USE_REPORT_ROLLUPS'] = use_rollups
+        for days in ranges:
+            form = {'start_date': (end_date - timedelta(days=days - 1)).isoformat(), 'end_date': end_date.isoformat()}
+            cold, warm = [], []
+            for _ in range(repeat):
+                REPORT_CACHE.clear()
+                CHART_CACHE.clear()
+                for samples in (cold, warm):
+                    started = time.perf_counter()
+                    response = client.post('/reports', data=form)
+                    samples.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"/reports returned {response.status_code} for {form}")
+            results[f'{source}_{days}d'] = {'cold': summarize(cold), 'warm': summarize(warm)}
+    return results
+
+
+def bench_station_reports(app, end_date, ranges, repeat, probe=False):
+    """dashboard2 latency with the per-station breakdown, cold, per range size and station report mode."""
+    from app.cache import REPORT_CACHE
+    from app.utils import CHART_CACHE
+
+    client = app.test_client()
+    results = {}
+    queries = _report_queries()
+    configured = {name: app.config[name] for name in ('STATION_REPORT_MODE', 'USE_REPORT_ROLLUPS')}
+    modes = (('grouped_rollups', 'grouped', True), ('grouped_raw', 'grouped', False), ('fanout', 'fanout', False))
+    for label, mode, use_rollups in modes:
+        reason = unsupported(app, queries[label], end_date) if probe else None
+        if reason:
+            print(f"  Skipping {label} station reports: the backend cannot run them ({reason}).")
+            results[label] = {'skipped': reason}
+            continue
+        app.config.update(STATION_REPORT_MODE=mode, USE_REPORT_ROLLUPS=use_rollups)
+        for days in ranges:
+            form = {'start_date': (end_date - timedelta(days=days - 1)).isoformat(), 'end_date': end_date.isoformat(),
+                    'by_station': '1'}
+            samples = []
+            for _ in range(repeat):
+                REPORT_CACHE.clear()
+                CHART_CACHE.clear()
+                started = time.perf_counter()
+                response = client.post('/reports', data=form)
+                samples.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise RuntimeError(f"/reports returned {response.status_code} for {form}")
+            results[f'{label}_{days}d'] = summarize(samples)
+    app.config.update(configured)
+    return results
+
+
+def bench_chart_render(app, repeat):
+    """generate_pie_chart time per backend (Matplotlib only if installed)."""
+    from app.utils import generate_pie_chart
+
+    backends = ['svg']
+    try:
+        import matplotlib # noqa: F401
+        backends.append('matplotlib')
+    except ImportError:
+        pass
+
+    results = {}
+    with app.app_context():
+        configured = app.config['CHART_BACKEND']
+        for backend in backends:
+            app.config['CHART_BACKEND'] = backend
+            samples = []
+            for i in range(repeat):
+                data = [120 + i % 7, 30, 55] # Vary the data so nothing can be memoised
+                started = time.perf_counter()
+                generate_pie_chart(data, ['2 Wheeler', '3 Wheeler', '4 Wheeler'], "Checks by Vehicle Wheels",
+                                   ['#66b3ff', '#ffcc99', '#99ff99'])
+                samples.append(time.perf_counter() - started)
+            results[backend] = summarize(samples)
+        app.config['CHART_BACKEND'] = configured
+    return results
+
+
+def bench_expiry_dates(count):
+    """calculate_expiry_date calls per second over a year of IST check times (month ends included)."""
+    from app.utils import calculate_expiry_date
+
+    base = IST.localize(datetime(2024, 1, 1, 10, 30))
+    inputs = [(base + timedelta(hours=7 * i), (6, 12)[i % 2]) for i in range(count)]
+    started = time.perf_counter()
+    for check_time, duration_months in inputs:
+        calculate_expiry_date(check_time, duration_months)
+    seconds = time.perf_counter() - started
+    return {'n': count, 'seconds': seconds, 'per_sec': count / seconds}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(tree, prefix=''):
+    flat = {}
+    for key, value in tree.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Prints the change of every headline number (p50 latencies, throughputs, durations) vs a baseline run."""
+    before, after = _flatten(baseline['results']), _flatten(current['results'])
+    print(f"\nChange vs baseline ({baseline['meta'].get('git_revision')} -> {current['meta'].get('git_revision')}):")
+    for field in ('backend', 'rows', 'seed', 'days', 'stations', 'schema_version'):
+        if baseline['meta'].get(field) != current['meta'].get(field):
+            print(f"  Warning: runs differ in {field} ({baseline['meta'].get(field)} vs {current['meta'].get(field)}).")
+    for key in sorted(after):
+        if key in before and before[key] and key.endswith(('p50_ms', 'per_sec', 'seconds')):
+            change = (after[key] - before[key]) / before[key] * 100
+            print(f"  {key:<45} {before[key]:>12.3f} -> {after[key]:>12.3f}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=('mongod', 'mongomock'), default='mongod')
+    parser.add_argument('--db-name', default='pollution_bench',
+                        help='Benchmark database; dropped and reloaded. Must differ from MONGO_DB_NAME.')
+    parser.add_argument('--rows', type=int, default=10000, help='Size of the seeded dataset (10k to 10M).')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--days', type=int, default=365, help='Days of history the dataset covers.')
+    parser.add_argument('--stations', type=int, default=0,
+                        help='Stations the dataset is spread over; > 0 also times per-station reports.')
+    parser.add_argument('--end-date', type=lambda s: datetime.strptime(s, '%Y-%m-%d').date(),
+                        default=datetime.now(IST).date(), help='Last IST day of the dataset (default: today).')
+    parser.add_argument('--ranges', type=lambda s: [int(d) for d in s.split(',')], default=list(DEFAULT_RANGES),
+                        help='Report range sizes in days, comma separated.')
+    parser.add_argument('--inserts', type=int, default=500, help='dashboard1 submissions to time.')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions per report range.')
+    parser.add_argument('--output', help='Write the results JSON here.')
+    parser.add_argument('--compare', help='Results JSON of a previous run to compare against.')
+    args = parser.parse_args()
+
+    app, create_app_seconds = open_bench_app(args.backend, args.db_name)
+    results = {'startup': {'import': bench_import_time(), 'create_app_seconds': create_app_seconds}}
+    with app.app_context():
+        print(f"Loading {args.rows} seeded checks ({args.backend})...")
+        results['dataset'] = prepare_dataset(app, args.rows, args.seed, args.end_date, args.days,
+                                             stations=args.stations, backend=args.backend)
+    print("Timing dashboard1 inserts...")
+    results['inserts'] = bench_inserts(app, args.inserts)
+    print("Timing dashboard2 reports...")
+    probe = args.backend == 'mongomock'
+    results['reports'] = bench_reports(app, args.end_date, args.ranges, args.repeat, probe=probe)
+    if args.stations:
+        print(f"Timing per-station reports ({args.stations} stations)...")
+        results['station_reports'] = bench_station_reports(app, args.end_date, args.ranges, args.repeat, probe=probe)
+    print("Timing chart rendering and expiry dates...")
+    results['chart_render'] = bench_chart_render(app, repeat=200)
+    results['expiry_dates'] = bench_expiry_dates(100000)
+
+    output = {
+        'meta': {
+            'timestamp': datetime.now(UTC).isoformat(),
+            'git_revision': _git_revision(),
+            'backend': args.backend,
+            'rows': args.rows,
+            'seed': args.seed,
+            'days': args.days,
+            'stations': args.stations,
+            'schema_version': app.config['CHECK_SCHEMA_VERSION'],
+            'end_date': args.end_date.isoformat(),
+            'python': platform.python_version(),
+            'pymongo': pymongo.version,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    print(json.dumps(output, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Fixtures shared by the tests.
+
+Tests run against mongomock, or against a real server if TEST_MONGO_URI is set (each
+test then gets a database of its own, dropped afterwards). Tests needing aggregation
+operators mongomock does not implement are skipped on it.
+"""
+import inspect
+import os
+import uuid
+
+import pytest
+
+
+def _ignore_sort(method):
+    def add(self, *args, sort=None, **kwargs):
+        assert sort is None, "mongomock cannot sort bulk updates"
+        return method(self, *args, **kwargs)
+    return add
+
+
+@pytest.fixture
+def db(monkeypatch):
+    uri = os.getenv('TEST_MONGO_URI')
+    if uri:
+        from pymongo import MongoClient
+        client = MongoClient(uri)
+        name = f'pollution_test_{uuid.uuid4().hex[:8]}'
+        yield client[name]
+        client.drop_database(name)
+        client.close()
+        return
+    mongomock = pytest.importorskip('mongomock')
+    builder = mongomock.collection.BulkOperationBuilder
+    if 'sort' not in inspect.signature(builder.add_update).parameters:
+        # mongomock 4.3 predates the sort option PyMongo 4.9+ passes for every bulk update
+        for name in ('add_update', 'add_replace'):
+            monkeypatch.setattr(builder, name, _ignore_sort(getattr(builder, name)))
+    yield mongomock.MongoClient()['pollution_test']
+
+
+@pytest.fixture
+def require_support():
+    """Calls fn(*args) and skips the test if the database does not implement what it needs."""
+    def run(fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except NotImplementedError as e: # mongomock's answer to operators it lacks
+            pytest.skip(f"Not supported by mongomock: {e}")
+    return run
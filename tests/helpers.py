@@ -0,0 +1,40 @@
+"""Test data shared by the tests."""
+from datetime import datetime
+
+import pytz
+
+from app.checks import build_check_entry
+from app.utils import calculate_expiry_date, get_utc_date_range
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def make_check(vehicle_no, when_ist, wheels=4, vehicle_type='petrol', duration_months=6, price='90.55',
+               station_id=None, schema_version=1):
+    """A stored check document as the entry form writes it; when_ist is a naive IST datetime."""
+    check_time = IST.localize(when_ist)
+    return build_check_entry(vehicle_no, vehicle_type, wheels, duration_months, price, check_time,
+                             calculate_expiry_date(check_time, duration_months),
+                             station_id=station_id, schema_version=schema_version)
+
+
+def ist_range(first_day, last_day):
+    """UTC [start, end) covering the IST days first_day to last_day (YYYY-MM-DD), like the report form."""
+    return get_utc_date_range(first_day, last_day)
+
+
+def sample_checks():
+    """Checks over a few IST days, in both schema versions and with and without stations."""
+    plans = [
+        ('2024-03-04 09:15', 2, 'petrol', 6, '60', 'HYD-1', 1),
+        ('2024-03-04 23:59', 4, 'diesel', 12, '150.1', 'HYD-1', 2),
+        ('2024-03-05 00:00', 3, 'petrol', 6, '90.55', None, 1),
+        ('2024-03-05 05:29', 4, 'petrol', 12, '150.1', 'VJA', 2),  # 23:59 UTC the day before
+        ('2024-03-05 05:30', 3, 'diesel', 6, '90.55', 'VJA', 1),
+        ('2024-03-05 18:45', 2, 'petrol', 12, '60', None, 2),
+        ('2024-03-07 11:00', 4, 'diesel', 6, '150.1', 'HYD-1', 1),
+    ]
+    return [make_check(f'AP{i:02d}X{i:04d}', datetime.strptime(when, '%Y-%m-%d %H:%M'), wheels, vehicle_type,
+                       duration_months, price, station_id, schema_version)
+            for i, (when, wheels, vehicle_type, duration_months, price, station_id, schema_version)
+            in enumerate(plans)]
@@ -0,0 +1,123 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+pytest.importorskip('numpy')
+
+from app import archive as archive_module
+from app.archive import CheckArchive, archive_month
+from app.export import find_checks
+from app.reports import run_report
+from helpers import ist_range, make_check, sample_checks
+
+MONTH = '2024-03'
+
+
+@pytest.fixture
+def collection(db):
+    collection = db['pollution_checks']
+    collection.insert_many(sample_checks())
+    collection.insert_one(make_check('AP09ZZ0001', datetime(2024, 4, 1, 0, 0))) # First minute of April
+    return collection
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return CheckArchive(str(tmp_path))
+
+
+class FailingDeletes:
+    """Passes calls through to a collection, running report on every delete_many and failing the nth."""
+
+    def __init__(self, collection, fail_on, report):
+        self.collection = collection
+        self.fail_on = fail_on
+        self.report = report
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def delete_many(self, query):
+        self.calls += 1
+        self.report()
+        if self.calls == self.fail_on:
+            raise RuntimeError('connection lost')
+        return self.collection.delete_many(query)
+
+
+def _report(collection, archive):
+    return run_report(collection, *ist_range('2024-02-01', '2024-04-30'), archive=archive)
+
+
+def _vehicles(collection, archive):
+    return sorted(check['vehicle_no'] for check in
+                  find_checks(collection, *ist_range('2024-02-01', '2024-04-30'), archive=archive))
+
+
+def test_archived_month_is_moved_and_reports_are_unchanged(collection, archive):
+    report, vehicles = _report(collection, archive), _vehicles(collection, archive)
+
+    assert archive_month(collection, archive, MONTH) == 7
+    assert [check['vehicle_no'] for check in collection.find()] == ['AP09ZZ0001']
+    entry = archive.manifest()['months'][MONTH]
+    assert (entry['rows'], entry['moved'], 'deleted' in entry) == (7, 7, False)
+    assert _report(collection, archive) == report
+    assert _vehicles(collection, archive) == vehicles
+    assert archive.report_counters(*ist_range('2024-03-05', '2024-03-05'))['total_checks'] == 4
+
+
+def test_nothing_is_deleted_if_the_file_does_not_add_up(collection, archive, monkeypatch):
+    monkeypatch.setattr(archive_module, 'run_report_counters', lambda *args: {'total_checks': -1})
+    with pytest.raises(RuntimeError, match='changed while archiving'):
+        archive_month(collection, archive, MONTH)
+    assert collection.count_documents({}) == 8
+    assert archive.manifest() == {'months': {}}
+
+
+def test_interrupted_run_counts_every_check_and_resumes(collection, archive):
+    report = _report(collection, archive)
+    reports = []
+    failing = FailingDeletes(collection, fail_on=3, report=lambda: reports.append(_report(collection, archive)))
+
+    with pytest.raises(RuntimeError, match='connection lost'):
+        archive_month(failing, archive, MONTH, batch_size=3)
+    assert archive.interrupted_months() == [MONTH]
+    assert archive.manifest()['months'][MONTH]['deleted'] == 6
+    assert collection.count_documents({}) == 2
+    reports.append(_report(collection, archive))
+
+    assert archive_month(collection, archive, MONTH, batch_size=3) == 7
+    assert archive.interrupted_months() == []
+    assert collection.count_documents({}) == 1
+    reports.append(_report(collection, archive))
+    assert reports == [report] * 5
+
+
+def test_ids_are_deleted_with_their_stored_type(db, archive):
+    collection = db['pollution_checks']
+    ids = ['a' * 24, 'legacy-7', 42, ObjectId()] # The first is a string that looks like an ObjectId
+    for i, _id in enumerate(ids):
+        collection.insert_one({**make_check(f'AP01AB{i:04d}', datetime(2024, 3, 10, 12, i)), '_id': _id})
+
+    assert archive_month(collection, archive, MONTH, batch_size=2) == 4
+    assert collection.count_documents({}) == 0
+
+
+def test_checks_added_to_an_archived_month_are_merged(collection, archive, tmp_path):
+    archive_month(collection, archive, MONTH)
+    first_file = archive.manifest()['months'][MONTH]['file']
+    collection.insert_one(make_check('AP05LATE01', datetime(2024, 3, 20, 10, 0)))
+    report = _report(collection, archive)
+
+    assert archive_month(collection, archive, MONTH) == 1
+    entry = archive.manifest()['months'][MONTH]
+    assert (entry['rows'], entry['moved']) == (8, 1)
+    assert not (tmp_path / first_file).exists()
+    assert _report(collection, archive) == report
+
+
+def test_open_month_is_refused(collection, archive):
+    with pytest.raises(ValueError):
+        archive_month(collection, archive, MONTH, now=datetime(2024, 3, 31, 12, 0, tzinfo=archive_module.UTC))
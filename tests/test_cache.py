@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import cache, routes
+from app.cache import ReportCache
+from helpers import make_check
+
+NOW = datetime.now(timezone.utc)
+LIVE = (NOW - timedelta(days=7), NOW + timedelta(hours=1))
+CLOSED = (NOW - timedelta(days=60), NOW - timedelta(days=30))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls the monotonic clock the cache expires entries with."""
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_new_checks_invalidate_live_ranges_only():
+    reports = ReportCache()
+    reports.put(*LIVE, {'total_checks': 1})
+    reports.put(*CLOSED, {'total_checks': 2})
+    reports.bump_generation()
+    assert reports.get(*LIVE) is None
+    assert reports.get(*CLOSED) == {'total_checks': 2}
+
+
+def test_result_computed_across_an_invalidation_is_not_stored():
+    reports = ReportCache()
+    version = reports.version()
+    reports.bump_generation() # A check was saved while the report ran
+    reports.put(*LIVE, {'total_checks': 1}, version=version)
+    assert reports.get(*LIVE) is None
+
+    version = reports.version()
+    reports.invalidate_closed()
+    reports.put(*CLOSED, {'total_checks': 2}, version=version)
+    assert reports.get(*CLOSED) is None
+
+    reports.put(*CLOSED, {'total_checks': 3}, version=reports.version())
+    assert reports.get(*CLOSED) == {'total_checks': 3}
+
+
+def test_closed_ranges_are_invalidated_and_expire(clock):
+    reports = ReportCache(live_ttl=30, closed_ttl=3600)
+    reports.put(*CLOSED, {'total_checks': 1})
+    reports.invalidate_closed()
+    assert reports.get(*CLOSED) is None
+
+    reports.put(*CLOSED, {'total_checks': 2})
+    clock[0] += 3599
+    assert reports.get(*CLOSED) == {'total_checks': 2}
+    clock[0] += 2
+    assert reports.get(*CLOSED) is None
+
+
+def test_closed_ttl_zero_never_expires(clock):
+    reports = ReportCache(closed_ttl=0)
+    reports.put(*CLOSED, {'total_checks': 1})
+    clock[0] += 10 ** 9
+    assert reports.get(*CLOSED) == {'total_checks': 1}
+
+
+def test_live_ranges_expire(clock):
+    reports = ReportCache(live_ttl=30)
+    reports.put(*LIVE, {'total_checks': 1})
+    clock[0] += 31
+    assert reports.get(*LIVE) is None
+
+
+def test_saving_a_backdated_check_invalidates_closed_ranges(monkeypatch):
+    reports = ReportCache()
+    monkeypatch.setattr(routes, 'REPORT_CACHE', reports)
+    today = datetime.now(routes.IST).replace(tzinfo=None)
+
+    routes.notify_checks_saved([make_check('AP01AB1234', today)])
+    assert reports.version() == (1, 0)
+    routes.notify_checks_saved([make_check('AP01AB1234', today - timedelta(days=40), schema_version=2)])
+    assert reports.version() == (2, 1)
@@ -0,0 +1,71 @@
+from app.reports import run_report
+from app.rollups import (apply_entries_to_rollups, build_rollup_updates, rebuild_rollups, rollup_increments,
+                         summarize_rollups)
+from helpers import ist_range, sample_checks
+
+
+def _without_zeros(doc):
+    """A rollup document with zero counters (which $inc never writes) and empty groups left out."""
+    result = {}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            value = _without_zeros(value)
+        if value not in (0, {}):
+            result[key] = value
+    return result
+
+
+def _rollups(collection):
+    return {doc['_id']: _without_zeros(doc) for doc in collection.find()}
+
+
+def test_increments_use_ist_days_and_hours():
+    checks = sample_checks()
+    assert rollup_increments(checks[1])[0] == '2024-03-04'
+    day_key, incs = rollup_increments(checks[3]) # 05:29 IST, still 4 March in UTC
+    assert day_key == '2024-03-05'
+    assert incs['hours.05.total_checks'] == 1
+    assert incs['total_sales_paise'] == incs['stations.VJA.total_sales_paise'] == 15010
+    assert incs['type_petrol_3_4'] == 1
+
+
+def test_updates_fold_checks_into_one_upsert_per_day():
+    updates = build_rollup_updates(sample_checks())
+    assert sorted(update._filter['_id'] for update in updates) == ['2024-03-04', '2024-03-05', '2024-03-07']
+
+
+def test_incremental_rollups_match_the_raw_report(db):
+    checks = sample_checks()
+    db['pollution_checks'].insert_many([dict(check) for check in checks])
+    apply_entries_to_rollups(db['daily_rollups'], checks[:3])
+    apply_entries_to_rollups(db['daily_rollups'], checks[3:])
+
+    start, end = ist_range('2024-03-01', '2024-03-31')
+    report = summarize_rollups(db['daily_rollups'], start, end)
+    assert report == run_report(db['pollution_checks'], start, end)
+    assert report['total_checks'] == len(checks)
+    assert summarize_rollups(db['daily_rollups'], *ist_range('2024-03-06', '2024-03-06')) is None
+
+
+def test_incremental_rollups_match_a_rebuild(db, require_support):
+    checks = sample_checks()
+    db['pollution_checks'].insert_many([dict(check) for check in checks])
+    for check in checks:
+        apply_entries_to_rollups(db['incremental'], [check])
+
+    start, end = ist_range('2024-03-01', '2024-03-31')
+    assert require_support(rebuild_rollups, db['pollution_checks'], db['rebuilt'], start, end) == 3
+    assert _rollups(db['rebuilt']) == _rollups(db['incremental'])
+
+
+def test_rebuild_replaces_stale_days_and_removes_empty_ones(db, require_support):
+    checks = sample_checks()
+    db['pollution_checks'].insert_many([dict(check) for check in checks])
+    apply_entries_to_rollups(db['daily_rollups'], checks + checks[:2]) # Counted twice, e.g. a replay
+    start, end = ist_range('2024-03-06', '2024-03-06')
+    db['daily_rollups'].insert_one({'_id': '2024-03-06', 'day_start': start, 'total_checks': 5})
+
+    start, end = ist_range('2024-03-01', '2024-03-31')
+    require_support(rebuild_rollups, db['pollution_checks'], db['daily_rollups'], start, end)
+    assert sorted(_rollups(db['daily_rollups'])) == ['2024-03-04', '2024-03-05', '2024-03-07']
+    assert summarize_rollups(db['daily_rollups'], start, end) == run_report(db['pollution_checks'], start, end)
@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from bson import ObjectId, json_util
+from flask import Flask
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from app import writebehind
+from app.writebehind import DEAD_LETTER_NAME, WriteBehindQueue
+
+
+def _wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _journal_lines(queue):
+    with open(queue._journal_path, encoding='utf-8') as f:
+        return [json_util.loads(line) for line in f]
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(collection, **kwargs):
+        queue = WriteBehindQueue(Flask(__name__), lambda: collection, journal_dir=str(tmp_path), **kwargs)
+        queues.append(queue)
+        return queue
+    yield make
+    for queue in queues:
+        queue.close(timeout=1)
+
+
+class FlakyCollection:
+    """Loses the connection after writing part of the first batch, and refuses documents marked bad
+    the way schema validation would."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.calls = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.calls += 1
+        if self.calls == 1:
+            self.collection.insert_many(documents[:2])
+            raise AutoReconnect('connection reset')
+        errors = []
+        for index, document in enumerate(documents):
+            if document.get('bad'):
+                errors.append({'index': index, 'code': 121, 'errmsg': 'Document failed validation'})
+                continue
+            try:
+                self.collection.insert_one(document)
+            except Exception:
+                errors.append({'index': index, 'code': writebehind.DUPLICATE_KEY_ERROR, 'errmsg': 'E11000'})
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'writeConcernErrors': [],
+                                  'nInserted': len(documents) - len(errors)})
+
+
+def test_orphaned_journal_is_replayed_once(db, tmp_path, make_queue):
+    collection = db['pollution_checks']
+    entries = [{'_id': ObjectId(), 'vehicle_no': f'AP01AB{i:04d}'} for i in range(3)]
+    collection.insert_one(dict(entries[0])) # Reached MongoDB before its process died
+    orphan = tmp_path / 'checks-4242-deadbeef.ndjson'
+    orphan.write_text(''.join(json_util.dumps(entry) + '\n' for entry in entries) + '{"_id": {"$oid"')
+
+    flushed = []
+    queue = make_queue(collection, on_flushed=flushed.extend, max_delay=0.01)
+    queue.ensure_started()
+    _wait_for(lambda: len(flushed) == 2)
+
+    assert not orphan.exists()
+    assert [entry['_id'] for entry in flushed] == [entry['_id'] for entry in entries[1:]]
+    assert collection.count_documents({}) == 3
+    _wait_for(lambda: _journal_lines(queue) == [])
+
+
+def test_partial_failure_is_retried_and_refused_checks_are_dead_lettered(db, tmp_path, make_queue, monkeypatch):
+    monkeypatch.setattr(writebehind, 'RETRY_INITIAL_SECONDS', 0.01)
+    collection = db['pollution_checks']
+    flushed = []
+    queue = make_queue(FlakyCollection(collection), on_flushed=flushed.extend, max_batch=10, max_delay=0.05)
+    for n in range(5):
+        queue.submit({'n': n, 'bad': n == 3})
+    _wait_for(lambda: len(flushed) == 4)
+
+    # The two documents written by the failed attempt count as inserted when their retry hits duplicates
+    assert sorted(entry['n'] for entry in flushed) == [0, 1, 2, 4]
+    assert sorted(doc['n'] for doc in collection.find()) == [0, 1, 2, 4]
+    dead = [json.loads(line) for line in (tmp_path / DEAD_LETTER_NAME).read_text().splitlines()]
+    assert [(line['check']['n'], line['error']) for line in dead] == [(3, 'Document failed validation')]
+    assert queue.depth == 0
+
+
+def test_journal_is_compacted_while_batches_are_pending(db, make_queue, monkeypatch):
+    monkeypatch.setattr(writebehind, 'JOURNAL_COMPACT_BYTES', 1)
+    collection = db['pollution_checks']
+    gate = threading.Semaphore(0)
+    calls = []
+
+    class GatedCollection:
+        def insert_many(self, documents, ordered=True):
+            calls.append(len(documents))
+            gate.acquire()
+            collection.insert_many(documents, ordered=ordered)
+
+    queue = make_queue(GatedCollection(), max_batch=2, max_delay=10)
+    for n in range(6):
+        queue.submit({'n': n})
+    _wait_for(lambda: len(calls) == 1)
+    assert [entry['n'] for entry in _journal_lines(queue)] == [0, 1, 2, 3, 4, 5]
+
+    gate.release()
+    _wait_for(lambda: len(calls) == 2)
+    # Rewritten with the entries not yet in MongoDB, including the batch now in flight
+    assert [entry['n'] for entry in _journal_lines(queue)] == [2, 3, 4, 5]
+
+    gate.release()
+    gate.release()
+    _wait_for(lambda: queue.depth == 0)
+    assert _journal_lines(queue) == []
+    assert collection.count_documents({}) == 6